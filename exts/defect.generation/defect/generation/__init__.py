@@ -13,4 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .extension import *
+import importlib.util
+
+# The CPU tools (job sharding, dry runs) import this package outside of Kit, where the extension cannot be loaded
+if importlib.util.find_spec("omni") is not None:
+    from .extension import *
@@ -0,0 +1,292 @@
+"""
+Throughput autotuner. Runs short calibration bursts of a job over a small grid of resolutions, subframe counts and
+camera counts, measures the frames written per hour and the writer yield of every setting, and recommends the best
+quality setting reaching a target rate. Measurements are cached per scene fingerprint, so settings already measured on
+the same scene and randomization are not rendered again. Jobs with adaptive subframes ignore rt_subframes, the subframe
+axis of the grid is collapsed to the rt_subframes of the job for them.
+
+    python autotune.py <job_file> --kit <kit> --work-dir DIR --target-fph 2000 [--apply tuned_job.json]
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from defect.generation.core.jobs.sharding import ShardedJobRunner, kit_worker_command
+from defect.generation.core.jobs.class_balance import read_class_counts
+from defect.generation.core.jobs.job_files import load_job
+from defect.generation.core.sampling.dry_run import DryRun
+from defect.generation.core.sampling.scene_snapshot import SceneSnapshot
+from defect.generation.core.writer.yield_stats import YieldStats
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "defect.generation", "autotune")
+# Status file written by worker.py in the output directory of a shard
+WORKER_STATUS_FILE = "_worker_status.json"
+
+
+class TuneSetting:
+    """
+    One point of the autotune grid.
+
+    Parameters:
+        resolution (Tuple[int, int]): Resolution of every render product.
+        rt_subframes (int): Subframes per frame.
+        cameras (int): Maximum number of cameras, and render products.
+    """
+
+    def __init__(self, resolution: Sequence[int], rt_subframes: int, cameras: int) -> None:
+        self.resolution = (int(resolution[0]), int(resolution[1]))
+        self.rt_subframes = int(rt_subframes)
+        self.cameras = int(cameras)
+
+    @property
+    def key(self) -> str:
+        return f"{self.resolution[0]}x{self.resolution[1]}_s{self.rt_subframes}_c{self.cameras}"
+
+    @property
+    def quality(self) -> Tuple[int, int, int]:
+        # Settings are compared by resolution first, then subframes, then cameras
+        return (self.resolution[0] * self.resolution[1], self.rt_subframes, self.cameras)
+
+    def apply(self, job: DefectGenerationJob, **update) -> DefectGenerationJob:
+        # Copy of the job rendering with this setting
+        job = job.copy(deep=True, update={"rt_subframes": self.rt_subframes, **update})
+        camera_params = job.domain_randomization_request.camera_domain_randomization_params
+        camera_params.default_render_settings.resolution = self.resolution
+        for render_settings in (camera_params.render_settings or {}).values():
+            render_settings.resolution = self.resolution
+        camera_params.max_render_products = self.cameras
+        return job
+
+
+def create_settings(job: DefectGenerationJob, resolutions: Sequence[Sequence[int]], subframes: Sequence[int],
+                    cameras: Sequence[int]) -> List[TuneSetting]:
+    """
+    Grid of settings of a job, the product of the resolutions, subframe counts and camera counts.
+
+    Parameters:
+        job (DefectGenerationJob): The job to tune.
+        resolutions (Sequence[Sequence[int]]): Resolutions to measure.
+        subframes (Sequence[int]): Subframe counts to measure, not used when the job has adaptive subframes.
+        cameras (Sequence[int]): Camera counts to measure.
+
+    Returns:
+        List[TuneSetting]: The settings.
+    """
+    if job.domain_randomization_request.adaptive_subframe_params.active:
+        # The frames render with their planned subframes, the settings would only differ by an unused rt_subframes
+        logger.warning(f"Adaptive subframes are active, not tuning the subframes {list(subframes)}")
+        subframes = [job.rt_subframes]
+    return [TuneSetting(resolution, rt_subframes, camera_count)
+            for resolution, rt_subframes, camera_count in itertools.product(resolutions, subframes, cameras)]
+
+
+def scene_fingerprint(job: DefectGenerationJob) -> str:
+    # Hash of the stage and of the randomization of a job, without the tuned settings, the frames and the output
+    normalized = TuneSetting((0, 0), 0, 0).apply(job, output_dir="", frames=0, start_frame=0, seed=None, replay_log=None, replay_frames=None,
+                                                  job_start_frame=None, job_frames=None)
+    digest = hashlib.sha1(normalized.json(sort_keys=True).encode())
+    if job.stage_url and os.path.exists(job.stage_url):
+        stat = os.stat(job.stage_url)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def read_burst(output_dir: str) -> Optional[Dict]:
+    # Duration and yield of a finished calibration burst, None if the worker did not finish
+    status_path = os.path.join(output_dir, WORKER_STATUS_FILE)
+    if not os.path.exists(status_path):
+        return None
+    with open(status_path, 'r') as file:
+        status = json.load(file)
+    if status.get("status") != "done":
+        return None
+    reports = []
+    for file_name in sorted(os.listdir(output_dir)):
+        if file_name.startswith("yield_report") and file_name.endswith(".json"):
+            with open(os.path.join(output_dir, file_name), 'r') as file:
+                reports.append(json.load(file))
+    totals = YieldStats.from_reports(reports).summary()["total"]
+    duration = max(status["duration"], 1e-6)
+    return {
+        "duration": duration,
+        "frames": status["frames"],
+        "frames_rendered": totals["frames_rendered"],
+        "frames_written": totals["frames_written"],
+        "frame_yield": totals["frame_yield"],
+        "box_yield": totals["box_yield"],
+        "classes": read_class_counts([output_dir]),
+        # Images written per hour over all render products, the rate the dataset grows at
+        "frames_per_hour": totals["frames_written"] / duration * 3600,
+        "rendered_frames_per_hour": status["frames"] / duration * 3600,
+    }
+
+
+class ThroughputAutotuner:
+    """
+    Calibrate a job over a grid of settings and pick the best quality setting reaching a target rate.
+
+    Parameters:
+        job (DefectGenerationJob): The job to tune.
+        settings (List[TuneSetting]): Grid of settings to measure.
+        work_dir (str): Directory of the calibration bursts.
+        worker_command (List[str]): Command template of a worker, see ShardedJobRunner.
+        burst_frames (int): Frames rendered per setting.
+        cache_dir (str): Directory of the measurements cached per scene fingerprint, None to disable the cache.
+        snapshot (SceneSnapshot): Scene geometry, used to predict the yield of every camera count with a dry run.
+    """
+
+    def __init__(self, job: DefectGenerationJob, settings: List[TuneSetting], work_dir: str, worker_command: List[str],
+                 burst_frames: int = 20, cache_dir: str = DEFAULT_CACHE_DIR, snapshot: SceneSnapshot = None) -> None:
+        self.job = job
+        self.settings = settings
+        self.work_dir = work_dir
+        self.worker_command = worker_command
+        self.burst_frames = burst_frames
+        self.cache_dir = cache_dir
+        self.snapshot = snapshot
+        self.fingerprint = scene_fingerprint(job)
+        self.results: Dict[str, Dict] = {}
+
+    @property
+    def cache_path(self) -> Optional[str]:
+        return os.path.join(self.cache_dir, f"{self.fingerprint}.json") if self.cache_dir else None
+
+    def load_cache(self) -> Dict[str, Dict]:
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, 'r') as file:
+            return json.load(file).get("results", {})
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.cache_path, 'w') as file:
+            json.dump({"fingerprint": self.fingerprint, "stage_url": self.job.stage_url, "results": self.results}, file, indent=4)
+
+    def predict_yields(self) -> Dict[Tuple[Tuple[int, int], int], float]:
+        # Fraction of the camera views predicted to show a defect, per resolution and camera count, from CPU dry runs
+        if self.snapshot is None:
+            return {}
+        predicted = {}
+        for resolution, cameras in sorted({(setting.resolution, setting.cameras) for setting in self.settings}):
+            columns, _ = DryRun(TuneSetting(resolution, 1, cameras).apply(self.job), self.snapshot, self.burst_frames).run()
+            visible = columns.get("camera_visible_defects")
+            if visible is not None and visible.size:
+                predicted[(resolution, cameras)] = float((visible > 0).mean())
+        return predicted
+
+    def measure(self, setting: TuneSetting) -> Optional[Dict]:
+        output_dir = os.path.join(self.work_dir, setting.key)
+        burst_job = setting.apply(self.job, output_dir=output_dir, frames=self.burst_frames)
+        start_time = time.time()
+        ShardedJobRunner(burst_job, 1, output_dir, self.worker_command).run(merge=False)
+        result = read_burst(os.path.join(output_dir, "shard_000"))
+        if result is None:
+            logger.warning(f"Calibration burst {setting.key} failed, see the logs in {output_dir}")
+            return None
+        # Process start up and graph creation, paid once per worker
+        result["overhead"] = time.time() - start_time - result["duration"]
+        result["measured_at"] = time.time()
+        return result
+
+    def run(self) -> Dict[str, Dict]:
+        """
+        Measure every setting of the grid, reusing the cached measurements of the scene.
+
+        Returns:
+            Dict[str, Dict]: Measurement of every setting, by setting key.
+        """
+        cached = self.load_cache()
+        self.results = dict(cached)
+        predicted = self.predict_yields()
+        for setting in self.settings:
+            if setting.key in cached:
+                logger.info(f"Using the cached measurement of {setting.key} for scene {self.fingerprint}")
+            else:
+                result = self.measure(setting)
+                if result is None:
+                    continue
+                self.results[setting.key] = result
+                self.save_cache()
+            self.results[setting.key]["predicted_yield"] = predicted.get((setting.resolution, setting.cameras))
+            logger.info(f"{setting.key}: {self.results[setting.key]['frames_per_hour']:.0f} frames/hour, "
+                           f"frame yield {self.results[setting.key]['frame_yield']:.1%}")
+        self.save_cache()
+        return {setting.key: self.results[setting.key] for setting in self.settings if setting.key in self.results}
+
+    def recommend(self, target_frames_per_hour: float) -> Optional[TuneSetting]:
+        # Best quality setting reaching the target, the fastest one if none does
+        measured = [setting for setting in self.settings if setting.key in self.results]
+        if not measured:
+            return None
+        reaching = [setting for setting in measured if self.results[setting.key]["frames_per_hour"] >= target_frames_per_hour]
+        if reaching:
+            return max(reaching, key=lambda setting: (setting.quality, self.results[setting.key]["frames_per_hour"]))
+        fastest = max(measured, key=lambda setting: self.results[setting.key]["frames_per_hour"])
+        logger.warning(f"No setting reaches {target_frames_per_hour:.0f} frames/hour, the fastest is {fastest.key} "
+                       f"with {self.results[fastest.key]['frames_per_hour']:.0f}")
+        return fastest
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Tune the resolution, subframes and camera count of a job to a target rate")
+    parser.add_argument("job_file", help="DefectGenerationJob json file")
+    parser.add_argument("--kit", required=True, help="Kit executable used to run the calibration bursts")
+    parser.add_argument("--work-dir", required=True, help="Directory of the calibration bursts")
+    parser.add_argument("--target-fph", type=float, required=True, help="Target of written frames per hour")
+    parser.add_argument("--resolutions", type=parse_resolution, nargs="+", default=[(512, 512), (1024, 1024)])
+    parser.add_argument("--subframes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--burst-frames", type=int, default=20, help="Frames rendered per setting")
+    parser.add_argument("--snapshot", help="Scene snapshot, to predict the yield of the camera counts with dry runs")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the measurements cached per scene")
+    parser.add_argument("--no-cache", action="store_true", help="Measure every setting again")
+    parser.add_argument("--apply", help="Write the job with the recommended setting to this file")
+    args = parser.parse_args(argv)
+
+    job = load_job(args.job_file)
+    settings = create_settings(job, args.resolutions, args.subframes, args.cameras)
+    adaptive_subframe_params = job.domain_randomization_request.adaptive_subframe_params
+    autotuner = ThroughputAutotuner(job, settings, args.work_dir, kit_worker_command(args.kit), burst_frames=args.burst_frames,
+                                    cache_dir=None if args.no_cache else args.cache_dir,
+                                    snapshot=SceneSnapshot.load(args.snapshot) if args.snapshot else None)
+    results = autotuner.run()
+
+    if adaptive_subframe_params.active:
+        print(f"Adaptive subframes ({adaptive_subframe_params.min_subframes} to {adaptive_subframe_params.max_subframes} per frame), "
+              f"the subframes were not tuned")
+    print(f"{'setting':<24}{'frames/hour':>14}{'frame yield':>13}{'box yield':>11}{'predicted':>11}")
+    for key, result in results.items():
+        predicted = result.get("predicted_yield")
+        print(f"{key:<24}{result['frames_per_hour']:>14.0f}{result['frame_yield']:>13.1%}{result['box_yield']:>11.1%}"
+              f"{'' if predicted is None else f'{predicted:.1%}':>11}")
+    setting = autotuner.recommend(args.target_fph)
+    if setting is None:
+        logger.error("No calibration burst finished")
+        return 1
+    subframes = "adaptive subframes" if adaptive_subframe_params.active else f"rt_subframes {setting.rt_subframes}"
+    print(f"Recommended: {setting.resolution[0]}x{setting.resolution[1]}, {subframes}, {setting.cameras} cameras")
+    if args.apply:
+        with open(args.apply, 'w') as file:
+            file.write(setting.apply(job).json())
+        print(f"Wrote the tuned job to {args.apply}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
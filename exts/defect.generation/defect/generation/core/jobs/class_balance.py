@@ -0,0 +1,324 @@
+"""
+Class balanced generation. Small defects such as cracks fail the bounding box area check of the writer more often than
+the others, so their classes end up underrepresented. The job is run in rounds of sharded workers and, between rounds,
+the per class box counts of the writers steer the visibility probability of every defect type, and the weights of its
+textures, toward a target class ratio. Frame parameters are sampled before the graph of a round is built, so the
+feedback is applied per round, within the frame budget of the job.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from typing import Dict, List, Tuple
+import numpy as np
+from defect.generation.core.jobs.dataset_merge import LABELS_DIR, _find_frame_files, merge_datasets
+from defect.generation.core.jobs.job_files import load_job
+from defect.generation.core.jobs.sharding import ShardedJobRunner, kit_worker_command
+from defect.generation.core.sampling.frame_parameters import FRAME_PARAMETERS_FILE, FrameParameters
+from defect.generation.core.writer.yield_stats import YieldStats
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest, DefectObject
+from defect.generation.utils.seed_plan import SeedPlan, shard_frame_range
+
+logger = logging.getLogger(__name__)
+
+CLASS_BALANCE_REPORT_FILE = "class_balance.json"
+
+
+def defect_class(defect: DefectObject) -> str:
+    # Class label the writer reports for the boxes of a defect
+    return defect.args.semantic_label.split("_")[0]
+
+
+def read_class_counts(output_dirs: List[str]) -> Dict[str, Dict[str, int]]:
+    # Boxes in and out per class, from the yield reports of all writers of the output directories
+    reports = []
+    for output_dir in output_dirs:
+        for report_path in sorted(glob.glob(os.path.join(output_dir, "yield_report*.json"))):
+            with open(report_path, 'r') as file:
+                reports.append(json.load(file))
+    return YieldStats.from_reports(reports).class_totals()
+
+
+def read_texture_yields(output_dirs: List[str], defect_classes: Dict[str, str]) -> Dict[str, Dict[str, Tuple[float, int]]]:
+    """
+    Attribute the boxes written per frame and class to the textures of the defects of that class shown in the frame.
+
+    Parameters:
+        output_dirs (List[str]): Output directories holding a frame parameter log and the writer labels.
+        defect_classes (Dict[str, str]): Class of every defect, by uuid.
+
+    Returns:
+        Dict[str, Dict[str, Tuple[float, int]]]: (boxes, camera views) of every texture, by defect name then texture file.
+    """
+    yields = {}
+    for output_dir in output_dirs:
+        parameters_path = os.path.join(output_dir, FRAME_PARAMETERS_FILE)
+        if not os.path.exists(parameters_path):
+            continue
+        frame_parameters = FrameParameters.load(parameters_path)
+        # Boxes written per frame and class, summed over the render products
+        boxes: Dict[int, Dict[str, int]] = {}
+        for render_product_dir, kinds in _find_frame_files(output_dir).items():
+            for frame_id, file_names in kinds.get(LABELS_DIR, {}).items():
+                for file_name in file_names:
+                    with open(os.path.join(output_dir, render_product_dir, LABELS_DIR, file_name), 'r') as file:
+                        for box in json.load(file):
+                            frame_boxes = boxes.setdefault(frame_id, {})
+                            frame_boxes[box["ObjectClassName"]] = frame_boxes.get(box["ObjectClassName"], 0) + 1
+
+        views = max(len(frame_parameters.tables.get("render_products") or []), 1)
+        uuids = frame_parameters.tables["defect_uuids"]
+        names = frame_parameters.tables["defect_names"]
+        classes = [defect_classes.get(uuid) for uuid in uuids]
+        shown = frame_parameters.columns["defect_shown"].astype(bool)
+        texture_choices = frame_parameters.columns["defect_texture"]
+        for row, frame_id in enumerate(frame_parameters.frame_ids):
+            frame_boxes = boxes.get(frame_id, {})
+            shown_classes = [classes[index] for index in np.flatnonzero(shown[row])]
+            for index in np.flatnonzero(shown[row]):
+                texture_index = int(texture_choices[row, index])
+                if texture_index < 0 or classes[index] is None:
+                    continue
+                texture = frame_parameters.tables["textures"][names[index]][texture_index]
+                credit = frame_boxes.get(classes[index], 0) / shown_classes.count(classes[index])
+                texture_boxes, texture_views = yields.setdefault(names[index], {}).get(texture, (0.0, 0))
+                yields[names[index]][texture] = (texture_boxes + credit, texture_views + views)
+    return yields
+
+
+class ClassBalancer:
+    """
+    Feedback controller of the class ratio. Every class has a multiplier of the visibility probability of its defects,
+    updated after each round so that the boxes expected from the next round bring the running counts to the target ratio.
+    When the probabilities of underrepresented classes cannot be raised further, the other classes are lowered instead.
+
+    Parameters:
+        targets (Dict[str, float]): Target share of every class, normalized over the given classes.
+        gain (float): Fraction of the correction applied per round, lower values converge slower but more smoothly.
+        min_multiplier (float): Lowest multiplier of a class, so no class disappears from the frames.
+        max_probability (float): Highest visibility probability of a defect.
+        texture_prior (float): Camera views given to the mean yield of a defect type when estimating a texture yield.
+        min_texture_weight (float): Lowest weight of a texture, so every texture still shows up.
+    """
+
+    def __init__(self, targets: Dict[str, float], gain: float = 0.5, min_multiplier: float = 0.05,
+                 max_probability: float = 1.0, texture_prior: float = 20.0, min_texture_weight: float = 0.2) -> None:
+        total = sum(max(target, 0.0) for target in targets.values())
+        if total <= 0:
+            raise ValueError(f"Class targets {targets} must have a positive sum")
+        self.targets = {label: max(target, 0.0) / total for label, target in targets.items()}
+        self.gain = gain
+        self.min_multiplier = min_multiplier
+        self.max_probability = max_probability
+        self.texture_prior = texture_prior
+        self.min_texture_weight = min_texture_weight
+        self.multipliers = {label: 1.0 for label in self.targets}
+        self.counts = {label: 0 for label in self.targets}
+        self.texture_weights: Dict[str, Dict[str, float]] = {}
+
+    def shares(self) -> Dict[str, float]:
+        total = sum(self.counts.values())
+        return {label: count / total if total else 0.0 for label, count in self.counts.items()}
+
+    def apply(self, request: DefectGenerationRequest) -> DefectGenerationRequest:
+        # Copy of the request with the visibility probabilities and texture weights of the next round
+        request = request.copy(deep=True)
+        for prim_defect in request.prim_defects:
+            for defect in prim_defect.defects:
+                label = defect_class(defect)
+                if label in self.multipliers:
+                    probability = defect.args.visibility_probability * self.multipliers[label]
+                    defect.args.visibility_probability = float(min(max(probability, 0.0), self.max_probability))
+        for defect_name, weights in self.texture_weights.items():
+            request.texture_weights[defect_name] = {**request.texture_weights.get(defect_name, {}), **weights}
+        return request
+
+    def record(self, class_counts: Dict[str, Dict[str, int]], frames: int) -> Dict[str, float]:
+        # Add the boxes written by a round to the running counts. Returns the boxes per frame and unit of multiplier of
+        # every class, the response of the class to its multiplier
+        rates = {}
+        for label in self.targets:
+            boxes = class_counts.get(label, {}).get("boxes_out", 0)
+            self.counts[label] += boxes
+            rates[label] = boxes / (self.multipliers[label] * max(frames, 1))
+        return rates
+
+    def update(self, request: DefectGenerationRequest, class_counts: Dict[str, Dict[str, int]], frames: int, next_frames: int,
+               texture_yields: Dict[str, Dict[str, Tuple[float, int]]] = None):
+        """
+        Update the multipliers and texture weights after a round.
+
+        Parameters:
+            request (DefectGenerationRequest): The request of the job, before balancing.
+            class_counts (Dict[str, Dict[str, int]]): Boxes in and out per class written by the round.
+            frames (int): Frames rendered by the round.
+            next_frames (int): Frames of the next round.
+            texture_yields (Dict[str, Dict[str, Tuple[float, int]]]): (boxes, camera views) per texture, see read_texture_yields.
+        """
+        rates = self.record(class_counts, frames)
+        # Boxes every class should add in the next round for the running counts to match the targets
+        expected_total = sum(rates[label] * self.multipliers[label] * next_frames for label in self.targets)
+        total = sum(self.counts.values()) + expected_total
+        multipliers = {}
+        for label, target in self.targets.items():
+            missing = max(target * total - self.counts[label], 0.0)
+            if rates[label] > 0:
+                wanted = missing / (rates[label] * max(next_frames, 1))
+            else:
+                # Nothing written yet, show the class as often as possible
+                wanted = np.inf if target > 0 else self.min_multiplier
+            wanted = min(wanted, self._max_multiplier(request, label))
+            wanted = max(wanted, self.min_multiplier)
+            # Damped update in log space
+            multipliers[label] = float(self.multipliers[label] ** (1 - self.gain) * wanted ** self.gain)
+
+        # Keep the ratios between the classes when some multipliers are capped by the highest probability
+        scale = min(self._max_multiplier(request, label) / multiplier for label, multiplier in multipliers.items())
+        if scale < 1:
+            multipliers = {label: max(multiplier * scale, self.min_multiplier) for label, multiplier in multipliers.items()}
+        self.multipliers = multipliers
+
+        if texture_yields:
+            self._update_texture_weights(request, texture_yields)
+
+    def _max_multiplier(self, request: DefectGenerationRequest, label: str) -> float:
+        # Multiplier raising the least likely defect of the class to the highest probability
+        probabilities = [defect.args.visibility_probability for prim_defect in request.prim_defects
+                         for defect in prim_defect.defects if defect_class(defect) == label]
+        lowest = min(probabilities) if probabilities else 0.0
+        return self.max_probability / lowest if lowest > 0 else 1.0
+
+    def _update_texture_weights(self, request: DefectGenerationRequest, texture_yields: Dict[str, Dict[str, Tuple[float, int]]]):
+        # Favor the textures of an underrepresented class that survive the writer filters, the more underrepresented the
+        # class the stronger, other classes pick their textures uniformly
+        shares = self.shares()
+        classes = {defect.defect_name: defect_class(defect) for prim_defect in request.prim_defects for defect in prim_defect.defects}
+        self.texture_weights = {}
+        for defect_name, textures in texture_yields.items():
+            label = classes.get(defect_name)
+            if label not in self.targets or not self.targets[label]:
+                continue
+            deficit = max(1.0 - shares[label] / self.targets[label], 0.0)
+            total_boxes = sum(boxes for boxes, _ in textures.values())
+            total_views = sum(views for _, views in textures.values())
+            if deficit <= 0 or total_boxes <= 0:
+                continue
+            mean_yield = total_boxes / total_views
+            weights = {}
+            for texture, (boxes, views) in textures.items():
+                texture_yield = (boxes + self.texture_prior * mean_yield) / (views + self.texture_prior)
+                weights[texture] = float(max((texture_yield / mean_yield) ** deficit, self.min_texture_weight))
+            self.texture_weights[defect_name] = weights
+
+    def report(self) -> Dict:
+        return {"targets": self.targets, "counts": dict(self.counts), "shares": self.shares(),
+                "multipliers": dict(self.multipliers), "texture_weights": self.texture_weights}
+
+
+class ClassBalancedJobRunner:
+    """
+    Run a job in rounds of sharded workers, balancing the classes between rounds, then merge all rounds into
+    job.output_dir. The rounds split the frames of the job, so balancing does not add frames.
+
+    Parameters:
+        job (DefectGenerationJob): The job to run.
+        balancer (ClassBalancer): Controller of the class ratio.
+        rounds (int): Number of rounds, more rounds react faster but restart the workers more often.
+        num_shards (int): Number of workers per round.
+        work_dir (str): Directory holding the rounds.
+        worker_command (List[str]): Command template of a worker, see ShardedJobRunner.
+        max_retries (int): Number of times a failed shard is restarted.
+    """
+
+    def __init__(self, job: DefectGenerationJob, balancer: ClassBalancer, rounds: int, num_shards: int, work_dir: str,
+                 worker_command: List[str], max_retries: int = 0, poll_interval: float = 5.0, env: Dict[str, str] = None) -> None:
+        self.job = job
+        self.balancer = balancer
+        self.rounds = rounds
+        self.num_shards = num_shards
+        self.work_dir = work_dir
+        self.worker_command = worker_command
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.env = env
+        self.seed_plan = SeedPlan(job.seed, job.start_frame)
+
+    def run(self) -> Dict[str, int]:
+        """
+        Run all rounds and merge their outputs.
+
+        Returns:
+            Dict[str, int]: Return code of every shard of every round, by shard output directory.
+        """
+        request = self.job.defect_generation_request
+        defect_classes = {defect.uuid: defect_class(defect) for prim_defect in request.prim_defects for defect in prim_defect.iter_defects()}
+        unknown = sorted(set(self.balancer.targets) - set(defect_classes.values()))
+        if unknown:
+            logger.warning(f"No defect of the job has the target classes {unknown}")
+
+        results = {}
+        history = []
+        ranges = [shard_frame_range(self.job.frames, index, self.rounds) for index in range(self.rounds)]
+        ranges = [(start_frame, end_frame) for start_frame, end_frame in ranges if end_frame > start_frame]
+        for index, (start_frame, end_frame) in enumerate(ranges):
+            round_job = self.job.copy(update={
+                "defect_generation_request": self.balancer.apply(request),
+                "output_dir": os.path.join(self.work_dir, f"round_{index:03d}"),
+                "frames": end_frame - start_frame,
+                "start_frame": self.job.start_frame + start_frame,
+                # Every round is a job of its own, with its own request, and draws other frames than the previous rounds
+                "seed": self.seed_plan.seed("class_balance.round", str(index)),
+            })
+            runner = ShardedJobRunner(round_job, self.num_shards, round_job.output_dir, self.worker_command,
+                                      max_retries=self.max_retries, poll_interval=self.poll_interval, env=self.env)
+            round_results = runner.run(merge=False)
+            results.update(round_results)
+            output_dirs = [output_dir for output_dir, code in round_results.items() if code == 0]
+
+            class_counts = read_class_counts(output_dirs)
+            history.append({"round": index, "frames": end_frame - start_frame, "class_counts": class_counts,
+                            "multipliers": dict(self.balancer.multipliers), "texture_weights": self.balancer.texture_weights})
+            if index + 1 < len(ranges):
+                next_frames = ranges[index + 1][1] - ranges[index + 1][0]
+                self.balancer.update(request, class_counts, end_frame - start_frame, next_frames,
+                                     read_texture_yields(output_dirs, defect_classes))
+            else:
+                self.balancer.record(class_counts, end_frame - start_frame)
+            logger.info(f"Round {index}: class shares {self.balancer.shares()}, next multipliers {self.balancer.multipliers}")
+
+        merge_datasets([output_dir for output_dir, code in results.items() if code == 0], self.job.output_dir)
+        with open(os.path.join(self.job.output_dir, CLASS_BALANCE_REPORT_FILE), 'w') as file:
+            json.dump({"rounds": history, "final": self.balancer.report()}, file, indent=4)
+        return results
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run a defect generation job in rounds balancing the defect classes")
+    parser.add_argument("job_file", help="DefectGenerationJob json file")
+    parser.add_argument("--targets", required=True, help="Json file or string of the target share of every class, e.g. '{\"crack\": 1, \"scratch\": 1}'")
+    parser.add_argument("--rounds", type=int, default=4, help="Number of rounds the frames are split into")
+    parser.add_argument("--gain", type=float, default=0.5, help="Fraction of the correction applied per round")
+    parser.add_argument("--shards", type=int, default=1, help="Number of workers per round")
+    parser.add_argument("--work-dir", required=True, help="Directory for the rounds, shard job files, logs and outputs")
+    parser.add_argument("--kit", required=True, help="Kit executable used to run the workers")
+    parser.add_argument("--retries", type=int, default=0, help="Number of times a failed shard is restarted")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.targets):
+        with open(args.targets, 'r') as file:
+            targets = json.load(file)
+    else:
+        targets = json.loads(args.targets)
+    job = load_job(args.job_file)
+    runner = ClassBalancedJobRunner(job, ClassBalancer(targets, gain=args.gain), args.rounds, args.shards, args.work_dir,
+                                    kit_worker_command(args.kit), max_retries=args.retries)
+    results = runner.run()
+    return 0 if all(code == 0 for code in results.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
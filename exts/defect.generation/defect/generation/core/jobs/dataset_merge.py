@@ -0,0 +1,165 @@
+"""
+Merge the BMWWriter outputs of the shards of a job into a single dataset. Frame ids are remapped to contiguous ids in
+shard order, and the segmentation ids, assigned per writer in order of appearance, are remapped to a single class map.
+The frame parameter logs of the shards are merged into one log of the written frames, with the remapped ids.
+
+The dataset is merged into a temporary directory next to the output directory and then moved into it, replacing the
+dataset of an earlier merge, so merging again into the same output directory does not stop on existing files.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Tuple
+import numpy as np
+from defect.generation.core.sampling.frame_parameters import FRAME_PARAMETERS_FILE, FrameParameters
+from defect.generation.core.writer.yield_stats import YieldStats
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = "images"
+LABELS_DIR = os.path.join("labels", "json")
+SEMANTIC_SEGMENTATION_DIR = "semantic_segmentation"
+CLASS_MAP_FILE = "class_map.json"
+YIELD_REPORT_FILE = "yield_report.json"
+
+
+def _find_frame_files(shard_dir: str) -> Dict[str, Dict[str, Dict[int, List[str]]]]:
+    # Files of a shard as {render product dir: {kind dir: {frame id: [file names]}}}, the render product dir is ""
+    # when the writer had a single render product
+    frame_files = {}
+    for root, _, files in os.walk(shard_dir):
+        relative_root = os.path.relpath(root, shard_dir)
+        for kind_dir in (IMAGES_DIR, LABELS_DIR, SEMANTIC_SEGMENTATION_DIR):
+            if relative_root == kind_dir or relative_root.endswith(os.sep + kind_dir):
+                render_product_dir = relative_root[:-len(kind_dir)].rstrip(os.sep)
+                break
+        else:
+            continue
+        kind_files = frame_files.setdefault(render_product_dir, {}).setdefault(kind_dir, {})
+        for file_name in files:
+            frame_id = os.path.splitext(file_name)[0]
+            if not frame_id.isdigit():
+                continue
+            kind_files.setdefault(int(frame_id), []).append(file_name)
+    return frame_files
+
+
+def _remap_segmentation(npy_path: str, json_path: str, class_map: Dict[str, int]) -> Tuple[np.ndarray, Dict[int, Dict]]:
+    # Remap the ids of a segmentation frame to the ids of the global class map
+    with open(json_path, 'r') as file:
+        id_to_labels = json.load(file)
+    id_mapping = {}
+    for key, value in id_to_labels.items():
+        class_name = value['class']
+        if class_name not in class_map:
+            class_map[class_name] = len(class_map)
+        id_mapping[int(key)] = class_map[class_name]
+
+    semantic_data = np.load(npy_path)
+    unique_ids, inverse = np.unique(semantic_data, return_inverse=True)
+    lookup = np.array([id_mapping.get(int(id), id) for id in unique_ids], dtype=semantic_data.dtype)
+    return lookup[inverse].reshape(semantic_data.shape), {id_mapping[int(key)]: value for key, value in id_to_labels.items()}
+
+
+def _replace_dataset(merged_dir: str, output_dir: str):
+    # Move the entries of merged_dir into output_dir, replacing the entries of the same name, other entries are kept
+    os.makedirs(output_dir, exist_ok=True)
+    for name in sorted(os.listdir(merged_dir)):
+        target = os.path.join(output_dir, name)
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        elif os.path.lexists(target):
+            os.remove(target)
+        os.replace(os.path.join(merged_dir, name), target)
+
+
+def merge_datasets(shard_dirs: List[str], output_dir: str, move: bool = False) -> Dict[str, int]:
+    """
+    Merge shard output directories into output_dir.
+
+    Parameters:
+        shard_dirs (List[str]): Output directories of the shards, in frame range order.
+        output_dir (str): Directory of the merged dataset.
+        move (bool): Move the files instead of copying them.
+
+    Returns:
+        Dict[str, int]: The consolidated class map, also written to class_map.json in output_dir.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    merged_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(os.path.abspath(output_dir))}.merge_", dir=parent_dir)
+    try:
+        class_map, frame_count = _merge_into(shard_dirs, merged_dir, move)
+        _replace_dataset(merged_dir, output_dir)
+    finally:
+        shutil.rmtree(merged_dir, ignore_errors=True)
+    logger.info(f"Merged {frame_count} frames of {len(shard_dirs)} shards into {output_dir}")
+    return class_map
+
+
+def _merge_into(shard_dirs: List[str], output_dir: str, move: bool) -> Tuple[Dict[str, int], int]:
+    # Merge the shards into the empty directory output_dir, returns the class map and the number of frames
+    transfer = shutil.move if move else shutil.copy2
+    class_map: Dict[str, int] = {}
+    next_frame_id = 0
+    frame_parameters = []
+    for shard_dir in shard_dirs:
+        frame_files = _find_frame_files(shard_dir)
+        # Frames without defects are not written, so the ids of a shard are not contiguous. Frames of different render
+        # products with the same id belong together and keep a common id
+        shard_frame_ids = sorted({frame_id for kinds in frame_files.values() for frames in kinds.values() for frame_id in frames})
+        frame_id_mapping = {frame_id: next_frame_id + index for index, frame_id in enumerate(shard_frame_ids)}
+        next_frame_id += len(shard_frame_ids)
+
+        parameters_path = os.path.join(shard_dir, FRAME_PARAMETERS_FILE)
+        if os.path.exists(parameters_path):
+            shard_parameters = FrameParameters.load(parameters_path)
+            written_frame_ids = [frame_id for frame_id in shard_parameters.frame_ids if frame_id in frame_id_mapping]
+            shard_parameters = shard_parameters.select(written_frame_ids)
+            shard_parameters.columns["frame"] = np.array([frame_id_mapping[frame_id] for frame_id in written_frame_ids], dtype=np.int64)
+            frame_parameters.append(shard_parameters)
+
+        for render_product_dir, kinds in frame_files.items():
+            for kind_dir, frames in kinds.items():
+                source_dir = os.path.join(shard_dir, render_product_dir, kind_dir)
+                target_dir = os.path.join(output_dir, render_product_dir, kind_dir)
+                os.makedirs(target_dir, exist_ok=True)
+                for frame_id, file_names in frames.items():
+                    new_frame_id = frame_id_mapping[frame_id]
+                    if kind_dir == SEMANTIC_SEGMENTATION_DIR:
+                        if f"{frame_id}.npy" not in file_names or f"{frame_id}.json" not in file_names:
+                            logger.warning(f"Skipping incomplete segmentation frame {frame_id} in {source_dir}")
+                            continue
+                        semantic_data, id_to_labels = _remap_segmentation(os.path.join(source_dir, f"{frame_id}.npy"),
+                                                                          os.path.join(source_dir, f"{frame_id}.json"),
+                                                                          class_map)
+                        with open(os.path.join(target_dir, f"{new_frame_id}.npy"), 'xb') as file:
+                            np.save(file, semantic_data)
+                        with open(os.path.join(target_dir, f"{new_frame_id}.json"), 'w') as file:
+                            json.dump(id_to_labels, file)
+                        continue
+                    for file_name in file_names:
+                        extension = os.path.splitext(file_name)[1]
+                        transfer(os.path.join(source_dir, file_name), os.path.join(target_dir, f"{new_frame_id}{extension}"))
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, CLASS_MAP_FILE), 'w') as file:
+        json.dump(class_map, file, indent=4)
+
+    if frame_parameters:
+        FrameParameters.concatenate(frame_parameters).save(os.path.join(output_dir, FRAME_PARAMETERS_FILE))
+
+    # Sum the yield reports of all writers of all shards
+    reports = []
+    for shard_dir in shard_dirs:
+        for report_path in sorted(glob.glob(os.path.join(shard_dir, "yield_report*.json"))):
+            with open(report_path, 'r') as file:
+                reports.append(json.load(file))
+    if reports:
+        yield_stats = YieldStats.from_reports(reports)
+        yield_stats.write_report(os.path.join(output_dir, YIELD_REPORT_FILE))
+        logger.info(yield_stats.format_summary())
+    return class_map, next_frame_id
@@ -0,0 +1,112 @@
+"""
+Loading of job files. Validating the defect args of jobs with tens of thousands of defects takes longer than the rest of
+the job setup, and every shard, autotune burst and class balancing round loads a job again, so validated jobs are
+cached keyed by the hash of the job file and of the defect args schemas they were validated with. The cache stores the
+distinct defect args once and the defects as uuids, counts and indices into them, and is loaded without validating the
+defects again.
+
+The cache is a directory of JSON files written with orjson when it is installed, loading them runs no code, but the
+args they contain are not validated again.
+"""
+import hashlib
+import logging
+import os
+from typing import Dict, Optional
+import pydantic
+from pydantic.json import pydantic_encoder
+from defect.generation.domain.models.defect_args import DEFECT_ARGS_VERSION, defect_args_schema_json, get_defect_args_schema
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+from defect.generation.domain.models.defect_generation_request import DefectObject, PrimDefectObject
+from defect.generation.utils.fast_json import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "defect.generation", "jobs")
+
+
+def job_cache_key(data: bytes) -> str:
+    digest = hashlib.sha1(data)
+    digest.update(f"args:{DEFECT_ARGS_VERSION}:pydantic:{pydantic.VERSION}".encode())
+    # The cached args are not validated again, a changed field or default of a schema must not reuse them
+    digest.update(defect_args_schema_json().encode())
+    return digest.hexdigest()
+
+
+def pack_job(job: DefectGenerationJob) -> Dict:
+    # Compact form of a validated job: the job without its defects, the distinct (defect name, args) of the defects, and
+    # the (prim path, uuids, counts, args indices) of every prim
+    args_indices = {}
+    args_table = []
+    prim_defects = []
+    for prim_defect in job.defect_generation_request.prim_defects:
+        uuids = []
+        counts = []
+        indices = []
+        for defect in prim_defect.defects:
+            values = defect.args.dict()
+            key = (defect.defect_name, json_dumps(values, sort_keys=True))
+            if key not in args_indices:
+                args_indices[key] = len(args_table)
+                args_table.append((defect.defect_name, values))
+            uuids.append(defect.uuid)
+            counts.append(defect.count)
+            indices.append(args_indices[key])
+        prim_defects.append((prim_defect.prim_path, uuids, counts, indices))
+    return {
+        "job": job.dict(exclude={"defect_generation_request": {"prim_defects"}}),
+        "args": args_table,
+        "prim_defects": prim_defects,
+    }
+
+
+def unpack_job(packed: Dict) -> DefectGenerationJob:
+    # Job of pack_job, the defects and their args are created without validation
+    data = packed["job"]
+    data["defect_generation_request"]["prim_defects"] = []
+    job = DefectGenerationJob.parse_obj(data)
+    args_table = [(defect_name, get_defect_args_schema(defect_name).construct(**values)) for defect_name, values in packed["args"]]
+    job.defect_generation_request.prim_defects = [
+        PrimDefectObject.construct(prim_path=prim_path, defects=[
+            DefectObject.construct(defect_name=args_table[index][0], args=args_table[index][1].copy(), uuid=uuid, count=count)
+            for uuid, count, index in zip(uuids, counts, indices)
+        ])
+        for prim_path, uuids, counts, indices in packed["prim_defects"]
+    ]
+    return job
+
+
+def load_job(job_file: str, cache_dir: Optional[str] = DEFAULT_JOB_CACHE_DIR) -> DefectGenerationJob:
+    """
+    Load and validate a job file, or load the job validated from the same file content.
+
+    Parameters:
+        job_file (str): Path of the job JSON file.
+        cache_dir (str): Directory of the validated jobs, None to always validate the file.
+
+    Returns:
+        DefectGenerationJob: The job.
+    """
+    with open(job_file, 'rb') as file:
+        data = file.read()
+    if cache_dir is None:
+        return DefectGenerationJob.parse_raw(data)
+
+    cache_path = os.path.join(cache_dir, f"{job_cache_key(data)}.json")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                return unpack_job(json_loads(file.read()))
+        except Exception as e:
+            logger.warning(f"Could not load the cached job {cache_path}, validating {job_file} again: {e}")
+
+    job = DefectGenerationJob.parse_raw(data)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name first, workers started together may load the same job
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(json_dumps(pack_job(job), default=pydantic_encoder))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache the validated job {job_file}: {e}")
+    return job
@@ -0,0 +1,220 @@
+"""
+Split a defect generation job into frame range shards, run every shard in its own worker process and merge the outputs
+into a single dataset. Workers are external processes started from a command template, so the orchestration can be run
+with local stand-in processes instead of Kit.
+"""
+import argparse
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+from defect.generation.core.jobs.dataset_merge import merge_datasets
+from defect.generation.core.jobs.job_files import load_job
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+from defect.generation.utils.seed_plan import SeedPlan, shard_frame_range
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+EXTENSION_FOLDER = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", ".."))
+
+
+def kit_worker_command(kit_executable: str, ext_folder: str = EXTENSION_FOLDER, extra_args: List[str] = None) -> List[str]:
+    # Command template running the worker script in a headless Kit process, "{job_file}" is replaced per shard
+    return [kit_executable, "--no-window", "--ext-folder", ext_folder,
+            "--enable", "omni.replicator.core", "--enable", "defect.generation",
+            *(extra_args or []),
+            "--exec", f"{WORKER_SCRIPT} {{job_file}}"]
+
+
+class Shard:
+    def __init__(self, index: int, job: DefectGenerationJob, job_file: str) -> None:
+        self.index = index
+        self.job = job
+        self.job_file = job_file
+        self.process: Optional[subprocess.Popen] = None
+        self.attempts = 0
+        self.returncode: Optional[int] = None
+
+    @property
+    def output_dir(self) -> str:
+        return self.job.output_dir
+
+    @property
+    def is_running(self) -> bool:
+        return self.process is not None and self.returncode is None
+
+    def count_written_frames(self) -> int:
+        # Progress of the shard, based on the images written so far
+        count = 0
+        for root, _, files in os.walk(self.output_dir):
+            if os.path.basename(root) == "images":
+                count += len(files)
+        return count
+
+
+class ShardedJobRunner:
+    """
+    Run a job as num_shards workers, each generating a contiguous frame range of the job into its own output directory,
+    then merge the shards into job.output_dir.
+
+    The graph of a shard holds the presampled values of all its frames and defects, so large jobs are split into shards
+    of at most max_shard_frames frames, run num_shards at a time. Every shard only samples the blocks of frames of the
+    job holding its own frames, so the frames do not depend on the number of shards.
+
+    Parameters:
+        job (DefectGenerationJob): The job to run, job.frames frames starting at job.start_frame.
+        num_shards (int): Number of workers.
+        max_shard_frames (int): Most frames of a shard, None to split the job into num_shards shards.
+        work_dir (str): Directory holding the shard job files and outputs.
+        worker_command (List[str]): Command template of a worker, "{job_file}" is replaced by the shard job file.
+        max_retries (int): Number of times a failed shard is restarted (from scratch, seeds make it reproducible).
+        poll_interval (float): Seconds between two checks of the workers.
+    """
+
+    def __init__(self, job: DefectGenerationJob, num_shards: int, work_dir: str, worker_command: List[str],
+                 max_retries: int = 0, poll_interval: float = 5.0, env: Dict[str, str] = None, max_shard_frames: int = None) -> None:
+        self.job = job
+        self.num_shards = num_shards
+        self.max_shard_frames = max_shard_frames
+        self.work_dir = work_dir
+        self.worker_command = worker_command
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.env = env
+        # Draw the job seed once, so every shard derives its seeds from the same job seed
+        self.seed_plan = SeedPlan(job.seed, job.start_frame)
+        self.shards: List[Shard] = []
+
+    def prepare(self) -> List[Shard]:
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.shards = []
+        shard_count = self.num_shards
+        if self.max_shard_frames:
+            shard_count = max(shard_count, math.ceil(self.job.frames / self.max_shard_frames))
+        for index in range(shard_count):
+            start_frame, end_frame = shard_frame_range(self.job.frames, index, shard_count)
+            if end_frame <= start_frame:
+                continue
+            shard_job = self.job.copy(update={
+                "output_dir": os.path.join(self.work_dir, f"shard_{index:03d}"),
+                "frames": end_frame - start_frame,
+                "start_frame": self.job.start_frame + start_frame,
+                "seed": self.seed_plan.job_seed,
+                "job_start_frame": self.job.start_frame if self.job.job_start_frame is None else self.job.job_start_frame,
+                "job_frames": self.job.frames if self.job.job_frames is None else self.job.job_frames,
+            })
+            job_file = os.path.join(self.work_dir, f"shard_{index:03d}.json")
+            with open(job_file, 'w') as file:
+                file.write(shard_job.json())
+            self.shards.append(Shard(index, shard_job, job_file))
+        logger.info(f"Split job of {self.job.frames} frames (seed {self.seed_plan.job_seed}) into {len(self.shards)} shards")
+        return self.shards
+
+    def launch(self, shard: Shard):
+        if os.path.exists(shard.output_dir):
+            shutil.rmtree(shard.output_dir)
+        os.makedirs(shard.output_dir)
+        command = [arg.replace("{job_file}", shard.job_file) for arg in self.worker_command]
+        log_file = open(os.path.join(self.work_dir, f"shard_{shard.index:03d}.log"), 'a')
+        shard.process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=self.env)
+        shard.process.log_file = log_file
+        shard.attempts += 1
+        shard.returncode = None
+        logger.info(f"Started shard {shard.index} (frames {shard.job.start_frame}-{shard.job.start_frame + shard.job.frames - 1}), attempt {shard.attempts}")
+
+    def launch_pending(self) -> bool:
+        # Start the shards not started yet while less than num_shards workers run. Returns True while some are not started
+        running_count = sum(shard.is_running for shard in self.shards)
+        pending = False
+        for shard in self.shards:
+            if shard.process is not None:
+                continue
+            if running_count >= self.num_shards:
+                pending = True
+                continue
+            self.launch(shard)
+            running_count += 1
+        return pending
+
+    def poll(self) -> bool:
+        # Check the workers, restart failed ones and start pending ones. Returns True until all shards are done
+        running = False
+        for shard in self.shards:
+            if not shard.is_running:
+                continue
+            returncode = shard.process.poll()
+            if returncode is None:
+                running = True
+                continue
+            shard.process.log_file.close()
+            shard.returncode = returncode
+            if returncode != 0 and shard.attempts <= self.max_retries:
+                logger.warning(f"Shard {shard.index} failed with code {returncode}, restarting it")
+                self.launch(shard)
+                running = True
+        if self.launch_pending():
+            running = True
+        return running or any(shard.is_running for shard in self.shards)
+
+    def monitor(self):
+        start_time = time.time()
+        while self.poll():
+            written = sum(shard.count_written_frames() for shard in self.shards)
+            elapsed = time.time() - start_time
+            logger.info(f"{written} frames written by {sum(shard.is_running for shard in self.shards)} running workers, "
+                           f"{written / max(elapsed, 1e-6) * 3600:.0f} frames/hour")
+            time.sleep(self.poll_interval)
+
+    def terminate(self):
+        for shard in self.shards:
+            if shard.is_running:
+                shard.process.terminate()
+
+    def run(self, merge: bool = True) -> Dict[str, int]:
+        """
+        Run all shards and merge their outputs.
+
+        Returns:
+            Dict[str, int]: Return code of every shard, by shard output directory.
+        """
+        self.prepare()
+        try:
+            self.launch_pending()
+            self.monitor()
+        except KeyboardInterrupt:
+            self.terminate()
+            raise
+
+        failed = [shard for shard in self.shards if shard.returncode != 0]
+        if failed:
+            logger.error(f"Shards {[shard.index for shard in failed]} failed, see the logs in {self.work_dir}")
+        if merge:
+            merge_datasets([shard.output_dir for shard in self.shards if shard.returncode == 0], self.job.output_dir)
+        return {shard.output_dir: shard.returncode for shard in self.shards}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run a defect generation job split into several worker processes")
+    parser.add_argument("job_file", help="DefectGenerationJob json file")
+    parser.add_argument("--shards", type=int, required=True, help="Number of workers")
+    parser.add_argument("--work-dir", required=True, help="Directory for the shard job files, logs and outputs")
+    parser.add_argument("--kit", required=True, help="Kit executable used to run the workers")
+    parser.add_argument("--retries", type=int, default=0, help="Number of times a failed shard is restarted")
+    parser.add_argument("--max-shard-frames", type=int, default=None, help="Split the job into shards of at most this many frames")
+    args = parser.parse_args(argv)
+
+    job = load_job(args.job_file)
+    runner = ShardedJobRunner(job, args.shards, args.work_dir, kit_worker_command(args.kit), max_retries=args.retries,
+                               max_shard_frames=args.max_shard_frames)
+    results = runner.run()
+    return 0 if all(code == 0 for code in results.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
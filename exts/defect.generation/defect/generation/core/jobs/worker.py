@@ -0,0 +1,110 @@
+"""
+Headless worker running one shard of a defect generation job, launched by the ShardedJobRunner with:
+
+    kit --no-window --enable defect.generation --exec "worker.py <job_file>"
+
+The worker writes a status file in the output directory of the shard and quits Kit when done. Jobs with a replay_log
+render the recorded parameters of the replay_frames again, for example with other render settings or annotators. With
+--snapshot <path>, it only saves the scene snapshot of the job used by CPU dry runs, without rendering.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+import carb
+import omni.kit.app
+import omni.usd
+import omni.replicator.core as rep
+from defect.generation.core.jobs.job_files import load_job
+from defect.generation.core.replicator.layer_key import is_saved_stage
+from defect.generation.core.replicator.replicator_defect import create_defect_layer
+from defect.generation.core.replicator.visibility_precheck import create_scene_snapshot
+from defect.generation.core.sampling.frame_parameters import FrameParameters
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+from defect.generation.utils.helpers import apply_defect_primvars, is_valid_prim
+from defect.generation.utils.replicator_utils import rep_run_frames_async
+
+logger = logging.getLogger(__name__)
+
+STATUS_FILE = "_worker_status.json"
+
+
+def write_status(output_dir: str, status: str, **kwargs):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, STATUS_FILE), 'w') as file:
+        json.dump({"status": status, "time": time.time(), **kwargs}, file)
+
+
+async def open_job_stage(job: DefectGenerationJob):
+    if job.stage_url:
+        await omni.usd.get_context().open_stage_async(job.stage_url)
+
+
+async def run_job(job: DefectGenerationJob):
+    await open_job_stage(job)
+
+    # The layer cache identifies the stage by its files, it cannot be used when the stage has edits besides the primvars
+    layer_cache_dir = job.layer_cache_dir
+    if layer_cache_dir and not is_saved_stage(omni.usd.get_context().get_stage()):
+        carb.log_warn("The stage of the job is not saved, not using the Defect layer cache")
+        layer_cache_dir = None
+
+    # Apply the primvars used by the projections, done by the UI when running interactively
+    for prim_defect in job.defect_generation_request.prim_defects:
+        prim = is_valid_prim(prim_defect.prim_path)
+        if prim is not None:
+            apply_defect_primvars(prim)
+
+    frame_parameters = None
+    if job.replay_log:
+        frame_parameters = FrameParameters.load(job.replay_log)
+        if job.replay_frames is not None:
+            frame_parameters = frame_parameters.select(job.replay_frames)
+
+    _, subframes = create_defect_layer(job.defect_generation_request, job.domain_randomization_request,
+                        frames=job.frames, output_dir=job.output_dir, rt_subframes=job.rt_subframes,
+                        use_seg=job.use_seg, use_bb=job.use_bb, use_bmw=job.use_bmw,
+                        seed=job.seed, start_frame=job.start_frame, frame_parameters=frame_parameters,
+                        layer_cache_dir=layer_cache_dir, job_start_frame=job.job_start_frame, job_frames=job.job_frames)
+    if subframes is not None:
+        await rep_run_frames_async(subframes)
+    else:
+        await rep.orchestrator.run_until_complete_async()
+
+
+async def export_snapshot(job_file: str, snapshot_path: str):
+    job = load_job(job_file)
+    return_code = 0
+    try:
+        await open_job_stage(job)
+        create_scene_snapshot(job.defect_generation_request, job.domain_randomization_request).save(snapshot_path)
+        logger.info(f"Saved the scene snapshot of {job_file} to {snapshot_path}")
+    except Exception as e:
+        carb.log_error(f"Scene snapshot of {job_file} failed: {e}")
+        return_code = 1
+    omni.kit.app.get_app().post_quit(return_code)
+
+
+async def main(job_file: str):
+    job = load_job(job_file)
+    return_code = 0
+    write_status(job.output_dir, "running", start_frame=job.start_frame, frames=job.frames)
+    try:
+        start_time = time.time()
+        await run_job(job)
+        write_status(job.output_dir, "done", start_frame=job.start_frame, frames=job.frames, duration=time.time() - start_time)
+    except Exception as e:
+        carb.log_error(f"Defect generation job {job_file} failed: {e}")
+        write_status(job.output_dir, "failed", start_frame=job.start_frame, frames=job.frames, error=traceback.format_exc())
+        return_code = 1
+    omni.kit.app.get_app().post_quit(return_code)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[2] == "--snapshot":
+        asyncio.ensure_future(export_snapshot(sys.argv[1], sys.argv[3]))
+    else:
+        asyncio.ensure_future(main(sys.argv[1]))
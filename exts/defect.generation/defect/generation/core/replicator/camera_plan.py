@@ -0,0 +1,129 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from defect.generation.domain.models.camera_plan import Bounds, CameraPlan, CameraSpec
+
+logger = logging.getLogger(__name__)
+
+
+def _expand_camera_params(camera_prims, parent_prim_bounds: Dict[str, Bounds]) -> Tuple[List[Tuple[Optional[str], Bounds]], int]:
+    # Turn the (scatter prim, look at) entries of the request into one (scatter prim, look at bounds) pair per camera
+    if not camera_prims:
+        # If no scatter prim or look at prim specified, create a look at for each defect parent prim
+        return [(None, bounds) for bounds in parent_prim_bounds.values()], 0
+
+    expanded = []
+    invalid_count = 0
+    for scatter_prim_path, look_at in camera_prims:
+        scatter_prim_path = scatter_prim_path or None
+        if not look_at:
+            if scatter_prim_path is None:
+                logger.warning("Skipping camera with neither a scatter prim nor a look at")
+                invalid_count += 1
+                continue
+            # Pair the scatter prim with every defect parent prim in the scene
+            expanded.extend((scatter_prim_path, bounds) for bounds in parent_prim_bounds.values())
+        else:
+            expanded.append((scatter_prim_path, look_at))
+    return expanded, invalid_count
+
+
+def _validate_bounds(look_at) -> Optional[Bounds]:
+    try:
+        min_coordinates, max_coordinates = look_at
+        if len(min_coordinates) != 3 or len(max_coordinates) != 3:
+            return None
+        # Order the coordinates, manual look at ranges can be given in any order
+        return (tuple(float(min(a, b)) for a, b in zip(min_coordinates, max_coordinates)),
+                tuple(float(max(a, b)) for a, b in zip(min_coordinates, max_coordinates)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _split_round_robin(items: List, count: int) -> List[List]:
+    return [items[i::count] for i in range(count)]
+
+
+def compile_camera_plan(camera_prims, parent_prim_bounds: Dict[str, Bounds], max_render_products: int = None,
+                        tolerance: float = 1e-3) -> CameraPlan:
+    """
+    Expand, validate and deduplicate the camera parameters of a request before any camera is created.
+    When the number of cameras exceeds max_render_products, the look at targets of cameras sharing a scatter prim
+    are distributed over fewer cameras that cycle through them across frames. Cameras that still do not fit are dropped.
+
+    Parameters:
+        camera_prims: List of (scatter prim path, look at bounds) pairs from CameraDomainRandomizationParameters.
+        parent_prim_bounds (Dict[str, Bounds]): World bounds of each defect parent prim.
+        max_render_products (int): Maximum number of cameras/render products, None for no limit.
+        tolerance (float): Look at bounds closer than this (in stage units) are considered the same viewpoint.
+
+    Returns:
+        CameraPlan: The cameras to create.
+    """
+    expanded, invalid_count = _expand_camera_params(camera_prims, parent_prim_bounds)
+
+    specs: List[Tuple[Optional[str], Bounds]] = []
+    seen = set()
+    duplicate_count = 0
+    for scatter_prim_path, look_at in expanded:
+        bounds = _validate_bounds(look_at)
+        if bounds is None:
+            logger.warning(f"Skipping camera with invalid look at: {look_at}")
+            invalid_count += 1
+            continue
+        key = (scatter_prim_path, tuple(round(value / tolerance) for coordinates in bounds for value in coordinates))
+        if key in seen:
+            duplicate_count += 1
+            continue
+        seen.add(key)
+        specs.append((scatter_prim_path, bounds))
+
+    plan = CameraPlan(duplicate_count=duplicate_count, invalid_count=invalid_count)
+    if max_render_products is None or len(specs) <= max_render_products:
+        plan.cameras = [CameraSpec(scatter_prim_path=path, look_at_bounds=[bounds]) for path, bounds in specs]
+        return plan
+
+    # Cameras scattered around their own look at cannot be merged, cameras sharing a scatter prim can
+    fixed = [(path, bounds) for path, bounds in specs if path is None]
+    groups: Dict[str, List[Bounds]] = {}
+    for path, bounds in specs:
+        if path is not None:
+            groups.setdefault(path, []).append(bounds)
+
+    budget = max(max_render_products, 0)
+    if len(fixed) > budget:
+        plan.over_budget_count += len(fixed) - budget
+        fixed = fixed[:budget]
+    budget -= len(fixed)
+
+    group_items = list(groups.items())
+    if len(group_items) > budget:
+        plan.over_budget_count += sum(len(targets) for _, targets in group_items[budget:])
+        group_items = group_items[:budget]
+
+    # Give every group one camera, then distribute the remaining budget proportionally to the number of targets
+    allocation = {path: 1 for path, _ in group_items}
+    remaining = budget - len(group_items)
+    total_targets = sum(len(targets) for _, targets in group_items)
+    for path, targets in group_items:
+        if total_targets == 0 or remaining <= 0:
+            break
+        extra = min(len(targets) - 1, (remaining * len(targets)) // total_targets)
+        allocation[path] += extra
+    remaining = budget - sum(allocation.values())
+    for path, targets in sorted(group_items, key=lambda item: -len(item[1])):
+        if remaining <= 0:
+            break
+        extra = min(len(targets) - allocation[path], remaining)
+        allocation[path] += extra
+        remaining -= extra
+
+    plan.cameras = [CameraSpec(scatter_prim_path=None, look_at_bounds=[bounds]) for _, bounds in fixed]
+    for path, targets in group_items:
+        for camera_targets in _split_round_robin(targets, allocation[path]):
+            plan.cameras.append(CameraSpec(scatter_prim_path=path, look_at_bounds=camera_targets))
+
+    logger.warning(f"Camera budget of {max_render_products} exceeded by {len(specs)} cameras, "
+                   f"{sum(1 for camera in plan.cameras if camera.is_multiplexed)} cameras cycle through several look at targets, "
+                   f"{plan.over_budget_count} look at targets were dropped")
+    return plan
+
@@ -0,0 +1,158 @@
+"""
+Compiled Defect layers persisted across sessions and workers. The Defect layer built by create_defect_layer holds the
+material copies, projections and cameras of a job, so it is exported as .usdc, keyed by a hash of the requests and of
+the job (see layer_key.defect_layer_key), and loaded instead of rebuilt when a shard of the same job is created on the
+same saved stage.
+
+The base stage is identified by the files of its layers and the defect primvars applied to it, not by its content, so
+the cache is only used on stages opened from saved files with no other unsaved edit, see is_saved_stage. Only the
+scene of the layer is cached: the /Render prims of the render products, annotators and writers and the replicator graph
+with the presampled sequences of the frames are removed from the cached copy. The run loading the layer builds them
+again for its own frames, on the cameras and materials of the layer and the randomizer state stored next to it.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+import carb
+from pxr import Sdf, Usd, UsdRender
+from defect.generation.utils.helpers import DEFECT_PRIMVARS
+from defect.generation.core.replicator.layer_key import DEFECT_LAYER_NAME, base_stage_fingerprint
+
+logger = logging.getLogger(__name__)
+
+LAYER_FILE = "Defect.usdc"
+METADATA_FILE = "layer.json"
+DEFAULT_LAYER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "defect.generation", "layers")
+# Root prim of the render products and of the annotator and writer graphs, and the replicator graph fed with the
+# sequences of the frames, created again by the run that loads a layer
+RENDER_PRIM_PATH = Sdf.Path("/Render")
+GRAPH_PRIM_PATH = Sdf.Path("/Replicator/SDGPipeline")
+
+
+class CompiledDefectLayer:
+    """
+    A Defect layer loaded from the cache.
+
+    Parameters:
+        layer (Sdf.Layer): The Defect layer, inserted in the stage.
+        metadata (Dict): Original materials, randomizer state and cameras of the layer.
+    """
+
+    def __init__(self, layer: Sdf.Layer, metadata: Dict) -> None:
+        self.layer = layer
+        self.metadata = metadata
+
+    @property
+    def original_materials(self) -> Dict:
+        return self.metadata["original_materials"]
+
+    @property
+    def randomizer_state(self) -> Dict:
+        # Arguments of the color and material randomizers, see replicator_defect._register_randomizers
+        return self.metadata["randomizer_state"]
+
+    @property
+    def cameras(self) -> List[str]:
+        # Camera paths, in the order of the camera plan
+        return self.metadata["cameras"]
+
+
+def _render_product_camera(stage: Usd.Stage, render_product_path: str) -> Optional[str]:
+    targets = UsdRender.Product(stage.GetPrimAtPath(render_product_path)).GetCameraRel().GetTargets()
+    return str(targets[0]) if targets else None
+
+
+def save_defect_layer(cache_dir: str, key: str, stage: Usd.Stage, layer: Sdf.Layer, render_list: list, original_materials: Dict,
+                      randomizer_state: Dict, primvar_prim_paths: List[str]) -> Optional[str]:
+    """
+    Export a compiled Defect layer to the cache.
+
+    Parameters:
+        cache_dir (str): Directory of the cached layers.
+        key (str): Key of the layer, see defect_layer_key.
+        stage (Usd.Stage): Stage the layer was built on.
+        layer (Sdf.Layer): The Defect layer.
+        render_list (list): (render product, annotators) pairs of the graph, one per camera of the camera plan.
+        original_materials (Dict): Materials to restore when the layer is removed, returned by create_defect_layer.
+        randomizer_state (Dict): Arguments of the color and material randomizers on the materials of the layer.
+        primvar_prim_paths (List[str]): Prims the defect primvars are applied to.
+
+    Returns:
+        str: Path of the exported layer, None if it could not be exported.
+    """
+    base_stage = base_stage_fingerprint(stage, primvar_prim_paths, DEFECT_PRIMVARS)
+    if base_stage is None:
+        carb.log_warn("Not caching the Defect layer, a layer of the stage is not saved to a file")
+        return None
+    cameras = []
+    for render_product, _ in render_list:
+        render_product_path = str(getattr(render_product, "path", render_product))
+        camera_path = _render_product_camera(stage, render_product_path)
+        if camera_path is None:
+            carb.log_warn(f"Not caching the Defect layer, the camera of {render_product_path} is unknown")
+            return None
+        cameras.append(camera_path)
+
+    layer_dir = os.path.join(cache_dir, key)
+    os.makedirs(layer_dir, exist_ok=True)
+    layer_path = os.path.join(layer_dir, LAYER_FILE)
+    # Copy without the render products, annotators and writers, nor the graph with the sequences of the frames
+    exported_layer = Sdf.Layer.CreateAnonymous(DEFECT_LAYER_NAME)
+    exported_layer.TransferContent(layer)
+    for prim_path in (RENDER_PRIM_PATH, GRAPH_PRIM_PATH):
+        if exported_layer.GetPrimAtPath(prim_path):
+            del exported_layer.GetPrimAtPath(prim_path.GetParentPath()).nameChildren[prim_path.name]
+    if not exported_layer.Export(layer_path):
+        carb.log_warn(f"Could not export the Defect layer to {layer_path}")
+        return None
+    metadata = {
+        "key": key,
+        "base_stage": base_stage,
+        "created": time.time(),
+        "original_materials": original_materials,
+        "randomizer_state": randomizer_state,
+        "cameras": cameras,
+    }
+    # The metadata is written last, a layer without metadata is incomplete
+    with open(os.path.join(layer_dir, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=4)
+    logger.info(f"Cached the Defect layer in {layer_path}")
+    return layer_path
+
+
+def load_defect_layer(cache_dir: str, key: str, stage: Usd.Stage, primvar_prim_paths: List[str]) -> Optional[CompiledDefectLayer]:
+    """
+    Insert a cached Defect layer in the stage, if the base stage did not change since it was compiled.
+
+    Parameters:
+        cache_dir (str): Directory of the cached layers.
+        key (str): Key of the layer, see defect_layer_key.
+        stage (Usd.Stage): Stage to insert the layer in.
+        primvar_prim_paths (List[str]): Prims the defect primvars are applied to.
+
+    Returns:
+        CompiledDefectLayer: The loaded layer, None when it is not cached or is outdated.
+    """
+    layer_dir = os.path.join(cache_dir, key)
+    metadata_path = os.path.join(layer_dir, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, 'r') as file:
+        metadata = json.load(file)
+    base_stage = base_stage_fingerprint(stage, primvar_prim_paths, DEFECT_PRIMVARS)
+    if base_stage is None or metadata.get("base_stage") != base_stage:
+        carb.log_warn(f"The base stage changed since the Defect layer {key} was compiled, rebuilding it")
+        return None
+    cached_layer = Sdf.Layer.FindOrOpen(os.path.join(layer_dir, LAYER_FILE))
+    if cached_layer is None:
+        carb.log_warn(f"Could not open the cached Defect layer {key}, rebuilding it")
+        return None
+
+    # Same anonymous layer as rep.new_layer, so the layer is found and removed by name like a built one
+    layer = Sdf.Layer.CreateAnonymous(DEFECT_LAYER_NAME)
+    layer.TransferContent(cached_layer)
+    stage.GetRootLayer().subLayerPaths.insert(0, layer.identifier)
+    logger.info(f"Loaded the cached Defect layer {key} ({len(metadata['cameras'])} cameras)")
+    return CompiledDefectLayer(layer, metadata)
@@ -0,0 +1,78 @@
+"""
+Keys of the compiled Defect layers and fingerprints of the stages they are built on, see layer_cache. Only the public
+attributes of the stage and of its layers are used, so the keys are computed without Kit.
+"""
+import hashlib
+import json
+import os
+from typing import List, Optional, Sequence
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest
+
+DEFECT_LAYER_NAME = "Defect"
+
+
+def _base_layers(stage) -> list:
+    # Layers the Defect layer is built on: the layer stack, references and payloads, without the session layers and
+    # the Defect layer
+    session_layers = {layer.identifier for layer in stage.GetLayerStack(includeSessionLayers=True)} - \
+                     {layer.identifier for layer in stage.GetLayerStack(includeSessionLayers=False)}
+    layers = [layer for layer in stage.GetUsedLayers(includeClipLayers=False)
+              if layer.identifier not in session_layers and layer.GetDisplayName() != DEFECT_LAYER_NAME]
+    return sorted(layers, key=lambda layer: layer.identifier)
+
+
+def is_saved_stage(stage) -> bool:
+    # True when every layer of the base stage is a saved file without unsaved edits, the stages the cache can be used on
+    return all(not layer.anonymous and not layer.dirty and layer.realPath and os.path.exists(layer.realPath)
+               for layer in _base_layers(stage))
+
+
+def base_stage_fingerprint(stage, primvar_prim_paths: List[str], primvars: Sequence[str]) -> Optional[str]:
+    """
+    Hash of the base stage of a Defect layer: the identifier, size and modification time of the file of every layer,
+    and the defect primvars applied to the prims with defects. The primvars are the only unsaved edits the hash accounts
+    for, the cache must only be used on stages checked with is_saved_stage before the primvars were applied.
+
+    Parameters:
+        stage (Usd.Stage): The stage.
+        primvar_prim_paths (List[str]): Prims the defect primvars are applied to.
+        primvars (Sequence[str]): Names of the defect primvars.
+
+    Returns:
+        str: The hash, None when a layer has no file.
+    """
+    digest = hashlib.sha1()
+    for layer in _base_layers(stage):
+        if layer.anonymous or not layer.realPath or not os.path.exists(layer.realPath):
+            return None
+        stat = os.stat(layer.realPath)
+        digest.update(f"{layer.identifier}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    digest.update(json.dumps({"primvars": list(primvars), "prims": sorted(primvar_prim_paths)}).encode())
+    return digest.hexdigest()
+
+
+def defect_layer_key(defect_generation_request: DefectGenerationRequest, domain_randomization_request: DomainRandomizationRequest,
+                     stage, seed: int, job_start_frame: int, job_frames: int) -> str:
+    """
+    Key of the compiled layer of a job on a stage. The layer holds no frame of the job, so all the shards of a job share
+    it: the key depends on the requests, the seed and the frame range of the whole job, not on the frames of a shard nor
+    on the render arguments. The content of the stage is validated separately when loading, see base_stage_fingerprint.
+
+    Parameters:
+        defect_generation_request (DefectGenerationRequest): The defects of the job.
+        domain_randomization_request (DomainRandomizationRequest): The randomization of the job.
+        stage (Usd.Stage): The stage the layer is built on.
+        seed (int): Seed of the job.
+        job_start_frame (int): First frame of the whole job.
+        job_frames (int): Frames of the whole job.
+
+    Returns:
+        str: The key.
+    """
+    digest = hashlib.sha1()
+    digest.update(defect_generation_request.json(sort_keys=True).encode())
+    digest.update(domain_randomization_request.json(sort_keys=True).encode())
+    digest.update(json.dumps({"seed": seed, "job_start_frame": job_start_frame, "job_frames": job_frames}, sort_keys=True).encode())
+    digest.update(stage.GetRootLayer().identifier.encode())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,130 @@
+"""
+Placement indices of the defect target prims: the area weighted triangle tables, with face normals, that the defect
+positions are drawn from, restricted to a region of the prim. Triangulations are cached per mesh topology hash and
+indices per topology, world vertices and region, so rebuilding the graph of an unchanged scene reuses them.
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Sequence, Tuple
+import carb
+import numpy as np
+from pxr import Usd, UsdGeom
+from defect.generation.core.sampling.geometry import SurfaceSampler
+from defect.generation.domain.models.defect_generation_request import PlacementRegion
+from defect.generation.utils.helpers import get_current_stage
+from defect.generation.utils.mesh_geometry import get_mesh_paths, get_subset_faces, topology_hash, triangle_faces, triangulate
+
+logger = logging.getLogger(__name__)
+
+
+class PlacementIndexCache:
+    """
+    Cache of the placement indices of the target prims, shared by the graph builds of a session.
+
+    Parameters:
+        max_entries (int): Number of placement indices kept, the least recently used ones are dropped first.
+    """
+
+    def __init__(self, max_entries: int = 32) -> None:
+        self.max_entries = max_entries
+        # Topology hash -> (triangles, face index of every triangle)
+        self._triangulations: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._indices: "OrderedDict[str, SurfaceSampler]" = OrderedDict()
+        self.hits = self.misses = 0
+
+    def _triangulate(self, face_vertex_counts: np.ndarray, face_vertex_indices: np.ndarray) -> Tuple[str, np.ndarray, np.ndarray]:
+        topology = topology_hash(face_vertex_counts, face_vertex_indices)
+        if topology not in self._triangulations:
+            self._triangulations[topology] = (triangulate(face_vertex_counts, face_vertex_indices), triangle_faces(face_vertex_counts))
+        self._triangulations.move_to_end(topology)
+        self._evict(self._triangulations)
+        return (topology, *self._triangulations[topology])
+
+    def get_index(self, prim_path: str, region: PlacementRegion = None, viewpoints: Sequence = None,
+                  stage: Usd.Stage = None, time: Usd.TimeCode = Usd.TimeCode.Default()) -> SurfaceSampler:
+        """
+        Get the placement index of the meshes at or under a prim.
+
+        Parameters:
+            prim_path (str): Target prim of the defects.
+            region (PlacementRegion): Faces the defects are placed on, all faces if None.
+            viewpoints (Sequence): (K, 3) points the faces must face when region.visible_only is set.
+            stage (Usd.Stage): Stage of the prim, the current stage if None.
+            time (Usd.TimeCode): Time the points and transforms are read at.
+
+        Returns:
+            SurfaceSampler: Area weighted sampler of the faces of the region.
+        """
+        stage = stage if stage is not None else get_current_stage()
+        region = region if region is not None else PlacementRegion()
+        xform_cache = UsdGeom.XformCache(time)
+        digest = hashlib.sha1()
+        all_vertices, all_triangles, all_masks = [], [], []
+        vertex_offset = 0
+        for mesh_path in get_mesh_paths(prim_path, stage):
+            mesh = UsdGeom.Mesh(stage.GetPrimAtPath(mesh_path))
+            points = mesh.GetPointsAttr().Get(time)
+            face_vertex_counts = mesh.GetFaceVertexCountsAttr().Get(time)
+            face_vertex_indices = mesh.GetFaceVertexIndicesAttr().Get(time)
+            if not points or not face_vertex_counts or not face_vertex_indices:
+                carb.log_warn(f"Skipping mesh without geometry: {mesh_path}")
+                continue
+
+            topology, triangles, faces = self._triangulate(np.array(face_vertex_counts, dtype=np.int64), np.array(face_vertex_indices, dtype=np.int64))
+            # Transform the points to world space, USD matrices are row major and transform row vectors
+            matrix = np.array(xform_cache.GetLocalToWorldTransform(mesh.GetPrim()), dtype=np.float64)
+            vertices = np.array(points, dtype=np.float64) @ matrix[:3, :3] + matrix[3, :3]
+            mask = np.ones(len(triangles), dtype=bool)
+            if region.include_subsets is not None:
+                mask &= np.isin(faces, get_subset_faces(mesh, region.include_subsets, time))
+            if region.exclude_subsets:
+                mask &= ~np.isin(faces, get_subset_faces(mesh, region.exclude_subsets, time))
+
+            digest.update(topology.encode())
+            digest.update(vertices.tobytes())
+            digest.update(np.packbits(mask).tobytes())
+            all_vertices.append(vertices)
+            all_triangles.append(triangles + vertex_offset)
+            all_masks.append(mask)
+            vertex_offset += len(vertices)
+
+        use_viewpoints = region.visible_only and viewpoints is not None and len(viewpoints) > 0
+        if region.visible_only and not use_viewpoints:
+            carb.log_warn(f"No camera scatter region to restrict the defects of {prim_path} to visible faces, using all faces of the region")
+        if use_viewpoints:
+            digest.update(np.asarray(viewpoints, dtype=np.float64).tobytes())
+        key = digest.hexdigest()
+        if key in self._indices:
+            self.hits += 1
+            self._indices.move_to_end(key)
+            return self._indices[key]
+
+        self.misses += 1
+        if not all_vertices:
+            index = SurfaceSampler(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+        else:
+            index = SurfaceSampler(np.concatenate(all_vertices), np.concatenate(all_triangles))
+            face_mask = np.concatenate(all_masks)
+            if use_viewpoints:
+                face_mask &= index.facing_mask(viewpoints)
+            index.set_face_mask(face_mask if not face_mask.all() else None)
+            logger.info(f"Built placement index of {prim_path}: {int(face_mask.sum())}/{len(face_mask)} triangles, area {index.total_area:.4g}")
+        self._indices[key] = index
+        self._evict(self._indices)
+        return index
+
+    def _evict(self, entries: OrderedDict):
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def clear(self):
+        self._triangulations = OrderedDict()
+        self._indices = OrderedDict()
+
+
+_placement_index_cache = PlacementIndexCache()
+
+
+def get_placement_index_cache() -> PlacementIndexCache:
+    return _placement_index_cache
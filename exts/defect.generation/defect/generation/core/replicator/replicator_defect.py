@@ -12,114 +12,164 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from asyncore import loop
 import omni.replicator.core as rep
 import carb
-from defect.generation.utils.helpers import get_textures, get_prim, get_all_children_paths, get_bbox_dimensions, rgba_to_rgb_dict, rgba_to_rgb_list, copy_prim, search_color_properties, create_color_attr
+from defect.generation.utils.helpers import get_textures, get_prim, get_all_children_paths, rgba_to_rgb_dict, rgba_to_rgb_list, copy_prims, get_next_free_paths, search_shader_color_properties, create_color_attr
+from defect.generation.utils.bounds import WorldBoundsCache
 from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest, DefectObject
-from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest, LightDomainRandomizationParameters, CameraDomainRandomizationParameters, ColorDomainRandomizationParameters, MaterialDomainRandomizationParameters
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest, CameraDomainRandomizationParameters, CameraRenderSettings, ColorDomainRandomizationParameters, MaterialDomainRandomizationParameters, VisibilityPrecheckParameters, PreviewSettings
 import logging
 import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 import omni
-import random
+from defect.generation.utils.seed_plan import SeedPlan
 from defect.generation.core.writer.bmw_writer import BMWWriter
+from defect.generation.core.replicator.camera_plan import compile_camera_plan
+from defect.generation.core.replicator.visibility_precheck import (create_camera_tracks, create_defect_placer, create_frame_planner,
+                                                                     write_frame_plan_report)
+from defect.generation.core.sampling.frame_parameters import FRAME_PARAMETERS_FILE, FrameParameters, check_replay, list_defect_textures, sample_frame_range
+from defect.generation.core.sampling.frame_plan import create_block_planner
+from defect.generation.core.sampling.subframes import SUBFRAMES_COLUMN, plan_subframes
+from defect.generation.core.replicator.layer_cache import CompiledDefectLayer, load_defect_layer, save_defect_layer
+from defect.generation.core.replicator.layer_key import defect_layer_key
+from defect.generation.utils.replicator_utils import get_defect_layer
+from defect.generation.core.sampling.visibility import FOCAL_LENGTH, HORIZONTAL_APERTURE, CLIPPING_RANGE
 from pxr import Sdf, UsdShade, Usd, UsdGeom
 
 logger = logging.getLogger(__name__)
 
 def _create_randomizers():
+    # Texture maps by defect texture directory, listed once for all the defects of a type
+    texture_maps = {}
 
-    def move_defect(defect_objet: DefectObject, prim_path: str):
-
-        semantic_label = defect_objet.args.get("semantic_label", "default")
-        rot_x_min = defect_objet.args.get("rot_x_min", 0)
-        rot_x_max = defect_objet.args.get("rot_x_max", 360)
-        rot_y_min = defect_objet.args.get("rot_y_min", 0)
-        rot_y_max = defect_objet.args.get("rot_y_max", 360)
-        rot_z_min = defect_objet.args.get("rot_z_min", 0)
-        rot_z_max = defect_objet.args.get("rot_z_max", 360)
-        dim_h_min = defect_objet.args.get("dim_h_min", 0)
-        dim_h_max = defect_objet.args.get("dim_h_max", 1)
-        dim_w_min = defect_objet.args.get("dim_w_min", 0)
-        dim_w_max = defect_objet.args.get("dim_w_max", 1)
-
+    def move_defect(defect_objet: DefectObject, placement: dict):
+        # Placements presampled by the frame plan
         defects = rep.get.prims(semantics=[('uuid', defect_objet.uuid + '_mesh')])
-        defect_prim = rep.get.prim_at_path(prim_path)
         with defects:
-            #rep.randomizer.scatter_2d(surface_prims=[plane_samp, sphere_samp], check_for_collisions=True)
-            rep.randomizer.scatter_2d(defect_prim, seed=random.randint(0, 999999))
             rep.modify.pose(
-                rotation=rep.distribution.uniform(
-                    (rot_x_min, rot_y_min, rot_z_min), 
-                    (rot_x_max, rot_y_max, rot_z_max)
-                ),
-                scale=rep.distribution.uniform(
-                    (1, dim_h_min,dim_w_min),
-                    (1, dim_h_max, dim_w_max)
-                )
+                position=rep.distribution.sequence(placement["position"]),
+                rotation=rep.distribution.sequence(placement["rotation"]),
+                scale=rep.distribution.sequence(placement["scale"])
             )
-
         return defects.node
-    
-    def change_defect_image(defect_objet: DefectObject, texture_dir: str):
+
+    def change_defect_image(defect_objet: DefectObject, texture_dir: str, visibility: list, texture_indices: list):
         texture_dir = os.path.join(texture_dir, defect_objet.defect_name)
-        diffuse_textures = get_textures(texture_dir, "_D.png")
-        normal_textures = get_textures(texture_dir, "_N.png")
-        roughness_textures = get_textures(texture_dir, "_R.png")
+        if texture_dir not in texture_maps:
+            texture_maps[texture_dir] = tuple(get_textures(texture_dir, suffix) for suffix in ("_D.png", "_N.png", "_R.png"))
+        diffuse_textures, normal_textures, roughness_textures = texture_maps[texture_dir]
 
         projections = rep.get.prims(semantics=[('uuid', defect_objet.uuid + '_projectmat')])
-        seed=random.randint(0, 999999)
         with projections:
+            # Texture indices presampled with the frame parameters, the same index keeps the three maps matched
             rep.modify.projection_material(
-                diffuse=rep.distribution.choice(diffuse_textures,seed=seed),
-                normal=rep.distribution.choice(normal_textures,seed=seed),
-                roughness=rep.distribution.choice(roughness_textures,seed=seed))
-            rep.modify.visibility(rep.distribution.choice([True, False]))
+                diffuse=rep.distribution.sequence([diffuse_textures[index] for index in texture_indices]),
+                normal=rep.distribution.sequence([normal_textures[index] for index in texture_indices]),
+                roughness=rep.distribution.sequence([roughness_textures[index] for index in texture_indices]))
+            rep.modify.visibility(rep.distribution.sequence(visibility))
         return projections.node
 
     rep.randomizer.register(move_defect)
     rep.randomizer.register(change_defect_image)
 
-    def change_light(light_randomization: LightDomainRandomizationParameters):
-        lights = rep.create.light(
-                    light_type="Distant",
-                    color=rep.distribution.uniform(light_randomization.light_color_min_value, light_randomization.light_color_max_value),
-                    intensity=rep.distribution.uniform(light_randomization.light_intensity_min_value, light_randomization.light_intensity_max_value),
-                    position=rep.distribution.uniform(light_randomization.light_position_min_value, light_randomization.light_position_max_value),
-                    scale=rep.distribution.uniform(light_randomization.light_scale_min_value, light_randomization.light_scale_max_value),
-                    rotation =  rep.distribution.uniform(light_randomization.light_rotation_min_value, light_randomization.light_rotation_max_value),
-                    count=light_randomization.light_count,
-                )
+    def change_light(light_sequences: list):
+        # One light per presampled light, with the values of the frame parameters
+        for sequences in light_sequences:
+            lights = rep.create.light(light_type="Distant", **{attribute: rep.distribution.sequence(values) for attribute, values in sequences.items()})
         return lights.node
     rep.randomizer.register(change_light)
 
 
 def _create_camera():
-    camera = rep.create.camera(clipping_range=(0.001, 10000))
+    # Same pinhole parameters as the CPU visibility pre-check
+    camera = rep.create.camera(focal_length=FOCAL_LENGTH, horizontal_aperture=HORIZONTAL_APERTURE, clipping_range=CLIPPING_RANGE)
     logger.warning(f"Creating Camera: {camera}")
     return camera
 
 def _create_camera_randomizer():
-    def change_camera(change_camera_params, prim_defects_path, camera_domain_randomization_params: CameraDomainRandomizationParameters):
+    def change_camera(change_camera_params):
         for camera_option in change_camera_params:
-                camera_randomization_params = camera_option["randomization"]
-                camera = camera_option["camera"]
-                scatter_prim_path, look_at_coordinates = camera_randomization_params
-                if not scatter_prim_path and look_at_coordinates :
-                    logger.warning(f"Routed omni graph to [NO] scatter prim and [YES] look at prim...")
-                    # Create a sphere scatter prim around the look at prim
-                    scatter_prim_path = rep.create.sphere(position=tuple((min_val + max_val) / 2 for min_val, max_val in zip(look_at_coordinates[0], look_at_coordinates[1])), scale=camera_domain_randomization_params.camera_distance_max_value, visible=False)
-                else:
-                    # Using the provided scatter prim and look at prim
-                    logger.warning(f"Routed omni graph to [YES] scatter prim and [YES] look at prim...")
-
-                with camera:
-                    rep.randomizer.scatter_3d(scatter_prim_path, seed=random.randint(0, 999999))
-                    rep.modify.pose(look_at=rep.distribution.uniform(look_at_coordinates[0],look_at_coordinates[1]))
+            # Poses presampled by the frame plan
+            with camera_option["camera"]:
+                rep.modify.pose(position=rep.distribution.sequence(camera_option["plan"]["position"]),
+                                look_at=rep.distribution.sequence(camera_option["plan"]["look_at"]))
 
     rep.randomizer.register(change_camera)
 
 
+def _get_render_settings(camera_domain_randomization_params: CameraDomainRandomizationParameters, scatter_prim_path: str = None, preview: PreviewSettings = None) -> CameraRenderSettings:
+    if preview is not None:
+        # Previews render at low resolution and attach no annotator
+        return CameraRenderSettings(resolution=preview.resolution, annotators=[])
+    render_settings = camera_domain_randomization_params.render_settings or {}
+    return render_settings.get(scatter_prim_path or "", camera_domain_randomization_params.default_render_settings)
+
+def _get_annotators(render_settings: CameraRenderSettings, use_seg: bool, use_bb: bool):
+    if render_settings.annotators is not None:
+        return frozenset(render_settings.annotators)
+    annotators = {"rgb"}
+    if use_bb:
+        annotators.add("bounding_box_2d_tight")
+    if use_seg:
+        annotators.add("semantic_segmentation")
+    return frozenset(annotators)
+
+def _attach_writers(render_products, use_bmw: bool, output_dir: str, semantic_labels, start_frame: int = 0, frame_ids: List[int] = None):
+    """
+    Attach the render products to writers, with one writer per distinct set of annotators so that every render product
+    only gets the annotators that were selected for its camera.
+
+    Parameters:
+        render_products: List of (render product, annotators) pairs.
+        use_bmw (bool): Use the BMWWriter instead of the BasicWriter.
+        output_dir (str): Output directory of the writers.
+        semantic_labels: Defect semantic labels, used by the BMWWriter to filter frames without defects.
+        start_frame (int): Frame id of the first frame written by the BMWWriter, the first frame of the shard for partitioned jobs.
+        frame_ids (List[int]): Frame ids written by the BMWWriter, in order, the recorded ids of the frames when replaying.
+
+    Returns:
+        List of the attached writers.
+    """
+    render_product_groups = {}
+    for render_product, annotators in render_products:
+        render_product_groups.setdefault(annotators, []).append(render_product)
+
+    if use_bmw:
+        rep.WriterRegistry.register(BMWWriter)
+
+    writers = []
+    for idx, (annotators, group) in enumerate(render_product_groups.items()):
+        writer_args = {
+            "rgb": "rgb" in annotators,
+            "bounding_box_2d_tight": "bounding_box_2d_tight" in annotators,
+            "semantic_segmentation": "semantic_segmentation" in annotators,
+        }
+        if use_bmw:
+            writer = rep.WriterRegistry.get("BMWWriter")
+            # Several writers share the output directory, keep every render product in its own folder
+            report_name = "yield_report.json" if len(render_product_groups) == 1 else f"yield_report_{idx}.json"
+            writer.initialize(output_dir=output_dir, defects=semantic_labels, render_product_dirs=len(render_product_groups) > 1, start_frame_id=start_frame, report_name=report_name, frame_ids=frame_ids, **writer_args)
+        else:
+            if frame_ids and frame_ids != list(range(start_frame, start_frame + len(frame_ids))):
+                carb.log_warn("The BasicWriter numbers the frames from 0, replayed frames lose their recorded ids")
+            writer = rep.WriterRegistry.get("BasicWriter")
+            writer_output_dir = output_dir if len(render_product_groups) == 1 else os.path.join(output_dir, f"writer_{idx}")
+            writer.initialize(output_dir=writer_output_dir, **writer_args)
+        logger.info(f"Attaching {len(group)} render products to a writer with annotators {sorted(annotators)}")
+        writer.attach(group)
+        writers.append(writer)
+    return writers
+
+def _get_camera(compiled_layer: Optional[CompiledDefectLayer], camera_idx: int):
+    # The camera_idx-th camera of the camera plan and the camera its render product is created on: a new camera, or the
+    # camera of a cached Defect layer, rendered from its path
+    if compiled_layer is None:
+        camera = _create_camera()
+        return camera, camera
+    camera_path = compiled_layer.cameras[camera_idx]
+    return rep.get.prim_at_path(camera_path), camera_path
+
 def get_original_materials(path):
     """
     Get the original materials bound to mesh prims under a given path in the USD stage. It traverses the stage starting form the given path and collects the materials 
@@ -173,6 +223,8 @@ def get_original_materials(path):
 
 
 def _create_color_randomizer(color_domain_randomization_params): 
+    # Create an OmniPBR material per color of every prim. Returns the original materials and the arguments of
+    # _register_color_randomizer, empty without prim colors
     prim_colors = color_domain_randomization_params.prim_colors
 
     if prim_colors is not None: 
@@ -181,30 +233,30 @@ def _create_color_randomizer(color_domain_randomization_params):
         
         created_materials = {}
         all_original_materials = {}
-        # Create an OmniPBR material with each specified color
+        # Create an OmniPBR material with each specified color, in the order of the colors
         for path in prim_colors: 
                  
             # Get all original materials of all selected prims
             children_path, original_materials, unique_materials = get_original_materials(path)
 
-            colors = prim_colors[path]
-            mats = rep.create.material_omnipbr(diffuse=rep.distribution.choice(colors, with_replacements=False), count=len(colors))
-            for child_path in children_path:
-                created_materials[str(child_path)] = mats
+            material_paths = []
+            for color in prim_colors[path]:
+                mat = rep.create.material_omnipbr(diffuse=color)
+                material_paths.append(str(mat.get_input('primsIn')[0]))
+            created_materials[path] = (children_path, material_paths)
             
             all_original_materials[path] = original_materials
+        return all_original_materials, {"created_materials": created_materials}
+    return {}, {}
 
-        seed=random.randint(0, 999999)
-        def get_colors():
-            for prim_path, mat in created_materials.items():
-                prim = rep.get.prim_at_path(prim_path)
-                # Change the material applied on each prim to change the color
-                with prim:
-                    rep.randomizer.materials(mat, seed=seed)
-            return prim.node
+def _register_color_randomizer(created_materials: Dict[str, Tuple[List[str], List[str]]]):
+    def get_colors(color_choices: dict):
+        for parent_path, (children_path, material_paths) in created_materials.items():
+            # Change the material applied on the prim and its children to change the color
+            chosen_material = rep.distribution.sequence([material_paths[index] for index in color_choices[parent_path]])
+            rep.modify.material(chosen_material, input_prims=children_path)
 
-        rep.randomizer.register(get_colors)
-    return all_original_materials
+    rep.randomizer.register(get_colors)
 
 def _create_texture_color_randomizer(color_domain_randomization_params, material_prims): 
     """
@@ -214,9 +266,9 @@ def _create_texture_color_randomizer(color_domain_randomization_params, material
         color_domain_randomization_params: Parameters that include prim_colors
 
     Returns:
-        Tuple[Dict[str, Dict[str, str]], Dict[str, Dict[str, List[str]]]]:
+        Tuple[Dict[str, Dict[str, str]], Dict]:
             - A dictionary mapping each prim path to its original material.
-            - A dictionary mapping each parent prim path to the new created material paths and the corresponding prim paths that they should be bound to.
+            - The arguments of _register_texture_color_randomizer, created_materials maps each parent prim path to the new created material paths and the corresponding prim paths that they should be bound to.
     """
     prim_colors = color_domain_randomization_params.prim_colors
     stage = omni.usd.get_context().get_stage()
@@ -229,6 +281,8 @@ def _create_texture_color_randomizer(color_domain_randomization_params, material
         material_color_attribute = {}
         color_attribute_name = ""
         texture_colors = prim_colors
+        material_copies = []
+        randomized_children = {}
 
         for path in prim_colors:
             # Check if material_prims is not None and if the current path is in material_prims
@@ -242,65 +296,72 @@ def _create_texture_color_randomizer(color_domain_randomization_params, material
 
             # Get all original materials of all selected prims
             children_path, original_materials, unique_materials = get_original_materials(path)
-            
-            for child_path in children_path:
-
-                # Check if original material exists
-                material_path = original_materials[child_path]
-
-                if material_path is not None:
-                    # Original material exists, Create a copy of the material for each unique material
-                    mat_path = f"/Replicator/Looks/OmniPBR_{mat_idx}"
-                    copy_prim(material_path, mat_path)
-
-                    # Save material color attribute name and type
-                    if mat_path not in material_color_attribute: 
-                        material_color_attribute[mat_path] = []
-                
-                    mat_prim = stage.GetPrimAtPath(material_path).GetChildren()[0]
-                    color_attributes = search_color_properties(mat_prim.GetAttributes())
-                    for attr_name, attr_type in color_attributes.items(): 
-                        create_color_attr(mat_path,attr_name,attr_type)
-                        if attr_type == "float3":
-                            texture_colors[path] = rgba_to_rgb_list(prim_colors[path])
-                        material_color_attribute[mat_path].append(attr_name)
-                else: 
-                    # Original material does not exist, Create a new OmniPBR Material
-                    mat = rep.create.material_omnipbr()                 
-                    mat_path = str(mat.get_input('primsIn')[0])
-                    # OmniPBR Materials have "inputs:diffuse_color_constant" color property, which takes RGB values. 
-                    color_attribute_name = "inputs:diffuse_color_constant"
-                    texture_colors[path] = rgba_to_rgb_list(prim_colors[path])
-                    material_color_attribute[mat_path] = [color_attribute_name]
-                
-                omni_pbr_materials[path][material_path] = mat_path
-                created_materials[path][mat_path] = []
+            randomized_children[path] = children_path
+
+            # Create a single copy of every unique original material of this prim, children sharing a material share its copy
+            for material_path in unique_materials:
+                material_copies.append((path, str(material_path), f"/Replicator/Looks/OmniPBR_{mat_idx}"))
                 mat_idx += 1
 
-            # Store the OmniPBR material paths along with the prim paths that they will be bound to
-            for prim_path in children_path:
-                original_material = original_materials[prim_path]
-                omni_pbr_path = omni_pbr_materials[path][original_material]
-                created_materials[path][omni_pbr_path].append(prim_path)
+            if any(original_materials[child_path] is None for child_path in children_path):
+                # Original material does not exist, Create a new OmniPBR Material shared by all children without material
+                mat = rep.create.material_omnipbr()                 
+                mat_path = str(mat.get_input('primsIn')[0])
+                # OmniPBR Materials have "inputs:diffuse_color_constant" color property, which takes RGB values. 
+                color_attribute_name = "inputs:diffuse_color_constant"
+                texture_colors[path] = rgba_to_rgb_list(prim_colors[path])
+                material_color_attribute[mat_path] = [color_attribute_name]
+                omni_pbr_materials[path][None] = mat_path
 
             all_original_textures[path] = original_materials
 
-        def get_colors():
-            for parent_path in created_materials:
-                seed = random.randint(0, 999999)                        
+        # Create all the material copies in one batch, at the next free paths so that the prims a previous run left under
+        # /Replicator/Looks are not overwritten
+        copy_paths = get_next_free_paths([copy_path for _, _, copy_path in material_copies])
+        for (path, material_path, _), mat_path in zip(material_copies, copy_paths):
+            omni_pbr_materials[path][material_path] = mat_path
+        copy_prims([(material_path, mat_path) for (_, material_path, _), mat_path in zip(material_copies, copy_paths)])
 
-                for material, prim_path in created_materials[parent_path].items():
-                    # Apply the color to each material using the correct color attribute
-                    color_attribute_name = material_color_attribute[material]
-                    mat_prim = rep.get.prim_at_path(str(material))
-                    with mat_prim:
-                        for attr_name in color_attribute_name:
-                            # Get a random color for all prims in the parent_path
-                            chosen_color = rep.distribution.choice(texture_colors[parent_path], seed=seed)
-                            rep.modify.attribute(name=attr_name, value=chosen_color)
+        for path in omni_pbr_materials:
+            for material_path, mat_path in omni_pbr_materials[path].items():
+                created_materials[path][mat_path] = []
+                if material_path is None:
+                    continue
+
+                # Save material color attribute name and type
+                material_color_attribute[mat_path] = []
+                mat_prim = stage.GetPrimAtPath(material_path).GetChildren()[0]
+                color_attributes = search_shader_color_properties(mat_prim)
+                for attr_name, attr_type in color_attributes.items(): 
+                    create_color_attr(mat_path,attr_name,attr_type)
+                    if attr_type == "float3":
+                        texture_colors[path] = rgba_to_rgb_list(prim_colors[path])
+                    material_color_attribute[mat_path].append(attr_name)
 
-        rep.randomizer.register(get_colors)
-        return all_original_textures, created_materials
+            # Store the OmniPBR material paths along with the prim paths that they will be bound to
+            original_materials = all_original_textures[path]
+            for prim_path in randomized_children[path]:
+                omni_pbr_path = omni_pbr_materials[path][original_materials[prim_path]]
+                created_materials[path][omni_pbr_path].append(prim_path)
+        return all_original_textures, {"created_materials": created_materials, "material_color_attribute": material_color_attribute,
+                                       "texture_colors": texture_colors}
+    return {}, {}
+
+def _register_texture_color_randomizer(created_materials: Dict[str, Dict[str, List[str]]], material_color_attribute: Dict[str, List[str]],
+                                       texture_colors: Dict[str, list]):
+    def get_colors(color_choices: dict):
+        for parent_path in created_materials:
+            for material, prim_path in created_materials[parent_path].items():
+                # Apply the color to each material using the correct color attribute
+                color_attribute_name = material_color_attribute[material]
+                mat_prim = rep.get.prim_at_path(str(material))
+                with mat_prim:
+                    for attr_name in color_attribute_name:
+                        # The color of the prims of parent_path in every frame, the same color for all their materials
+                        chosen_color = rep.distribution.sequence([texture_colors[parent_path][index] for index in color_choices[parent_path]])
+                        rep.modify.attribute(name=attr_name, value=chosen_color)
+
+    rep.randomizer.register(get_colors)
 
 def _create_material_randomizer(material_randomization_params, prim_colors):
     """
@@ -312,9 +373,9 @@ def _create_material_randomizer(material_randomization_params, prim_colors):
         prim_colors: Dictionary mapping prim_paths to a list of RGBA colors
 
     Returns:
-        Tuple[Dict[str, Dict[str, str]], Dict[str, Dict[str, List[str]]]]:
+        Tuple[Dict[str, Dict[str, str]], Dict]:
             - A dictionary mapping each prim path to its original material.
-            - A dictionary mapping each parent prim path to the new created material paths and the corresponding prim paths that they should be bound to.
+            - The arguments of _register_material_randomizer, material_options maps each material prim path to the materials it picks from, indexed by the material choices of the frame parameters.
     """
     children_prims = {}
     all_original_materials = {}
@@ -339,20 +400,28 @@ def _create_material_randomizer(material_randomization_params, prim_colors):
                 else: 
                     shader_path = mat_path
                 # Get all attributes from the Shader Prim and search for found color attributes. 
-                material_properties = stage.GetPrimAtPath(shader_path).GetAttributes()
-                change_color_attr = search_color_properties(material_properties)
+                change_color_attr = search_shader_color_properties(stage.GetPrimAtPath(shader_path))
                 material_color_attrs[material_prim].append((str(mat_path), change_color_attr))
 
-    def randomize_materials():
-        for prim_path in material_randomization_params.material_prims:
-            children_paths = children_prims[prim_path]
-            materials_list = created_materials[prim_path]
+    # Materials each prim picks from: with prim colors, only the materials with color attributes
+    material_options = {}
+    for prim_path in material_randomization_params.material_prims:
+        if prim_colors is not None:
+            material_options[prim_path] = [mat_path for mat_path, color_attr in material_color_attrs[prim_path] if color_attr != {}]
+        else:
+            material_options[prim_path] = [str(mat_path) for mat_path in created_materials[prim_path]]
+    return all_original_materials, {"children_prims": children_prims, "material_color_attrs": material_color_attrs, "material_options": material_options}
 
-            materials = []
+def _register_material_randomizer(material_prims: Dict[str, List[str]], prim_colors, children_prims: Dict[str, List[str]],
+                                  material_color_attrs: Dict[str, list], material_options: Dict[str, List[str]]):
+    stage = omni.usd.get_context().get_stage()
+
+    def randomize_materials(material_choices: dict, material_color_choices: dict):
+        for prim_path in material_prims:
+            children_paths = children_prims[prim_path]
             if prim_colors is not None: 
                 # If color material randomization is enabled, get the stored material and color attributes
-                materials_list = material_color_attrs[prim_path]
-                for mat_path, color_attr in materials_list: 
+                for mat_path, color_attr in material_color_attrs[prim_path]: 
                     if color_attr != {}:
                         # If color attributes were found for the material, get the shader path to modify its attributes. 
                         if len(stage.GetPrimAtPath(mat_path).GetChildren())>0:
@@ -366,30 +435,45 @@ def _create_material_randomizer(material_randomization_params, prim_colors):
                         use_rgba = any(attr_type == "float4" for attr_type in color_attr.values())
                         colors = prim_colors if use_rgba else rgba_to_rgb_dict(prim_colors)
                         
-                        # Get a random color from the selected colors and modify the shader's respective attributes. 
-                        seed=random.randint(0, 999999)                        
+                        # Presampled color of the material in every frame, set on all the shader's color attributes
                         for attr_name, attr_type in color_attr.items(): 
-                            chosen_color = rep.distribution.choice(colors[prim_path], seed=seed)
+                            chosen_color = rep.distribution.sequence([colors[prim_path][index] for index in material_color_choices[mat_path]])
                             attr_name = f"inputs:{attr_name}"
                             rep.modify.attribute(name=attr_name, value=chosen_color, input_prims = shader_path)
-                        
-                        # Append material to list of materials that will be used for randomization                   
-                        materials.append(mat_path)
-
                     else: 
                         logger.warning(f'Material {mat_path} has no color attributes.')
-            else: 
-                # If color material randomization is not enabled, get the materials from the created_materials list. 
-                materials = materials_list
-            # Randomly select a material and apply it on the input prim and all its children. 
-            chosen_material = rep.distribution.choice(materials, seed=random.randint(0, 999999))
+            # Apply the presampled material of every frame on the input prim and all its children
+            chosen_material = rep.distribution.sequence([material_options[prim_path][index] for index in material_choices[prim_path]])
             rep.modify.material(chosen_material, input_prims=children_paths)
 
     rep.randomizer.register(randomize_materials)
-    return all_original_materials
+
+def _register_randomizers(domain_randomization_request: DomainRandomizationRequest, randomizer_state: Dict) -> Tuple[Dict, Optional[Dict[str, List[str]]]]:
+    """
+    Register the color and material randomizers on the materials created for them, by a build or by the build of a
+    cached Defect layer.
+
+    Parameters:
+        domain_randomization_request (DomainRandomizationRequest): The randomization of the job.
+        randomizer_state (Dict): Arguments of the register functions by randomizer, returned by the create functions.
+
+    Returns:
+        Tuple[Dict, Dict[str, List[str]]]: The created texture materials and the prims they are bound to, and the
+            materials each material prim picks from, None without material randomization.
+    """
+    if randomizer_state.get("color"):
+        _register_color_randomizer(**randomizer_state["color"])
+    if randomizer_state.get("texture_color"):
+        _register_texture_color_randomizer(**randomizer_state["texture_color"])
+    material_options = None
+    if randomizer_state.get("material"):
+        _register_material_randomizer(domain_randomization_request.material_domain_randomization_params.material_prims,
+                                      domain_randomization_request.color_domain_randomization_params.prim_colors, **randomizer_state["material"])
+        material_options = randomizer_state["material"]["material_options"]
+    return randomizer_state.get("texture_color", {}).get("created_materials", {}), material_options
 
 def _create_defects(defect_objet: DefectObject, prim_path: str):
-    semantic_label = defect_objet.args.get("semantic_label", "default")
+    semantic_label = defect_objet.args.semantic_label
     # Get prim to place defect on
     target_prim = rep.get.prims(path_pattern=prim_path)
     # Create cube for projecting the material
@@ -398,39 +482,94 @@ def _create_defects(defect_objet: DefectObject, prim_path: str):
         rep.create.projection_material(cube, [('class', semantic_label + '_projectmat'),('uuid', defect_objet.uuid + '_projectmat')])
 
 
-def create_defect_layer(defect_generation_request: DefectGenerationRequest, domain_randomization_request :DomainRandomizationRequest, frames: int = 1, output_dir: str = "_defects", rt_subframes: int = 0, use_seg: bool = False, use_bb: bool = True, use_bmw: bool =True):
+def _subframe_plan(frame_parameters: FrameParameters) -> Optional[List[int]]:
+    # Subframes of every frame planned with adaptive subframes, None when the run uses a fixed count
+    subframes = frame_parameters.columns.get(SUBFRAMES_COLUMN)
+    return subframes.tolist() if subframes is not None else None
+
+def create_defect_layer(defect_generation_request: DefectGenerationRequest, domain_randomization_request :DomainRandomizationRequest, frames: int = 1, output_dir: str = "_defects", rt_subframes: int = 0, use_seg: bool = False, use_bb: bool = True, use_bmw: bool =True, seed: int = None, start_frame: int = 0, frame_parameters: FrameParameters = None, preview: PreviewSettings = None, layer_cache_dir: str = None,
+                        job_start_frame: int = None, job_frames: int = None):
+    """
+    Build the Defect layer and the replicator graph of a job.
+
+    Parameters:
+        job_start_frame (int): First frame of the whole job, for the shards of a job. The frames of the job_frames
+            frames of the job are sampled in blocks aligned at job_start_frame, only the blocks holding the frames
+            start_frame to start_frame + frames are sampled, so the frames do not depend on the number of shards.
+        layer_cache_dir (str): Directory of the compiled Defect layers. Jobs with a fixed seed load the materials,
+            projections and cameras compiled for the same job from it, if the base stage did not change, and save the
+            ones they build to it otherwise, so the shards of a job build them once. The graph is always built for the
+            frames of the run. Only for saved stages whose only unsaved edits are the defect primvars, see
+            layer_key.is_saved_stage.
+        preview (PreviewSettings): Build the reduced preview graph instead: a single low resolution camera, without
+            writer nor annotators, and nothing written to output_dir. The frame parameters are sampled for all the
+            cameras of the job at their render resolutions, and the graph is fed with the first preview.frames frames
+            of the previewed camera, so these frames are the frames of the full run.
+
+    Returns:
+        Tuple[Dict, List[int]]: The original materials to restore when the layer is removed, and the subframes of every
+            frame with adaptive subframes, to step the frames with (see replicator_utils.rep_run), None otherwise.
+    """
 
     if len(defect_generation_request.texture_dir) <= 0:
         carb.log_error("No directory selected")
-        return
-    with rep.new_layer("Defect"):
+        return None, None
+    # All randomizer seeds are derived from the job seed, log it so that the run can be reproduced
+    seed_plan = SeedPlan(seed, start_frame if job_start_frame is None else job_start_frame)
+    job_frames = frames if job_frames is None else job_frames
+    logger.info(f"Creating defect layer with {seed_plan}")
+    rep.set_global_seed(seed_plan.seed("global"))
+
+    # Load the materials, projections and cameras compiled for the same job, shared by all its shards, instead of
+    # building them again. The graph holds the frames of the run, it is built on the loaded layer. Replays and previews
+    # are not cached
+    layer_key = None
+    compiled_layer = None
+    if layer_cache_dir and preview is None and frame_parameters is None and seed is not None and seed >= 0:
+        stage = omni.usd.get_context().get_stage()
+        layer_key = defect_layer_key(defect_generation_request, domain_randomization_request, stage, seed=seed_plan.job_seed,
+                                     job_start_frame=seed_plan.start_frame, job_frames=job_frames)
+        primvar_prim_paths = [prim_defect.prim_path for prim_defect in defect_generation_request.prim_defects]
+        compiled_layer = load_defect_layer(layer_cache_dir, layer_key, stage, primvar_prim_paths)
+
+    # The graph of a loaded layer is authored in it, so that it is removed with the layer like the graph of a built one
+    layer_context = rep.new_layer("Defect") if compiled_layer is None else Usd.EditContext(stage, compiled_layer.layer)
+    with layer_context:
         change_camera_params = []
         render_list = []
         prim_defects_path = []
         parent_prim_defects_path = []
         all_original_textures = {}
+        # All the defect semantic labels present in the scene
+        semantic_labels = []
 
         # Create randomizers
         _create_randomizers()
         _create_camera_randomizer()
 
-
-        # Get Texture Randomization params
-        if domain_randomization_request.color_domain_randomization_params.active:
-            if domain_randomization_request.color_domain_randomization_params.texture_randomization:
-                if domain_randomization_request.material_domain_randomization_params.active:
-                    original_textures, created_textures = _create_texture_color_randomizer(domain_randomization_request.color_domain_randomization_params, domain_randomization_request.material_domain_randomization_params.material_prims)
-                else: 
-                    original_textures, created_textures = _create_texture_color_randomizer(domain_randomization_request.color_domain_randomization_params, None)
-            else:
-                original_textures = _create_color_randomizer(domain_randomization_request.color_domain_randomization_params)
-            all_original_textures.update(original_textures)
-
-        # Get material params
-        if domain_randomization_request.material_domain_randomization_params.active:
-            material_randomization_params = domain_randomization_request.material_domain_randomization_params
-            original_textures = _create_material_randomizer(material_randomization_params, domain_randomization_request.color_domain_randomization_params.prim_colors)
-            all_original_textures.update(original_textures)
+        if compiled_layer is None:
+            # Create the materials of the color and material randomizers, and keep the state the randomizers are
+            # registered with, so that it is cached with the layer
+            randomizer_state = {}
+            if domain_randomization_request.color_domain_randomization_params.active:
+                if domain_randomization_request.color_domain_randomization_params.texture_randomization:
+                    material_prims = None
+                    if domain_randomization_request.material_domain_randomization_params.active:
+                        material_prims = domain_randomization_request.material_domain_randomization_params.material_prims
+                    original_textures, randomizer_state["texture_color"] = _create_texture_color_randomizer(domain_randomization_request.color_domain_randomization_params, material_prims)
+                else:
+                    original_textures, randomizer_state["color"] = _create_color_randomizer(domain_randomization_request.color_domain_randomization_params)
+                all_original_textures.update(original_textures)
+
+            # Get material params
+            if domain_randomization_request.material_domain_randomization_params.active:
+                material_randomization_params = domain_randomization_request.material_domain_randomization_params
+                original_textures, randomizer_state["material"] = _create_material_randomizer(material_randomization_params, domain_randomization_request.color_domain_randomization_params.prim_colors)
+                all_original_textures.update(original_textures)
+        else:
+            randomizer_state = compiled_layer.randomizer_state
+            all_original_textures = compiled_layer.original_materials
+        created_textures, material_options = _register_randomizers(domain_randomization_request, randomizer_state)
         # Get camera params
         camera_randomization_params = domain_randomization_request.camera_domain_randomization_params.camera_prims
 
@@ -449,9 +588,13 @@ def create_defect_layer(defect_generation_request: DefectGenerationRequest, doma
                 logger.warning(f"{defect_prim_objects.prim_path} is not an Xform")
                 prim_defects_path.append(Sdf.Path(defect_prim_objects.prim_path))
 
-            # Create defects
-            for defect in defect_prim_objects.defects:
-                _create_defects(defect, prim_path=defect_prim_objects.prim_path)
+            # Create defects, one projection per defect of every group
+            for defect_group in defect_prim_objects.defects:
+                if defect_group.args.semantic_label not in semantic_labels:
+                    semantic_labels.append(defect_group.args.semantic_label)
+                if compiled_layer is None:
+                    for defect in defect_group.instances():
+                        _create_defects(defect, prim_path=defect_prim_objects.prim_path)
 
         # Remove duplicate paths
         prim_defects_path = list(set(prim_defects_path))
@@ -461,77 +604,137 @@ def create_defect_layer(defect_generation_request: DefectGenerationRequest, doma
 
         # Camera scatter prim and lookat prim randomization
         if domain_randomization_request.camera_domain_randomization_params.active:
-            # If no scatter prim or look at prim specified, create a look at prim for each defect
-            if len(domain_randomization_request.camera_domain_randomization_params.camera_prims) == 0:
-                logger.warning(f"No camera parameters were specified, parent_paths are : {parent_prim_defects_path} ")
-                for prim_defect_path in parent_prim_defects_path:
-                    camera_randomization_params.append((None, get_bbox_dimensions(str(prim_defect_path))))
-                logger.warning(f"No camera prims were specified, new camera params: {camera_randomization_params}")
-            #Transform every (scatter_prim, None) in camera params into a scatter prim paired with every defect parent prim in the scene
-            for index, camera_param in enumerate(camera_randomization_params):
-                scatter_params = []
-                if not camera_param[1] and camera_param[0]:
-                    for prim_defect_path in parent_prim_defects_path:
-                        scatter_params.append((camera_param[0], get_bbox_dimensions(str(prim_defect_path))))
-                    camera_randomization_params.pop(index)
-                    camera_randomization_params.extend(scatter_params)
-                # Create cameras with randomization information
-            for camera_param in camera_randomization_params:
-                camera = _create_camera()
-                change_camera_params.append({"camera": camera, "randomization": camera_param})
-                render_product = rep.create.render_product(camera, (1024, 1024))
-                render_list.append(render_product)
+            camera_domain_randomization_params = domain_randomization_request.camera_domain_randomization_params
+            # Compute the bounds of all defect parent prims once
+            bounds_cache = WorldBoundsCache()
+            parent_prim_bounds = bounds_cache.get_all_bounds(parent_prim_defects_path)
+            # Expand, validate and deduplicate the cameras before creating them
+            camera_plan = compile_camera_plan(camera_randomization_params, parent_prim_bounds,
+                                              max_render_products=camera_domain_randomization_params.max_render_products,
+                                              tolerance=camera_domain_randomization_params.look_at_tolerance)
+            logger.info(f"Camera plan: {len(camera_plan.cameras)} cameras, {camera_plan.duplicate_count} duplicates, {camera_plan.invalid_count} invalid, {camera_plan.over_budget_count} over budget")
+            # Create cameras with randomization information, previews only create the previewed camera but the frames
+            # are still planned with all the cameras
+            for camera_idx, camera_spec in enumerate(camera_plan.cameras):
+                if preview is not None and camera_idx != preview.camera_index % len(camera_plan.cameras):
+                    continue
+                camera, render_camera = _get_camera(compiled_layer, camera_idx)
+                change_camera_params.append({"camera": camera, "randomization": camera_spec, "index": camera_idx})
+                render_settings = _get_render_settings(camera_domain_randomization_params, camera_spec.scatter_prim_path, preview)
+                render_product = rep.create.render_product(render_camera, tuple(render_settings.resolution))
+                render_list.append((render_product, _get_annotators(render_settings, use_seg, use_bb)))
             logger.warning(f"Randomization params are : {change_camera_params}")
         else:
             # If not domain randomization on camera, create a regular camera
-            camera = _create_camera()
-            render_product = rep.create.render_product(camera, (1024, 1024))
-            render_list.append(render_product)
-
-        # Initialize and attach writer
-        if use_bmw:
-            # Create a list containing all the defect names present in scene.
-            defect_names = []
-            semantic_labels = []
-            for prim_defect in defect_generation_request.prim_defects:
-                for defect in prim_defect.defects:
-                    if defect.defect_name not in defect_names:
-                        defect_names.append(defect.defect_name)
-                    if defect.args.get("semantic_label", "default") not in semantic_labels:
-                        semantic_labels.append(defect.args.get("semantic_label", "default"))
-
-                        
-            rep.WriterRegistry.register(BMWWriter)
-            writer = rep.WriterRegistry.get("BMWWriter")
-            writer.initialize(output_dir=output_dir, rgb=True, bounding_box_2d_tight=use_bb,semantic_segmentation=use_seg, defects=semantic_labels)
+            _, render_camera = _get_camera(compiled_layer, 0)
+            render_settings = domain_randomization_request.camera_domain_randomization_params.default_render_settings
+            if preview is not None:
+                render_settings = _get_render_settings(domain_randomization_request.camera_domain_randomization_params, preview=preview)
+            render_product = rep.create.render_product(render_camera, tuple(render_settings.resolution))
+            render_list.append((render_product, _get_annotators(render_settings, use_seg, use_bb)))
+
+        # Presample the parameters of every frame on the CPU, the graph is fed with them as sequences and they are recorded
+        # next to the output, so that any frame can be replayed
+        camera_randomization_active = domain_randomization_request.camera_domain_randomization_params.active
+        if preview is not None:
+            frames = min(frames, preview.frames)
+        if frame_parameters is None:
+            schedules = domain_randomization_request.parameter_schedules
+            precheck_params = domain_randomization_request.visibility_precheck_params
+            defect_targeting = domain_randomization_request.camera_domain_randomization_params.defect_targeting.active
+            if camera_randomization_active:
+                if not precheck_params.active:
+                    # Sample the camera poses once, without resampling the frames predicted to show no defect
+                    precheck_params = VisibilityPrecheckParameters(max_camera_attempts=1, max_defect_attempts=1)
+                # Resolutions of the full run, the visibility of the defects depends on them
+                resolutions = [tuple(_get_render_settings(camera_domain_randomization_params, camera_spec.scatter_prim_path).resolution) for camera_spec in camera_plan.cameras]
+                camera_tracks = create_camera_tracks(camera_plan.cameras, resolutions, camera_domain_randomization_params, bounds_cache)
+                frame_planner = create_frame_planner(defect_generation_request, camera_tracks, precheck_params, np.random.default_rng(seed_plan.seed("frame_plan")),
+                                                     sampling_method=domain_randomization_request.sampling_method)
+                plan_block = create_block_planner(frame_planner, seed_plan, schedules, max_camera_attempts=precheck_params.max_camera_attempts,
+                                                  max_defect_attempts=precheck_params.max_defect_attempts, skip_rejected=precheck_params.skip_rejected_frames)
+            else:
+                if precheck_params.active or defect_targeting:
+                    carb.log_warn("The visibility pre-check and defect targeting need camera randomization, skipping them")
+                # Presample the defect placements from the placement indices of the target prims
+                defect_placer = create_defect_placer(defect_generation_request, np.random.default_rng(seed_plan.seed("defect_placement")),
+                                                     sampling_method=domain_randomization_request.sampling_method)
+                plan_block = create_block_planner(defect_placer, seed_plan, schedules)
+
+            # Frames of this shard or of the preview, sampled from the blocks of the job holding them
+            defect_names = [defect.defect_name for prim_defect in defect_generation_request.prim_defects for defect in prim_defect.defects]
+            frame_parameters, plan_stats = sample_frame_range(plan_block, defect_generation_request, domain_randomization_request, seed_plan,
+                                                              start_frame, frames, job_frames,
+                                                              list_defect_textures(defect_generation_request.texture_dir, defect_names),
+                                                              material_options=material_options,
+                                                              render_products=[str(getattr(render_product, "path", render_product)) for render_product, _ in render_list])
+            if camera_randomization_active:
+                if preview is None:
+                    write_frame_plan_report(output_dir, plan_stats)
+                if frame_parameters.num_frames == 0:
+                    carb.log_error("No frame is predicted to show a defect, check the camera and defect parameters")
+                    return all_original_textures, None
         else:
-            writer = rep.WriterRegistry.get("BasicWriter")
-            writer.initialize(output_dir=output_dir, rgb=True, semantic_segmentation=use_seg, bounding_box_2d_tight=use_bb)
-        # Attach all render products to the writer
-        writer.attach(render_list)
+            # Replay of recorded frames, the graph must have the defects, textures, cameras, colors and materials of the recording
+            color_params = domain_randomization_request.color_domain_randomization_params
+            check_replay(frame_parameters,
+                         [defect.uuid for prim_defect in defect_generation_request.prim_defects for defect in prim_defect.iter_defects()],
+                         list_defect_textures(defect_generation_request.texture_dir, [defect.defect_name for prim_defect in defect_generation_request.prim_defects for defect in prim_defect.defects]),
+                         camera_count=len(camera_plan.cameras) if camera_randomization_active else None,
+                         prim_colors=color_params.prim_colors if color_params.active else None,
+                         material_options=material_options)
+            logger.info(f"Replaying {frame_parameters.num_frames} recorded frames: {frame_parameters.frame_ids}")
+        # Subframes of every frame from the randomizers changing the scene, the frames are then stepped one at a time
+        adaptive_subframe_params = domain_randomization_request.adaptive_subframe_params
+        frame_parameters.columns.pop(SUBFRAMES_COLUMN, None)
+        if adaptive_subframe_params.active:
+            subframes = plan_subframes(frame_parameters, adaptive_subframe_params)
+            frame_parameters.columns[SUBFRAMES_COLUMN] = subframes
+            logger.info(f"Adaptive subframes: {int(subframes.sum())} subframes over {len(subframes)} frames, "
+                           f"{int((subframes == adaptive_subframe_params.min_subframes).sum())} frames with the minimum")
+        if preview is None:
+            frame_parameters.save(os.path.join(output_dir, FRAME_PARAMETERS_FILE))
+        frames = frame_parameters.num_frames
+        if camera_randomization_active:
+            for camera_option in change_camera_params:
+                camera_option["plan"] = frame_parameters.camera_sequences(camera_option["index"])
+
+        # Initialize the writers and attach all render products to them, previews write nothing
+        if preview is None:
+            _attach_writers(render_list, use_bmw, output_dir, semantic_labels, start_frame, frame_ids=frame_parameters.frame_ids)
 
         # Setup randomization
-        with rep.trigger.on_frame(num_frames=frames, rt_subframes=rt_subframes):
+        # With adaptive subframes the frames are stepped one at a time with their own subframes, the trigger has no fixed count
+        trigger_args = {} if adaptive_subframe_params.active else {"rt_subframes": rt_subframes}
+        with rep.trigger.on_frame(num_frames=frames, **trigger_args):
 
             # Light domain randomization
             if domain_randomization_request.light_domain_randomization_params.active:
-                rep.randomizer.change_light(domain_randomization_request.light_domain_randomization_params)
+                light_sequences = [frame_parameters.light_sequences(light_idx) for light_idx in range(frame_parameters.tables["light_count"])]
+                rep.randomizer.change_light(light_sequences)
             # Camera domain randomization
             if domain_randomization_request.camera_domain_randomization_params.active:
-                rep.randomizer.change_camera(change_camera_params, prim_defects_path, domain_randomization_request.camera_domain_randomization_params)
+                rep.randomizer.change_camera(change_camera_params)
             # Defects domain randomization
             for defect_prim_objects in defect_generation_request.prim_defects:
-                for defect in defect_prim_objects.defects:
-                    rep.randomizer.move_defect(defect_objet=defect, prim_path=defect_prim_objects.prim_path)
-                    rep.randomizer.change_defect_image(defect_objet=defect, texture_dir=defect_generation_request.texture_dir)
+                for defect in defect_prim_objects.iter_defects():
+                    placement = frame_parameters.defect_sequences(defect.uuid)
+                    rep.randomizer.move_defect(defect_objet=defect, placement=placement)
+                    rep.randomizer.change_defect_image(defect_objet=defect, texture_dir=defect_generation_request.texture_dir,
+                                                       visibility=placement["visibility"], texture_indices=placement["texture"])
 
             # Color domain randomization
             if domain_randomization_request.color_domain_randomization_params.active:
-                rep.randomizer.get_colors()
+                rep.randomizer.get_colors({prim_path: frame_parameters.choices("color_choice", prim_path, "color_prims")
+                                           for prim_path in frame_parameters.tables.get("color_prims", [])})
 
             # Material domain randomization
             if domain_randomization_request.material_domain_randomization_params.active: 
-                rep.randomizer.randomize_materials()
+                material_choices = {prim_path: frame_parameters.choices("material_choice", prim_path, "material_prims")
+                                    for prim_path in frame_parameters.tables.get("material_prims", [])}
+                material_color_choices = {mat_path: frame_parameters.choices("material_color_choice", mat_path, "material_colors")
+                                          for mat_path in frame_parameters.tables.get("material_colors", [])}
+                rep.randomizer.randomize_materials(material_choices, material_color_choices)
 
             # Texture domain randomization
             if domain_randomization_request.color_domain_randomization_params.texture_randomization:
@@ -540,4 +743,7 @@ def create_defect_layer(defect_generation_request: DefectGenerationRequest, doma
                         for material, prim_paths in created_textures[parent_path].items():
                             # Bind the material to the corresponding prim_paths
                             rep.modify.material([material], input_prims = prim_paths)
-    return all_original_textures       
+
+    if layer_key is not None and compiled_layer is None and get_defect_layer() is not None:
+        save_defect_layer(layer_cache_dir, layer_key, stage, get_defect_layer()[0], render_list, all_original_textures, randomizer_state, primvar_prim_paths)
+    return all_original_textures, _subframe_plan(frame_parameters)
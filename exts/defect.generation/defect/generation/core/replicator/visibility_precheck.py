@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+from typing import Dict, List, Tuple
+import carb
+import numpy as np
+from pxr import Usd, UsdGeom
+from defect.generation.core.replicator.placement_index import get_placement_index_cache
+from defect.generation.core.sampling.frame_plan import (CameraTrack, DefectPlacer, DefectTrack, FramePlanner,
+                                                        create_camera_tracks)
+from defect.generation.core.sampling.geometry import SurfaceSampler
+from defect.generation.core.sampling.scene_snapshot import SceneSnapshot
+from defect.generation.core.sampling.schedules import FrameSchedule
+from defect.generation.core.sampling.visibility import CameraIntrinsics, CoarseBVH, VisibilityPredictor
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest, VisibilityPrecheckParameters
+from defect.generation.utils.bounds import WorldBoundsCache
+from defect.generation.utils.helpers import get_current_stage
+from defect.generation.utils.mesh_geometry import get_mesh_paths, get_world_triangles
+
+logger = logging.getLogger(__name__)
+
+FRAME_PLAN_REPORT = "frame_plan.json"
+
+
+def get_up_axis(stage: Usd.Stage) -> Tuple[float, float, float]:
+    return (0.0, 0.0, 1.0) if UsdGeom.GetStageUpAxis(stage) == UsdGeom.Tokens.z else (0.0, 1.0, 0.0)
+
+
+def get_scatter_viewpoints(scatter_bounds: List) -> np.ndarray:
+    # Corners and centers of the camera scatter bounds, the points a face must face to be visible
+    viewpoints = []
+    for bounds in scatter_bounds:
+        bounds = np.asarray(bounds, dtype=np.float64)
+        corners = np.stack(np.meshgrid(*bounds.T, indexing="ij"), axis=-1).reshape(-1, 3)
+        viewpoints.extend([*corners, bounds.mean(axis=0)])
+    return np.array(viewpoints).reshape(-1, 3)
+
+
+def get_defect_surfaces(defect_generation_request: DefectGenerationRequest, viewpoints: np.ndarray = None,
+                        stage: Usd.Stage = None) -> Dict[str, SurfaceSampler]:
+    # Placement index of every target prim, restricted to its placement region
+    cache = get_placement_index_cache()
+    surfaces: Dict[str, SurfaceSampler] = {}
+    for prim_defect in defect_generation_request.prim_defects:
+        if prim_defect.prim_path in surfaces:
+            continue
+        surfaces[prim_defect.prim_path] = cache.get_index(prim_defect.prim_path, defect_generation_request.placement_regions.get(prim_defect.prim_path),
+                                                          viewpoints=viewpoints, stage=stage)
+        if surfaces[prim_defect.prim_path].is_empty:
+            carb.log_warn(f"No mesh surface found under {prim_defect.prim_path}, its defects are placed at the origin")
+    logger.info(f"Placement indices: {cache.hits} cached, {cache.misses} built")
+    return surfaces
+
+
+def create_defect_tracks(defect_generation_request: DefectGenerationRequest) -> List[DefectTrack]:
+    return [DefectTrack.from_args(defect.uuid, prim_defect.prim_path, defect.args, defect.defect_name)
+            for prim_defect in defect_generation_request.prim_defects for defect in prim_defect.iter_defects()]
+
+
+def create_defect_placer(defect_generation_request: DefectGenerationRequest, rng: np.random.Generator,
+                         viewpoints: np.ndarray = None, stage: Usd.Stage = None, sampling_method: str = "uniform",
+                         schedule: FrameSchedule = None) -> DefectPlacer:
+    # Placements of the defects when no camera needs a frame plan
+    return DefectPlacer(create_defect_tracks(defect_generation_request), get_defect_surfaces(defect_generation_request, viewpoints, stage),
+                        rng, max_visible_per_surface=defect_generation_request.max_visible_defects_per_prim,
+                        min_separation=defect_generation_request.min_defect_separation, sampling_method=sampling_method,
+                        schedule=schedule)
+
+
+def create_frame_planner(defect_generation_request: DefectGenerationRequest, camera_tracks: List[CameraTrack],
+                         precheck_params: VisibilityPrecheckParameters, rng: np.random.Generator, stage: Usd.Stage = None,
+                         sampling_method: str = "uniform", schedule: FrameSchedule = None) -> FramePlanner:
+    """
+    Gather the geometry of the defect prims and build the frame planner of a request.
+
+    Parameters:
+        defect_generation_request (DefectGenerationRequest): The defects to place.
+        camera_tracks (List[CameraTrack]): Sampling ranges of the cameras.
+        precheck_params (VisibilityPrecheckParameters): Visibility tests to run.
+        rng (np.random.Generator): Random generator of the frame plan.
+        stage (Usd.Stage): Stage of the defect prims, the current stage if None.
+        sampling_method (str): Sampler of the defect ranges and camera poses.
+        schedule (FrameSchedule): Schedules of the defect args and budget.
+
+    Returns:
+        FramePlanner: Planner sampling the defect placements and camera poses.
+    """
+    stage = stage if stage is not None else get_current_stage()
+    viewpoints = get_scatter_viewpoints([track.scatter_bounds for track in camera_tracks if track.scatter_bounds is not None])
+    surfaces = get_defect_surfaces(defect_generation_request, viewpoints, stage)
+    defects = create_defect_tracks(defect_generation_request)
+
+    bvh = None
+    if precheck_params.check_occlusion:
+        occluder_prims = precheck_params.occluder_prims or list(surfaces)
+        mesh_paths = [mesh_path for prim_path in occluder_prims for mesh_path in get_mesh_paths(prim_path, stage)]
+        bvh = CoarseBVH(*get_world_triangles(mesh_paths, stage), leaf_size=precheck_params.bvh_leaf_size,
+                        max_leaves=precheck_params.bvh_max_leaves)
+        logger.info(f"Built occlusion BVH of {bvh.triangle_count} triangles in {len(bvh.box_min)} leaves")
+
+    predictor = VisibilityPredictor(CameraIntrinsics(), get_up_axis(stage), bvh=bvh,
+                                    check_facing=precheck_params.check_facing, frustum_margin=precheck_params.frustum_margin)
+    return FramePlanner(defects, surfaces, camera_tracks, predictor, rng,
+                        max_visible_per_surface=defect_generation_request.max_visible_defects_per_prim,
+                        min_separation=defect_generation_request.min_defect_separation, sampling_method=sampling_method,
+                        schedule=schedule)
+
+
+def create_scene_snapshot(defect_generation_request: DefectGenerationRequest, domain_randomization_request: DomainRandomizationRequest,
+                          stage: Usd.Stage = None) -> SceneSnapshot:
+    """
+    Gather the geometry the CPU sampling of a job needs, for dry runs outside of Kit.
+
+    Parameters:
+        defect_generation_request (DefectGenerationRequest): The defects to place.
+        domain_randomization_request (DomainRandomizationRequest): The randomization of the job, for the camera and occluder prims.
+        stage (Usd.Stage): Stage of the prims, the current stage if None.
+
+    Returns:
+        SceneSnapshot: Placement indices, bounds and up axis of the scene.
+    """
+    stage = stage if stage is not None else get_current_stage()
+    bounds_cache = WorldBoundsCache(stage)
+    bounds = bounds_cache.get_all_bounds(prim_defect.prim_path for prim_defect in defect_generation_request.prim_defects)
+    scatter_prim_paths = [scatter_prim_path for scatter_prim_path, _ in domain_randomization_request.camera_domain_randomization_params.camera_prims or []
+                          if scatter_prim_path]
+    bounds.update(bounds_cache.get_all_bounds(scatter_prim_paths))
+
+    surfaces = get_defect_surfaces(defect_generation_request, get_scatter_viewpoints([bounds[path] for path in scatter_prim_paths]), stage)
+    precheck_params = domain_randomization_request.visibility_precheck_params
+    if precheck_params.check_occlusion:
+        for prim_path in precheck_params.occluder_prims or []:
+            if prim_path not in surfaces:
+                surfaces[prim_path] = get_placement_index_cache().get_index(prim_path, stage=stage)
+    return SceneSnapshot(surfaces, bounds, get_up_axis(stage))
+
+
+def write_frame_plan_report(output_dir: str, stats: Dict):
+    # Acceptance statistics of the frame plans of the sampled blocks, see frame_parameters.merge_plan_stats
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, FRAME_PLAN_REPORT), 'w') as file:
+        json.dump(stats, file, indent=4)
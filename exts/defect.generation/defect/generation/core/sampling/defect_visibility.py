@@ -0,0 +1,43 @@
+"""
+Coordinated sampling of the defects shown in every frame: each defect is shown with the probability of its defect
+type, then the defects of a prim exceeding the per frame budget are hidden at random.
+"""
+from typing import Sequence
+import numpy as np
+
+
+def sample_shown_defects(probabilities: Sequence[float], groups: Sequence, num_frames: int, rng: np.random.Generator,
+                         max_per_group: int = None) -> np.ndarray:
+    """
+    Sample the shown flags of all defects in num_frames frames.
+
+    Parameters:
+        probabilities (Sequence[float]): Probability of every defect being shown in a frame, or (num_frames, defect count)
+            probabilities per frame.
+        groups (Sequence): Group of every defect, the prim path it is placed on. The budget applies per group.
+        num_frames (int): Number of frames.
+        rng (np.random.Generator): Random generator.
+        max_per_group (int): Maximum number of defects shown per group and frame, None or 0 for no limit. Also a
+            (num_frames,) array of budgets per frame.
+
+    Returns:
+        np.ndarray: (num_frames, defect count) boolean flags.
+    """
+    probabilities = np.clip(np.asarray(probabilities, dtype=np.float64), 0.0, 1.0)
+    defect_count = probabilities.shape[-1]
+    shown = rng.random((num_frames, defect_count)) < probabilities
+    limits = np.broadcast_to(np.asarray(max_per_group if max_per_group is not None else 0, dtype=np.int64), (num_frames,))
+    if not np.any(limits > 0):
+        return shown
+    limits = np.where(limits > 0, limits, defect_count)
+
+    groups = np.asarray(groups)
+    # Random priorities of the shown defects, the lowest max_per_group priorities of every group stay shown
+    priorities = np.where(shown, rng.random(shown.shape), np.inf)
+    for group in np.unique(groups):
+        columns = np.nonzero(groups == group)[0]
+        if len(columns) <= limits.min():
+            continue
+        ranks = np.argsort(np.argsort(priorities[:, columns], axis=1), axis=1)
+        shown[:, columns] &= ranks < limits[:, None]
+    return shown
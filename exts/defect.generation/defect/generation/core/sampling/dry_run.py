@@ -0,0 +1,296 @@
+"""
+CPU-only dry run of a defect generation job: samples what every randomizer of the job would pick for N frames, without
+Kit nor rendering, and writes the samples as columns with coverage statistics.
+
+    python -m defect.generation.core.sampling.dry_run <job_file> [--snapshot scene.npz] [--frames N] [--output-dir DIR]
+        [--sampling-method METHOD]
+
+Run it from exts/defect.generation, or with that directory on PYTHONPATH: the module imports the defect.generation
+package, so running the file as a script does not work.
+
+The columns are the frame parameters the graph would be fed with the same seed and scene snapshot, see
+frame_parameters.py. Without a scene snapshot, exported by the worker with --snapshot, the positions and camera poses
+are not sampled.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+import numpy as np
+from defect.generation.core.jobs.job_files import load_job
+from defect.generation.core.replicator.camera_plan import compile_camera_plan
+from defect.generation.core.sampling.frame_parameters import LIGHT_ATTRIBUTES, FrameParameters, list_defect_textures, sample_frame_range
+from defect.generation.core.sampling.frame_plan import DefectPlacer, DefectTrack, FramePlan, FramePlanner, create_block_planner, create_camera_tracks
+from defect.generation.core.sampling.geometry import SurfaceSampler
+from defect.generation.core.sampling.low_discrepancy import SAMPLING_METHODS
+from defect.generation.core.sampling.scene_snapshot import SceneSnapshot
+from defect.generation.core.sampling.subframes import SUBFRAMES_COLUMN, plan_subframes, scene_changes
+from defect.generation.core.sampling.visibility import CameraIntrinsics, CoarseBVH, VisibilityPredictor
+from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+from defect.generation.domain.models.domain_randomization_request import VisibilityPrecheckParameters
+from defect.generation.utils.seed_plan import SeedPlan
+
+logger = logging.getLogger(__name__)
+
+COLUMNS_FILE = "dry_run.npz"
+STATS_FILE = "dry_run_stats.json"
+
+
+def _numeric_stats(values: np.ndarray) -> Dict:
+    # Statistics per component of the last axis of (..., K) values
+    values = np.asarray(values, dtype=np.float64)
+    values = values.reshape(-1, values.shape[-1]) if values.ndim > 1 else values.reshape(-1, 1)
+    if len(values) == 0:
+        return {}
+    return {"min": values.min(axis=0).tolist(), "max": values.max(axis=0).tolist(),
+            "mean": values.mean(axis=0).tolist(), "std": values.std(axis=0).tolist()}
+
+
+def _range_coverage(values: np.ndarray, range_min: np.ndarray, range_max: np.ndarray) -> List[float]:
+    # Fraction of each requested (min, max) range spanned by the samples, 1 for degenerate ranges
+    values = np.asarray(values, dtype=np.float64).reshape(-1, np.shape(range_min)[-1])
+    if len(values) == 0:
+        return []
+    width = np.asarray(range_max, dtype=np.float64) - np.asarray(range_min, dtype=np.float64)
+    spanned = values.max(axis=0) - values.min(axis=0)
+    return np.where(np.abs(width) > 1e-12, spanned / np.where(np.abs(width) > 1e-12, np.abs(width), 1.0), 1.0).tolist()
+
+
+def _choice_stats(choices: np.ndarray, options: Sequence[str]) -> Dict:
+    choices = np.asarray(choices, dtype=np.int64).ravel()
+    counts = np.bincount(choices[choices >= 0], minlength=len(options))[:len(options)] if len(options) else np.zeros(0)
+    return {"counts": {str(option): int(count) for option, count in zip(options, counts)},
+            "coverage": float((counts > 0).mean()) if len(options) else 0.0}
+
+
+class DryRun:
+    """
+    Sample all randomizers of a job on the CPU.
+
+    Parameters:
+        job (DefectGenerationJob): The job, with the same request objects the graph is built from.
+        snapshot (SceneSnapshot): Geometry of the scene, None to skip the positions and camera poses.
+        frames (int): Number of frames to sample from the first frame of the job, the frames of the job (or of the
+            shard of a job) if None.
+    """
+
+    def __init__(self, job: DefectGenerationJob, snapshot: SceneSnapshot = None, frames: int = None) -> None:
+        self.job = job
+        self.snapshot = snapshot
+        # The frames of a shard are sampled from the blocks of the job holding them, like create_defect_layer does
+        self.seed_plan = SeedPlan(job.seed, job.start_frame if job.job_start_frame is None else job.job_start_frame)
+        self.job_frames = job.frames if job.job_frames is None else job.job_frames
+        self.start_frame = job.start_frame if frames is None else self.seed_plan.start_frame
+        self.frames = job.frames if frames is None else frames
+        self.job_frames = max(self.job_frames, self.frames)
+        self.columns: Dict[str, np.ndarray] = {}
+        self.stats: Dict = {}
+
+    def run(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        start_time = time.time()
+        self.stats = {"frames": self.frames, "job_seed": self.seed_plan.job_seed, "start_frame": self.start_frame,
+                      "geometry": self.snapshot is not None, "sampling_method": self.job.domain_randomization_request.sampling_method}
+        plan_block, camera_tracks = self._create_block_planner()
+        frame_parameters = self._sample_frame_parameters(plan_block)
+        self.columns = dict(frame_parameters.columns)
+        self.columns["defect_uuid"] = np.array(frame_parameters.tables["defect_uuids"], dtype=str)
+        if self.snapshot is None:
+            del self.columns["defect_position"]
+        if not camera_tracks:
+            for name in ["camera_position", "camera_look_at", "camera_visible_defects"]:
+                del self.columns[name]
+        self._defect_stats(frame_parameters, camera_tracks)
+        self._texture_stats(frame_parameters)
+        self._light_stats(frame_parameters)
+        self._choice_column_stats(frame_parameters)
+        self._subframe_stats(frame_parameters)
+        duration = time.time() - start_time
+        self.stats["duration"] = duration
+        self.stats["frames_per_second"] = self.frames / duration if duration > 0 else float("inf")
+        logger.info(f"Dry run of {self.frames} frames in {duration:.3f}s ({self.stats['frames_per_second']:.0f} frames/s)")
+        return self.columns, self.stats
+
+    def _create_block_planner(self) -> Tuple[Callable[[SeedPlan, int], FramePlan], list]:
+        request = self.job.defect_generation_request
+        randomization = self.job.domain_randomization_request
+        defects = [DefectTrack.from_args(defect.uuid, prim_defect.prim_path, defect.args, defect.defect_name)
+                   for prim_defect in request.prim_defects for defect in prim_defect.iter_defects()]
+        surfaces = {defect.surface: self.snapshot.surfaces.get(defect.surface) if self.snapshot is not None else None for defect in defects}
+        surfaces = {surface: sampler if sampler is not None else SurfaceSampler(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+                    for surface, sampler in surfaces.items()}
+
+        # Same branches as create_defect_layer
+        camera_params = randomization.camera_domain_randomization_params
+        precheck_params = randomization.visibility_precheck_params
+        camera_tracks = []
+        if camera_params.active and self.snapshot is not None:
+            parent_prims = list(dict.fromkeys(prim_defect.prim_path for prim_defect in request.prim_defects))
+            camera_plan = compile_camera_plan(camera_params.camera_prims, {path: self.snapshot.get_bounds(path) for path in parent_prims},
+                                              max_render_products=camera_params.max_render_products, tolerance=camera_params.look_at_tolerance)
+            resolutions = [tuple((camera_params.render_settings or {}).get(camera_spec.scatter_prim_path or "", camera_params.default_render_settings).resolution)
+                           for camera_spec in camera_plan.cameras]
+            camera_tracks = create_camera_tracks(camera_plan.cameras, resolutions, camera_params, self.snapshot)
+
+        if not precheck_params.active:
+            # Without the pre-check, cameras are sampled once and only predicted for the statistics
+            precheck_params = VisibilityPrecheckParameters(max_camera_attempts=1, max_defect_attempts=1,
+                                                           check_facing=precheck_params.check_facing, check_occlusion=precheck_params.check_occlusion,
+                                                           occluder_prims=precheck_params.occluder_prims, frustum_margin=precheck_params.frustum_margin)
+        if camera_tracks:
+            bvh = None
+            if precheck_params.check_occlusion:
+                bvh = CoarseBVH(*self.snapshot.get_triangles(precheck_params.occluder_prims or list(surfaces)),
+                                leaf_size=precheck_params.bvh_leaf_size, max_leaves=precheck_params.bvh_max_leaves)
+            predictor = VisibilityPredictor(CameraIntrinsics(), self.snapshot.up_axis, bvh=bvh,
+                                            check_facing=precheck_params.check_facing, frustum_margin=precheck_params.frustum_margin)
+            planner = FramePlanner(defects, surfaces, camera_tracks, predictor, np.random.default_rng(self.seed_plan.seed("frame_plan")),
+                                   max_visible_per_surface=request.max_visible_defects_per_prim, min_separation=request.min_defect_separation,
+                                   sampling_method=randomization.sampling_method)
+            plan_block = create_block_planner(planner, self.seed_plan, randomization.parameter_schedules,
+                                              max_camera_attempts=precheck_params.max_camera_attempts,
+                                              max_defect_attempts=precheck_params.max_defect_attempts,
+                                              skip_rejected=precheck_params.skip_rejected_frames)
+        else:
+            placer = DefectPlacer(defects, surfaces, np.random.default_rng(self.seed_plan.seed("defect_placement")),
+                                  max_visible_per_surface=request.max_visible_defects_per_prim, min_separation=request.min_defect_separation,
+                                  sampling_method=randomization.sampling_method)
+            plan_block = create_block_planner(placer, self.seed_plan, randomization.parameter_schedules)
+        return plan_block, camera_tracks
+
+    def _sample_frame_parameters(self, plan_block: Callable[[SeedPlan, int], FramePlan]) -> FrameParameters:
+        request = self.job.defect_generation_request
+        material_params = self.job.domain_randomization_request.material_domain_randomization_params
+        # The color attributes of the materials are only known with the stage, the materials pick from all their options
+        material_options = {prim_path: list((material_params.created_materials or {}).get(prim_path) or materials)
+                            for prim_path, materials in (material_params.material_prims or {}).items()}
+        defect_names = [defect.defect_name for prim_defect in request.prim_defects for defect in prim_defect.defects]
+        frame_parameters, self.stats["frame_plan"] = sample_frame_range(plan_block, request, self.job.domain_randomization_request, self.seed_plan,
+                                                                        self.start_frame, self.frames, self.job_frames,
+                                                                        list_defect_textures(request.texture_dir, defect_names),
+                                                                        material_options=material_options)
+        if frame_parameters.num_frames != self.frames:
+            # Skipped frames are not rendered, the job renders the planned frames only
+            self.stats["frames"] = self.frames = frame_parameters.num_frames
+        return frame_parameters
+
+    def _defect_stats(self, frame_parameters: FrameParameters, camera_tracks: list):
+        # Coverage per defect type
+        request = self.job.defect_generation_request
+        defects = [DefectTrack.from_args(defect.uuid, prim_defect.prim_path, defect.args, defect.defect_name)
+                   for prim_defect in request.prim_defects for defect in prim_defect.iter_defects()]
+        defect_names = [defect.defect_name for defect in defects]
+        shown = frame_parameters.columns["defect_shown"]
+        rotations = frame_parameters.columns["defect_rotation"]
+        scales = frame_parameters.columns["defect_scale"]
+        defect_stats = {}
+        for defect_name in dict.fromkeys(defect_names):
+            indices = [index for index, name in enumerate(defect_names) if name == defect_name]
+            tracks = [defects[index] for index in indices]
+            defect_stats[defect_name] = {
+                "instances": len(indices),
+                "shown_fraction": float(shown[:, indices].mean()) if frame_parameters.num_frames else 0.0,
+                "rotation": _numeric_stats(rotations[:, indices]),
+                "rotation_coverage": _range_coverage(rotations[:, indices], np.min([track.rotation_range[0] for track in tracks], axis=0),
+                                                     np.max([track.rotation_range[1] for track in tracks], axis=0)),
+                "scale": _numeric_stats(scales[:, indices]),
+                "scale_coverage": _range_coverage(scales[:, indices], np.min([track.scale_range[0] for track in tracks], axis=0),
+                                                  np.max([track.scale_range[1] for track in tracks], axis=0)),
+            }
+        shown_per_frame = shown.sum(axis=1)
+        self.stats["defects"] = defect_stats
+        self.stats["mean_shown_defects"] = float(shown_per_frame.mean()) if len(shown_per_frame) else 0.0
+        self.stats["frames_without_shown_defect"] = int((shown_per_frame == 0).sum())
+        if camera_tracks:
+            distances = np.linalg.norm(frame_parameters.columns["camera_position"] - frame_parameters.columns["camera_look_at"], axis=2)
+            self.stats["cameras"] = {"count": len(camera_tracks), "distance": _numeric_stats(distances[..., None]),
+                                     "predicted_frame_acceptance": float((frame_parameters.columns["camera_visible_defects"] > 0).any(axis=1).mean()) if frame_parameters.num_frames else 0.0}
+
+    def _texture_stats(self, frame_parameters: FrameParameters):
+        # Texture index picked by change_defect_image, -1 when the texture directory cannot be listed
+        textures = frame_parameters.tables["textures"]
+        defect_names = frame_parameters.tables["defect_names"]
+        choices = frame_parameters.columns["defect_texture"]
+        self.stats["textures"] = {defect_name: _choice_stats(choices[:, [index for index, name in enumerate(defect_names) if name == defect_name]],
+                                                             defect_textures)
+                                  for defect_name, defect_textures in textures.items() if defect_textures}
+        missing = sorted(defect_name for defect_name, defect_textures in textures.items() if not defect_textures)
+        if missing:
+            logger.warning(f"No textures found in {self.job.defect_generation_request.texture_dir} for {missing}")
+
+    def _light_stats(self, frame_parameters: FrameParameters):
+        light_params = self.job.domain_randomization_request.light_domain_randomization_params
+        if not light_params.active:
+            return
+        light_stats = {}
+        for attribute in LIGHT_ATTRIBUTES:
+            values = frame_parameters.columns.get(f"light_{attribute}")
+            if values is None:
+                continue
+            min_value = getattr(light_params, f"light_{attribute}_min_value")
+            max_value = getattr(light_params, f"light_{attribute}_max_value")
+            shape = values.shape[2:]
+            light_stats[attribute] = {**_numeric_stats(values.reshape(values.shape[0] * values.shape[1], -1)),
+                                      "coverage": _range_coverage(values, np.broadcast_to(min_value, shape or (1,)), np.broadcast_to(max_value, shape or (1,)))}
+        self.stats["lights"] = light_stats
+
+    def _subframe_stats(self, frame_parameters: FrameParameters):
+        # Subframes the adaptive mode would render, against the fixed rt_subframes of the job
+        params = self.job.domain_randomization_request.adaptive_subframe_params
+        subframes = plan_subframes(frame_parameters, params)
+        if params.active:
+            self.columns[SUBFRAMES_COLUMN] = subframes
+        counts = dict(zip(*np.unique(subframes, return_counts=True)))
+        self.stats["subframes"] = {
+            "active": params.active,
+            "adaptive_total": int(subframes.sum()),
+            "fixed_total": self.frames * max(self.job.rt_subframes, 1),
+            "histogram": {str(int(count)): int(frames) for count, frames in counts.items()},
+            "mean_scene_change": {randomizer: float(changes[1:].mean()) if len(changes) > 1 else 0.0
+                                  for randomizer, changes in scene_changes(frame_parameters).items()},
+        }
+
+    def _choice_column_stats(self, frame_parameters: FrameParameters):
+        tables = frame_parameters.tables
+        color_params = self.job.domain_randomization_request.color_domain_randomization_params
+        if "color_choice" in frame_parameters.columns:
+            self.stats["colors"] = {prim_path: _choice_stats(frame_parameters.choices("color_choice", prim_path, "color_prims"),
+                                                             [str(tuple(color)) for color in color_params.prim_colors[prim_path]])
+                                    for prim_path in tables["color_prims"]}
+        if "material_choice" in frame_parameters.columns:
+            self.stats["materials"] = {prim_path: _choice_stats(frame_parameters.choices("material_choice", prim_path, "material_prims"),
+                                                                [str(material) for material in tables["material_options"][prim_path]])
+                                       for prim_path in tables["material_prims"]}
+
+
+def write_dry_run(output_dir: str, columns: Dict[str, np.ndarray], stats: Dict):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, COLUMNS_FILE), 'wb') as file:
+        np.savez_compressed(file, **columns)
+    with open(os.path.join(output_dir, STATS_FILE), 'w') as file:
+        json.dump(stats, file, indent=4)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Sample the randomization of a defect generation job without rendering")
+    parser.add_argument("job_file", help="DefectGenerationJob json file")
+    parser.add_argument("--snapshot", help="Scene snapshot exported by the worker, needed for the positions and camera poses")
+    parser.add_argument("--frames", type=int, help="Number of frames to sample, the frames of the job by default")
+    parser.add_argument("--output-dir", help="Directory of the samples and statistics, <job output dir>/dry_run by default")
+    parser.add_argument("--sampling-method", choices=SAMPLING_METHODS, help="Sampler of the randomization ranges, the one of the job by default")
+    args = parser.parse_args(argv)
+
+    job = load_job(args.job_file)
+    if args.sampling_method:
+        job.domain_randomization_request.sampling_method = args.sampling_method
+    snapshot = SceneSnapshot.load(args.snapshot) if args.snapshot else None
+    columns, stats = DryRun(job, snapshot, args.frames).run()
+    write_dry_run(args.output_dir or os.path.join(job.output_dir, "dry_run"), columns, stats)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Per frame parameters of all randomizers of a job: defect placements and textures, camera poses, lights, colors and
+materials. They are sampled on the CPU before the graph is built and fed to it as sequences, so every frame can be
+recorded to a sidecar log and replayed later.
+"""
+import json
+import os
+from typing import Callable, Dict, List, Sequence, Tuple
+import numpy as np
+from defect.generation.core.sampling.frame_plan import FramePlan
+from defect.generation.core.sampling.low_discrepancy import create_sampler
+from defect.generation.core.sampling.schedules import FrameSchedule
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest
+from defect.generation.utils.seed_plan import SeedPlan
+
+FRAME_PARAMETERS_FILE = "frame_parameters.npz"
+LIGHT_ATTRIBUTES = ["color", "intensity", "position", "scale", "rotation"]
+
+
+def list_defect_textures(texture_dir: str, defect_names: Sequence[str], suffix: str = "_D.png") -> Dict[str, List[str]]:
+    # Sorted texture files of every defect type, the listing of the change_defect_image randomizer
+    textures = {}
+    for defect_name in dict.fromkeys(defect_names):
+        directory = os.path.join(texture_dir, defect_name)
+        textures[defect_name] = sorted(file for file in os.listdir(directory) if file.endswith(suffix)) if os.path.isdir(directory) else []
+    return textures
+
+
+def texture_probabilities(texture_files: List[str], weights: Dict[str, float] = None):
+    # Probability of every texture file of a defect type, None to pick them uniformly
+    if not weights:
+        return None
+    probabilities = np.array([max(weights.get(file, 1.0), 0.0) for file in texture_files], dtype=np.float64)
+    if probabilities.sum() <= 0:
+        return None
+    return probabilities / probabilities.sum()
+
+
+class FrameParameters:
+    """
+    Columns indexed by frame, then by defect, camera, light or prim, and the tables the indices refer to.
+
+    Parameters:
+        columns (Dict[str, np.ndarray]): Per frame values, "frame" holds the frame id written by the writer.
+        tables (Dict): Json serializable tables: defect uuids and names, texture files per defect type, render products,
+            color and material prims and options.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], tables: Dict) -> None:
+        self.columns = columns
+        self.tables = tables
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.columns["frame"])
+
+    @property
+    def frame_ids(self) -> List[int]:
+        return self.columns["frame"].tolist()
+
+    def select(self, frame_ids: Sequence[int]) -> "FrameParameters":
+        # Rows of the given frame ids, in the given order
+        rows = {frame_id: row for row, frame_id in enumerate(self.frame_ids)}
+        missing = [frame_id for frame_id in frame_ids if frame_id not in rows]
+        if missing:
+            raise ValueError(f"Frames {missing} are not in the parameter log")
+        indices = np.array([rows[frame_id] for frame_id in frame_ids], dtype=np.int64)
+        return FrameParameters({name: column[indices] for name, column in self.columns.items()}, self.tables)
+
+    def frame_range(self, start_frame: int, frames: int) -> "FrameParameters":
+        # Rows of the frame ids from start_frame to start_frame + frames, the frames of a shard of the job
+        frame_ids = self.columns["frame"]
+        rows = np.nonzero((frame_ids >= start_frame) & (frame_ids < start_frame + frames))[0]
+        return FrameParameters({name: column[rows] for name, column in self.columns.items()}, self.tables)
+
+    @classmethod
+    def concatenate(cls, parts: List["FrameParameters"]) -> "FrameParameters":
+        # Frames of several shards of the same job, the tables of the first shard are kept
+        names = parts[0].columns.keys()
+        return cls({name: np.concatenate([part.columns[name] for part in parts]) for name in names}, parts[0].tables)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, tables=np.array(json.dumps(self.tables)), **self.columns)
+
+    @classmethod
+    def load(cls, path: str) -> "FrameParameters":
+        with np.load(path) as arrays:
+            columns = {name: arrays[name] for name in arrays.files if name != "tables"}
+            tables = json.loads(str(arrays["tables"]))
+        return cls(columns, tables)
+
+    def defect_sequences(self, uuid: str) -> Dict[str, list]:
+        # Per frame values of a defect, as python values for rep.distribution.sequence
+        index = self.tables["defect_uuids"].index(uuid)
+        return {
+            "position": [tuple(value) for value in self.columns["defect_position"][:, index].tolist()],
+            "rotation": [tuple(value) for value in self.columns["defect_rotation"][:, index].tolist()],
+            "scale": [tuple(value) for value in self.columns["defect_scale"][:, index].tolist()],
+            "visibility": self.columns["defect_shown"][:, index].tolist(),
+            "texture": self.columns["defect_texture"][:, index].tolist(),
+        }
+
+    def camera_sequences(self, camera_index: int) -> Dict[str, list]:
+        return {
+            "position": [tuple(value) for value in self.columns["camera_position"][:, camera_index].tolist()],
+            "look_at": [tuple(value) for value in self.columns["camera_look_at"][:, camera_index].tolist()],
+        }
+
+    def light_sequences(self, light_index: int) -> Dict[str, list]:
+        sequences = {}
+        for attribute in LIGHT_ATTRIBUTES:
+            column = self.columns.get(f"light_{attribute}")
+            if column is not None:
+                values = column[:, light_index].tolist()
+                sequences[attribute] = [tuple(value) if isinstance(value, list) else value for value in values]
+        return sequences
+
+    def choices(self, column: str, key: str, table: str) -> List[int]:
+        # Per frame option indices of the prim (or material) key of a choice column
+        return self.columns[column][:, self.tables[table].index(key)].tolist()
+
+
+def check_replay(frame_parameters: FrameParameters, defect_uuids: List[str], textures: Dict[str, List[str]], camera_count: int = None,
+                 prim_colors: Dict[str, list] = None, material_options: Dict[str, List[str]] = None):
+    """
+    Check that recorded frame parameters can be replayed by the graph of a request: the graph indexes the textures,
+    colors and materials of the request with the recorded choices.
+
+    Parameters:
+        frame_parameters (FrameParameters): The recorded frames.
+        defect_uuids (List[str]): Uuids of the defects of the request, in order.
+        textures (Dict[str, List[str]]): Texture files of every defect type, see list_defect_textures.
+        camera_count (int): Number of randomized cameras, None without camera randomization.
+        prim_colors (Dict[str, list]): Colors of every color randomized prim, None without color randomization.
+        material_options (Dict[str, List[str]]): Materials of every material randomized prim, None without material randomization.
+
+    Raises:
+        ValueError: If the recorded frames do not match the request.
+    """
+    tables = frame_parameters.tables
+    if tables["defect_uuids"] != defect_uuids:
+        raise ValueError("The defects of the request do not match the defects of the recorded frames")
+    for defect_name, texture_files in textures.items():
+        if tables["textures"].get(defect_name, texture_files) != texture_files:
+            raise ValueError(f"The {defect_name} textures of the texture directory do not match the textures of the recorded frames")
+    if camera_count is not None and frame_parameters.columns["camera_position"].shape[1] != camera_count:
+        raise ValueError(f"The request has {camera_count} cameras, the recorded frames {frame_parameters.columns['camera_position'].shape[1]}")
+
+    def check_choices(column: str, table: str, options: Dict[str, list], name: str):
+        # Every key of options must have recorded choices within its options
+        recorded = tables.get(table, [])
+        missing = [key for key in options if key not in recorded]
+        if missing:
+            raise ValueError(f"The recorded frames have no {name} choices for {missing}")
+        for key, key_options in options.items():
+            choices = frame_parameters.columns[column][:, recorded.index(key)]
+            if len(choices) and choices.max() >= len(key_options):
+                raise ValueError(f"The recorded frames choose {name} {int(choices.max())} of {key}, the request has {len(key_options)}")
+
+    if prim_colors:
+        check_choices("color_choice", "color_prims", prim_colors, "color")
+    if material_options:
+        if tables.get("material_options") != material_options:
+            raise ValueError("The materials of the request do not match the materials of the recorded frames")
+        check_choices("material_choice", "material_prims", material_options, "material")
+        if prim_colors:
+            material_colors = {material: prim_colors[prim_path] for prim_path, options in material_options.items()
+                               if prim_path in prim_colors for material in options}
+            check_choices("material_color_choice", "material_colors", material_colors, "material color")
+
+
+def sample_frame_parameters(defect_generation_request: DefectGenerationRequest, domain_randomization_request: DomainRandomizationRequest,
+                            frame_plan: FramePlan, seed_plan: SeedPlan, textures: Dict[str, List[str]],
+                            material_options: Dict[str, List[str]] = None, render_products: List[str] = None) -> FrameParameters:
+    """
+    Sample the parameters of every frame of a frame plan.
+
+    Parameters:
+        defect_generation_request (DefectGenerationRequest): The defects of the job.
+        domain_randomization_request (DomainRandomizationRequest): The randomization of the job.
+        frame_plan (FramePlan): Defect placements and camera poses of the frames.
+        seed_plan (SeedPlan): Seeds of the job, every randomizer draws from its own stream.
+        textures (Dict[str, List[str]]): Texture files of every defect type, see list_defect_textures.
+        material_options (Dict[str, List[str]]): Materials each material prim picks from, the created materials if None.
+        render_products (List[str]): Render product paths, in camera order.
+
+    Returns:
+        FrameParameters: The parameters of all frames, frame ids start at the start frame of the seed plan.
+    """
+    num_frames = frame_plan.num_frames
+    frames = frame_plan.frames
+    schedule = FrameSchedule(domain_randomization_request.parameter_schedules, seed_plan.start_frame)
+    defects = [defect for prim_defect in defect_generation_request.prim_defects for defect in prim_defect.iter_defects()]
+    columns = {
+        "frame": seed_plan.start_frame + frames,
+        "defect_position": frame_plan.positions,
+        "defect_rotation": frame_plan.rotations,
+        "defect_scale": frame_plan.scales,
+        "defect_shown": frame_plan.shown,
+        "camera_position": frame_plan.camera_positions,
+        "camera_look_at": frame_plan.look_ats,
+        "camera_visible_defects": frame_plan.visibility.sum(axis=2),
+    }
+    tables = {
+        "defect_uuids": frame_plan.defect_uuids,
+        "defect_names": [defect.defect_name for defect in defects],
+        "textures": textures,
+        "render_products": render_products or [],
+    }
+
+    # Texture index of every defect, the same index picks the diffuse, normal and roughness maps
+    texture_choices = np.full((num_frames, len(defects)), -1, dtype=np.int64)
+    # Texture probabilities by defect type, shared by all the defects of the type
+    probabilities = {defect_name: texture_probabilities(texture_files, defect_generation_request.texture_weights.get(defect_name))
+                     for defect_name, texture_files in textures.items()}
+    for index, defect in enumerate(defects):
+        if textures.get(defect.defect_name):
+            rng = np.random.default_rng(seed_plan.seed("change_defect_image.texture", defect.uuid))
+            weights = probabilities[defect.defect_name]
+            if weights is None:
+                texture_choices[:, index] = rng.integers(0, len(textures[defect.defect_name]), num_frames)
+            else:
+                texture_choices[:, index] = rng.choice(len(weights), num_frames, p=weights)
+    columns["defect_texture"] = texture_choices
+
+    light_params = domain_randomization_request.light_domain_randomization_params
+    if light_params.active:
+        tables["light_count"] = light_count = light_params.light_count or 1
+        # All attributes of a light are the dimensions of its sampler stream, one sample per frame
+        ranges = []
+        for attribute in LIGHT_ATTRIBUTES:
+            min_value = getattr(light_params, f"light_{attribute}_min_value")
+            max_value = getattr(light_params, f"light_{attribute}_max_value")
+            if min_value is None or max_value is None:
+                continue
+            shape = np.broadcast(np.asarray(min_value), np.asarray(max_value)).shape
+            # Per frame ranges, the scheduled ones change at their keyframes
+            bounds = []
+            for key, value in [(f"light_{attribute}_min_value", min_value), (f"light_{attribute}_max_value", max_value)]:
+                scheduled = schedule.values(key, frames, np.broadcast_to(np.asarray(value, dtype=np.float64), shape))
+                value = scheduled if scheduled is not None else np.broadcast_to(np.asarray(value, dtype=np.float64), (num_frames, *shape))
+                bounds.append(np.broadcast_to(value[:, None], (num_frames, light_count, *shape)))
+            ranges.append((attribute, *bounds))
+        if ranges:
+            sampler = create_sampler(domain_randomization_request.sampling_method, np.random.default_rng(seed_plan.seed("change_light")))
+            values = sampler.uniform(np.concatenate([low.reshape(num_frames, light_count, -1) for _, low, _ in ranges], axis=2),
+                                     np.concatenate([high.reshape(num_frames, light_count, -1) for _, _, high in ranges], axis=2))
+            offset = 0
+            for attribute, low, _ in ranges:
+                size = low[0, 0].size
+                columns[f"light_{attribute}"] = values[:, :, offset:offset + size].reshape(low.shape)
+                offset += size
+
+    color_params = domain_randomization_request.color_domain_randomization_params
+    prim_colors = color_params.prim_colors or {}
+    if color_params.active and prim_colors:
+        # One color of the prim colors per prim and frame
+        tables["color_prims"] = list(prim_colors)
+        columns["color_choice"] = np.stack([np.random.default_rng(seed_plan.seed("get_colors", prim_path)).integers(0, max(len(colors), 1), num_frames)
+                                            for prim_path, colors in prim_colors.items()], axis=1)
+
+    material_params = domain_randomization_request.material_domain_randomization_params
+    if material_params.active and material_params.material_prims:
+        if material_options is None:
+            material_options = {prim_path: list((material_params.created_materials or {}).get(prim_path) or [])
+                                for prim_path in material_params.material_prims}
+        tables["material_prims"] = list(material_options)
+        tables["material_options"] = material_options
+        columns["material_choice"] = np.stack([np.random.default_rng(seed_plan.seed("randomize_materials", prim_path)).integers(0, max(len(options), 1), num_frames)
+                                               for prim_path, options in material_options.items()], axis=1)
+        # Color of every candidate material when the materials are recolored with the prim colors
+        material_colors = [(prim_path, material) for prim_path, options in material_options.items() if prim_path in prim_colors for material in options]
+        if material_colors:
+            tables["material_colors"] = [material for _, material in material_colors]
+            columns["material_color_choice"] = np.stack([np.random.default_rng(seed_plan.seed("randomize_materials.color", material)).integers(0, max(len(prim_colors[prim_path]), 1), num_frames)
+                                                         for prim_path, material in material_colors], axis=1)
+    return FrameParameters(columns, tables)
+
+
+def merge_plan_stats(stats: List[Dict]) -> Dict:
+    # Statistics of the frame plans of several blocks, counts are summed and rates averaged over the sampled frames
+    frames = [block_stats["frames_sampled"] for block_stats in stats]
+    merged = {}
+    for key, value in stats[0].items():
+        if key in ("cameras", "defects"):
+            merged[key] = value
+        elif isinstance(value, float):
+            merged[key] = float(np.average([block_stats[key] for block_stats in stats], weights=frames)) if sum(frames) else 0.0
+        else:
+            merged[key] = sum(block_stats[key] for block_stats in stats)
+    return merged
+
+
+def sample_frame_range(plan_block: Callable[[SeedPlan, int], FramePlan], defect_generation_request: DefectGenerationRequest,
+                       domain_randomization_request: DomainRandomizationRequest, seed_plan: SeedPlan, start_frame: int, frames: int,
+                       job_frames: int, textures: Dict[str, List[str]], material_options: Dict[str, List[str]] = None,
+                       render_products: List[str] = None) -> Tuple[FrameParameters, Dict]:
+    """
+    Sample the parameters of the frames start_frame to start_frame + frames of a job. The frames of the job are sampled
+    in blocks of sampling_block_frames frames from the first frame of the job, every block from seeds of its own, and
+    only the blocks holding the requested frames are sampled: a shard pays for its own frames, not for the whole job,
+    and gets the same frames whatever the number of shards.
+
+    Parameters:
+        plan_block (Callable[[SeedPlan, int], FramePlan]): Defect placements and camera poses of a block, given the
+            seeds of the block and its number of frames.
+        defect_generation_request (DefectGenerationRequest): The defects of the job.
+        domain_randomization_request (DomainRandomizationRequest): The randomization of the job.
+        seed_plan (SeedPlan): Seeds of the job, starting at the first frame of the job.
+        start_frame (int): Frame id of the first frame to sample.
+        frames (int): Number of frames to sample.
+        job_frames (int): Number of frames of the whole job, the blocks do not depend on the frames sampled.
+        textures (Dict[str, List[str]]): Texture files of every defect type, see list_defect_textures.
+        material_options (Dict[str, List[str]]): Materials each material prim picks from, the created materials if None.
+        render_products (List[str]): Render product paths, in camera order.
+
+    Returns:
+        Tuple[FrameParameters, Dict]: The parameters of the frames, without the frames skipped by the frame plan, and
+            the statistics of the frame plans of the sampled blocks.
+    """
+    block_frames = max(min(domain_randomization_request.sampling_block_frames, job_frames), 1)
+    first_block = max(start_frame - seed_plan.start_frame, 0) // block_frames
+    end_block = -(-min(start_frame + frames - seed_plan.start_frame, job_frames) // block_frames)
+    parts = []
+    stats = []
+    for block in range(first_block, max(end_block, first_block + 1)):
+        block_seed_plan = seed_plan.for_block(block, block_frames)
+        frame_plan = plan_block(block_seed_plan, max(min(block_frames, job_frames - block * block_frames), 0))
+        parts.append(sample_frame_parameters(defect_generation_request, domain_randomization_request, frame_plan, block_seed_plan,
+                                             textures, material_options=material_options, render_products=render_products))
+        stats.append(frame_plan.stats)
+    return FrameParameters.concatenate(parts).frame_range(start_frame, frames), merge_plan_stats(stats)
@@ -0,0 +1,471 @@
+"""
+Presampling of the per frame defect placements and camera poses on the CPU. The sampled values are fed to the graph
+as sequences, so frames where no camera is predicted to see a defect can be resampled or skipped before rendering.
+"""
+import logging
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+import numpy as np
+from defect.generation.core.sampling.defect_visibility import sample_shown_defects
+from defect.generation.core.sampling.geometry import SurfaceSampler, map_to_bounds, map_to_shell, sample_in_cone, sample_in_shell
+from defect.generation.core.sampling.low_discrepancy import create_sampler
+from defect.generation.core.sampling.schedules import FrameSchedule
+from defect.generation.core.sampling.separation import reject_close_points
+from defect.generation.core.sampling.visibility import CameraIntrinsics, VisibilityPredictor
+from defect.generation.domain.models.camera_plan import CameraSpec
+from defect.generation.domain.models.defect_args import DefectArgs
+from defect.generation.domain.models.domain_randomization_request import CameraDomainRandomizationParameters, ParameterSchedule
+from defect.generation.utils.seed_plan import SeedPlan
+
+logger = logging.getLogger(__name__)
+
+# Column of the (rotation x, y, z, scale 1, h, w) ranges of a defect set by the defect args
+SCHEDULED_RANGE_ARGS = {"rot_x": 0, "rot_y": 1, "rot_z": 2, "dim_h": 4, "dim_w": 5}
+
+
+class DefectTrack:
+    """
+    Sampling ranges of one defect instance.
+
+    Parameters:
+        uuid (str): UUID of the defect.
+        surface (str): Key of the SurfaceSampler the defect is placed on, the target prim path.
+        rotation_range: (min, max) rotation in degrees per axis.
+        scale_range: (min, max) scale per axis.
+        visibility_probability (float): Probability of the projection being shown in a frame.
+        defect_name (str): Defect type, selects the parameter schedules of the defect.
+    """
+
+    def __init__(self, uuid: str, surface: str, rotation_range: Sequence, scale_range: Sequence, visibility_probability: float = 0.5,
+                 defect_name: str = None) -> None:
+        self.uuid = uuid
+        self.surface = surface
+        self.rotation_range = rotation_range
+        self.scale_range = scale_range
+        self.visibility_probability = visibility_probability
+        self.defect_name = defect_name
+
+    @classmethod
+    def from_args(cls, uuid: str, surface: str, args: DefectArgs, defect_name: str = None) -> "DefectTrack":
+        # Ranges of the validated defect args, missing args have the defaults of the args schema
+        return cls(
+            uuid,
+            surface,
+            rotation_range=((args.rot_x_min, args.rot_y_min, args.rot_z_min), (args.rot_x_max, args.rot_y_max, args.rot_z_max)),
+            scale_range=((1, args.dim_h_min, args.dim_w_min), (1, args.dim_h_max, args.dim_w_max)),
+            visibility_probability=args.visibility_probability,
+            defect_name=defect_name,
+        )
+
+
+class DefectTargeting:
+    """
+    Aim a camera at the defects placed in the frame instead of a random point of its look at bounds.
+
+    Parameters:
+        distance_range: (min, max) distance of the camera to the targeted defect, used for cameras without scatter prim.
+        jitter (float): Radius of the random offset of the look at point around the defect.
+        max_view_angle (float): Maximum angle in degrees between the view direction and the surface normal at the defect.
+        context_fraction (float): Fraction of the frames keeping the look at sampling of the camera, for context shots.
+    """
+
+    def __init__(self, distance_range: Sequence[float], jitter: float = 0.0, max_view_angle: float = 60.0, context_fraction: float = 0.2) -> None:
+        self.distance_range = distance_range
+        self.jitter = jitter
+        self.max_view_angle = max_view_angle
+        self.context_fraction = context_fraction
+
+
+class CameraTrack:
+    """
+    Sampling ranges of one camera. Positions are sampled inside the scatter bounds or, for cameras without a scatter
+    prim, in a shell around the center of their look at target.
+
+    Parameters:
+        look_at_bounds: Look at bounds, frame i looks at target i modulo the number of targets.
+        tangents: Tangents of the horizontal and vertical half fields of view of the render product.
+        scatter_bounds: (min, max) world bounds of the scatter prim.
+        distance_range: (min, max) distance of the camera to its look at center, used without scatter bounds.
+        targeting (DefectTargeting): Aim at the defects of the frame, None to sample the look at bounds.
+    """
+
+    def __init__(self, look_at_bounds: List[Sequence], tangents: Sequence[float], scatter_bounds: Sequence = None,
+                 distance_range: Sequence[float] = (0, 5), targeting: DefectTargeting = None) -> None:
+        self.look_at_bounds = look_at_bounds
+        self.tangents = tangents
+        self.scatter_bounds = scatter_bounds
+        self.distance_range = distance_range
+        self.targeting = targeting
+
+
+class FramePlan:
+    """
+    Sampled values of every frame, arrays are indexed by frame, then camera or defect. frames holds the index of every
+    planned frame from the first sampled frame, skipped frames leave gaps.
+    """
+
+    def __init__(self, defect_uuids: List[str], positions: np.ndarray, normals: np.ndarray, rotations: np.ndarray,
+                 scales: np.ndarray, shown: np.ndarray, camera_positions: np.ndarray, look_ats: np.ndarray,
+                 visibility: np.ndarray, stats: Dict, frames: np.ndarray = None) -> None:
+        self.defect_uuids = defect_uuids
+        self.frames = frames if frames is not None else np.arange(len(positions))
+        self.positions = positions
+        self.normals = normals
+        self.rotations = rotations
+        self.scales = scales
+        self.shown = shown
+        self.camera_positions = camera_positions
+        self.look_ats = look_ats
+        self.visibility = visibility
+        self.stats = stats
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.positions)
+
+
+class DefectPlacer:
+    """
+    Vectorized sampling of the placements and shown flags of all defects, positions are drawn from the placement
+    indices of their surfaces.
+
+    Parameters:
+        defects (List[DefectTrack]): Defect instances.
+        surfaces (Dict[str, SurfaceSampler]): Surfaces the defects are placed on, by DefectTrack.surface.
+        rng (np.random.Generator): Random generator, derived from the seed plan of the job.
+        max_visible_per_surface (int): Maximum number of defects shown per surface and frame, None for no limit.
+        min_separation (float): Minimum distance between two defects shown in a frame, None for no constraint.
+        max_separation_attempts (int): Resamples of the defects too close to another one, before hiding them.
+        sampling_method (str): Sampler of the rotation and scale ranges, see low_discrepancy.SAMPLING_METHODS.
+        schedule (FrameSchedule): Schedules of the defect args and budget, evaluated at the sampled frame indices.
+    """
+
+    def __init__(self, defects: List[DefectTrack], surfaces: Dict[str, SurfaceSampler], rng: np.random.Generator,
+                 max_visible_per_surface: int = None, min_separation: float = None, max_separation_attempts: int = 10,
+                 sampling_method: str = "uniform", schedule: FrameSchedule = None) -> None:
+        self.defects = defects
+        self.surfaces = surfaces
+        self.rng = rng
+        self.max_visible_per_surface = max_visible_per_surface
+        self.min_separation = min_separation
+        self.max_separation_attempts = max_separation_attempts
+        self.separation_resamples = self.separation_hidden = 0
+        # The rotation and scale ranges of every defect are the 6 dimensions of its own sampler stream, one sample per frame
+        self.sampling_method = sampling_method
+        self.sampler = create_sampler(sampling_method, rng)
+        self.schedule = schedule
+        self._defect_surfaces = np.array([defect.surface for defect in defects], dtype=object)
+        # (rotation x, y, z, scale 1, h, w) ranges of every defect
+        self._range_min = np.concatenate([np.array([defect.rotation_range[0] for defect in defects], dtype=np.float64).reshape(-1, 3),
+                                          np.array([defect.scale_range[0] for defect in defects], dtype=np.float64).reshape(-1, 3)], axis=1)
+        self._range_max = np.concatenate([np.array([defect.rotation_range[1] for defect in defects], dtype=np.float64).reshape(-1, 3),
+                                          np.array([defect.scale_range[1] for defect in defects], dtype=np.float64).reshape(-1, 3)], axis=1)
+        self._visibility_probability = np.array([defect.visibility_probability for defect in defects], dtype=np.float64)
+        # Defects grouped by surface, so every surface is sampled once per batch
+        self._surface_defects: Dict[str, np.ndarray] = {}
+        for index, defect in enumerate(defects):
+            self._surface_defects.setdefault(defect.surface, []).append(index)
+        self._surface_defects = {surface: np.array(indices) for surface, indices in self._surface_defects.items()}
+
+    def reseed(self, rng: np.random.Generator, schedule: FrameSchedule = None):
+        # Start the streams of another block of frames, the schedule is evaluated from the first frame of the block
+        self.rng = rng
+        self.sampler = create_sampler(self.sampling_method, rng)
+        self.schedule = schedule
+        self.separation_resamples = self.separation_hidden = 0
+
+    def sample(self, frames: np.ndarray):
+        # Positions, normals, rotations, scales and shown flags of all defects in the given frames
+        count, defect_count = len(frames), len(self.defects)
+        positions = np.zeros((count, defect_count, 3))
+        normals = np.zeros((count, defect_count, 3))
+        for surface, indices in self._surface_defects.items():
+            surface_positions, surface_normals = self.surfaces[surface].sample(count * len(indices), self.rng)
+            positions[:, indices] = surface_positions.reshape(count, len(indices), 3)
+            normals[:, indices] = surface_normals.reshape(count, len(indices), 3)
+        range_min, range_max, visibility_probability, max_visible = self._scheduled_parameters(frames)
+        ranges = self.sampler.uniform(range_min, range_max)
+        rotations, scales = ranges[..., :3], ranges[..., 3:]
+        shown = sample_shown_defects(visibility_probability, [defect.surface for defect in self.defects], count,
+                                     self.rng, max_per_group=max_visible)
+        if self.min_separation:
+            self._separate(positions, normals, shown)
+        return positions, normals, rotations, scales, shown
+
+    def _scheduled_parameters(self, frames: np.ndarray):
+        # Per frame ranges, visibility probabilities and budget, the request values unless a schedule changes them
+        count = len(frames)
+        range_min = np.repeat(self._range_min[None], count, axis=0)
+        range_max = np.repeat(self._range_max[None], count, axis=0)
+        visibility_probability = np.repeat(self._visibility_probability[None], count, axis=0)
+        max_visible = self.max_visible_per_surface
+        if not self.schedule:
+            return range_min, range_max, visibility_probability, max_visible
+        for index, defect in enumerate(self.defects):
+            for arg, column in SCHEDULED_RANGE_ARGS.items():
+                for bound, ranges in [("min", range_min), ("max", range_max)]:
+                    values = self.schedule.values(f"{arg}_{bound}", frames, ranges[0, index, column], defect.defect_name)
+                    if values is not None:
+                        ranges[:, index, column] = values
+            values = self.schedule.values("visibility_probability", frames, visibility_probability[0, index], defect.defect_name)
+            if values is not None:
+                visibility_probability[:, index] = values
+        values = self.schedule.values("max_visible_defects_per_prim", frames, max_visible or 0)
+        if values is not None:
+            max_visible = np.round(values).astype(np.int64)
+        return range_min, range_max, visibility_probability, max_visible
+
+    def _separate(self, positions: np.ndarray, normals: np.ndarray, shown: np.ndarray):
+        # Resample the shown defects closer than min_separation to another shown defect of their frame. Kept defects
+        # win over resampled ones, so every pass only moves the defects still in conflict
+        rows, columns = np.nonzero(shown)
+        resampled = np.zeros(len(rows), dtype=bool)
+        max_attempts = max(self.max_separation_attempts, 0)
+        for attempt in range(max_attempts + 1):
+            priorities = np.arange(len(rows)) + len(rows) * resampled
+            rejected = reject_close_points(positions[rows, columns], rows, self.min_separation, priorities)
+            if not rejected.any():
+                return
+            if attempt == max_attempts:
+                break
+            self.separation_resamples += int(rejected.sum())
+            for surface in np.unique(self._defect_surfaces[columns[rejected]]):
+                selected = np.nonzero(rejected & (self._defect_surfaces[columns] == surface))[0]
+                new_positions, new_normals = self.surfaces[surface].sample(len(selected), self.rng)
+                positions[rows[selected], columns[selected]] = new_positions
+                normals[rows[selected], columns[selected]] = new_normals
+            resampled = rejected
+        # Hide the defects that found no free spot rather than rendering them overlapped
+        self.separation_hidden += int(rejected.sum())
+        shown[rows[rejected], columns[rejected]] = False
+
+    def plan(self, num_frames: int) -> FramePlan:
+        # Defect placements of num_frames frames, without cameras nor visibility prediction
+        positions, normals, rotations, scales, shown = self.sample(np.arange(num_frames))
+        stats = {"frames_sampled": num_frames, "frames_planned": num_frames, "frames_skipped": 0, "cameras": 0, "defects": len(self.defects),
+                 "separation_resamples": self.separation_resamples, "separation_hidden": self.separation_hidden}
+        return FramePlan([defect.uuid for defect in self.defects], positions, normals, rotations, scales, shown,
+                         np.zeros((num_frames, 0, 3)), np.zeros((num_frames, 0, 3)),
+                         np.zeros((num_frames, 0, len(self.defects)), dtype=bool), stats)
+
+
+class FramePlanner:
+    """
+    Sample defect placements and camera poses for all frames at once and resample the ones predicted to be empty:
+    cameras that see no defect are resampled up to max_camera_attempts times, then the defects of frames that no camera
+    sees are resampled, up to max_defect_attempts times.
+
+    Parameters:
+        defects (List[DefectTrack]): Defect instances.
+        surfaces (Dict[str, SurfaceSampler]): Surfaces the defects are placed on, by DefectTrack.surface.
+        cameras (List[CameraTrack]): Cameras.
+        predictor (VisibilityPredictor): Visibility test.
+        rng (np.random.Generator): Random generator, derived from the seed plan of the job.
+        max_visible_per_surface (int): Maximum number of defects shown per surface and frame, None for no limit.
+        min_separation (float): Minimum distance between two defects shown in a frame, None for no constraint.
+        sampling_method (str): Sampler of the defect ranges and camera poses, see low_discrepancy.SAMPLING_METHODS.
+        schedule (FrameSchedule): Schedules of the defect args and budget.
+    """
+
+    def __init__(self, defects: List[DefectTrack], surfaces: Dict[str, SurfaceSampler], cameras: List[CameraTrack],
+                 predictor: VisibilityPredictor, rng: np.random.Generator, max_visible_per_surface: int = None,
+                 min_separation: float = None, sampling_method: str = "uniform", schedule: FrameSchedule = None) -> None:
+        self.defects = defects
+        self.surfaces = surfaces
+        self.cameras = cameras
+        self.predictor = predictor
+        self.rng = rng
+        self.placer = DefectPlacer(defects, surfaces, rng, max_visible_per_surface=max_visible_per_surface, min_separation=min_separation,
+                                   sampling_method=sampling_method, schedule=schedule)
+        # The look at point and position of a camera are the dimensions of one sample, every camera continues its own sequence
+        self.sampling_method = sampling_method
+        self.camera_samplers = [create_sampler(sampling_method, rng) for _ in cameras]
+        # Index of the first planned frame in the job, multiplexed cameras cycle through their targets over the job
+        self.first_frame = 0
+        self._tangents = np.array([camera.tangents for camera in cameras], dtype=np.float64).reshape(-1, 2)
+        # Centers of the surfaces of the defects, used to orient the surface normals outwards
+        self._defect_centers = np.array([surfaces[defect.surface].center for defect in defects], dtype=np.float64).reshape(-1, 3)
+
+    def reseed(self, rng: np.random.Generator, schedule: FrameSchedule = None, first_frame: int = 0):
+        # Start the streams of the block of frames from first_frame, keeping the geometry and visibility test
+        self.rng = rng
+        self.placer.reseed(rng, schedule)
+        self.camera_samplers = [create_sampler(self.sampling_method, rng) for _ in self.cameras]
+        self.first_frame = first_frame
+
+    def sample_defects(self, frames: np.ndarray):
+        return self.placer.sample(frames)
+
+    def sample_cameras(self, frames: np.ndarray, camera_indices: np.ndarray, positions: np.ndarray, normals: np.ndarray, shown: np.ndarray):
+        # Positions and look at points of camera_indices[i] in frames[i], given the defects of all frames, and whether
+        # each pose is aimed at a defect
+        camera_positions = np.zeros((len(frames), 3))
+        look_ats = np.zeros((len(frames), 3))
+        targeted = np.zeros(len(frames), dtype=bool)
+        for camera_index in np.unique(camera_indices):
+            selected = np.nonzero(camera_indices == camera_index)[0]
+            camera = self.cameras[camera_index]
+            targets = np.asarray(camera.look_at_bounds, dtype=np.float64)
+            target_bounds = targets[(self.first_frame + frames[selected]) % len(targets)]
+            units = self.camera_samplers[camera_index].random(len(selected), 6)
+            look_ats[selected] = target_bounds[:, 0] + units[:, :3] * (target_bounds[:, 1] - target_bounds[:, 0])
+            if camera.scatter_bounds is not None:
+                camera_positions[selected] = map_to_bounds(camera.scatter_bounds, units[:, 3:])
+            else:
+                camera_positions[selected] = map_to_shell(targets[0].mean(axis=0), camera.distance_range[0], camera.distance_range[1], units[:, 3:])
+            if camera.targeting is not None:
+                targeted[selected] = self._target_defects(camera, selected, frames[selected], target_bounds, camera_positions, look_ats, positions, normals, shown)
+        return camera_positions, look_ats, targeted
+
+    def _target_defects(self, camera: CameraTrack, rows: np.ndarray, frames: np.ndarray, target_bounds: np.ndarray,
+                        camera_positions: np.ndarray, look_ats: np.ndarray, positions: np.ndarray, normals: np.ndarray, shown: np.ndarray):
+        # Replace the poses of rows that are not context shots by poses aimed at a defect shown in their frame, returns
+        # the rows that were aimed
+        targeting = camera.targeting
+        frame_positions, frame_shown = positions[frames], shown[frames]
+        # Prefer the defects inside the look at bounds of the camera, then any shown defect
+        inside = np.all((frame_positions >= target_bounds[:, None, 0] - targeting.jitter)
+                        & (frame_positions <= target_bounds[:, None, 1] + targeting.jitter), axis=2)
+        candidates = np.where((frame_shown & inside).any(axis=1, keepdims=True), frame_shown & inside, frame_shown)
+        targeted = candidates.any(axis=1) & (self.rng.random(len(rows)) >= targeting.context_fraction)
+        if not np.any(targeted):
+            return targeted
+
+        # Pick one candidate per row uniformly
+        keys = np.where(candidates, self.rng.random(candidates.shape), -1.0)
+        chosen = np.argmax(keys, axis=1)[targeted]
+        targeted_frames = frames[targeted]
+        defect_positions = positions[targeted_frames, chosen]
+        offsets = sample_in_shell((0.0, 0.0, 0.0), 0.0, targeting.jitter, len(chosen), self.rng) if targeting.jitter > 0 else 0.0
+        look_ats[rows[targeted]] = defect_positions + offsets
+        if camera.scatter_bounds is not None:
+            return targeted
+
+        # Place the camera in front of the defect, within max_view_angle of the surface normal pointing away from the surface center
+        defect_normals = normals[targeted_frames, chosen]
+        inwards = np.einsum("nk,nk->n", defect_normals, defect_positions - self._defect_centers[chosen]) < 0
+        defect_normals[inwards] *= -1
+        degenerate = np.linalg.norm(defect_normals, axis=1) < 0.5
+        defect_normals[degenerate] = sample_in_shell((0.0, 0.0, 0.0), 1.0, 1.0, int(degenerate.sum()), self.rng)
+        directions = sample_in_cone(defect_normals, targeting.max_view_angle, self.rng)
+        distances = self.rng.uniform(targeting.distance_range[0], targeting.distance_range[1], len(chosen))
+        camera_positions[rows[targeted]] = defect_positions + directions * distances[:, None]
+        return targeted
+
+    def plan(self, num_frames: int, max_camera_attempts: int = 10, max_defect_attempts: int = 3, skip_rejected: bool = False) -> FramePlan:
+        """
+        Sample num_frames frames.
+
+        Parameters:
+            num_frames (int): Number of frames to sample.
+            max_camera_attempts (int): Samples of a camera pose per defect placement before giving up.
+            max_defect_attempts (int): Defect placements of a frame before giving up.
+            skip_rejected (bool): Drop the frames no camera is predicted to see a defect in.
+
+        Returns:
+            FramePlan: The sampled frames and the acceptance statistics.
+        """
+        all_frames = np.arange(num_frames)
+        camera_count = len(self.cameras)
+        positions, normals, rotations, scales, shown = self.sample_defects(all_frames)
+        frame_grid, camera_grid = np.meshgrid(all_frames, np.arange(camera_count), indexing="ij")
+        camera_positions, look_ats, targeted = self.sample_cameras(frame_grid.ravel(), camera_grid.ravel(), positions, normals, shown)
+        camera_positions = camera_positions.reshape(num_frames, camera_count, 3)
+        look_ats = look_ats.reshape(num_frames, camera_count, 3)
+        targeted = targeted.reshape(num_frames, camera_count)
+
+        def update_visibility(frames):
+            return self.predictor.visible(camera_positions[frames], look_ats[frames], self._tangents,
+                                          positions[frames], normals[frames], shown[frames])
+
+        visibility = update_visibility(all_frames)
+        first_pass = visibility.any(axis=2)
+        accepted = first_pass.copy()
+        camera_samples = defect_samples = 0
+        for defect_attempt in range(max(max_defect_attempts, 1)):
+            for _ in range(max(max_camera_attempts, 1) - 1):
+                rejected_frames, rejected_cameras = np.nonzero(~accepted)
+                if len(rejected_frames) == 0:
+                    break
+                camera_samples += len(rejected_frames)
+                (camera_positions[rejected_frames, rejected_cameras], look_ats[rejected_frames, rejected_cameras],
+                 targeted[rejected_frames, rejected_cameras]) = self.sample_cameras(rejected_frames, rejected_cameras, positions, normals, shown)
+                frames = np.unique(rejected_frames)
+                visibility[frames] = update_visibility(frames)
+                accepted[frames] = visibility[frames].any(axis=2)
+
+            empty_frames = np.nonzero(~accepted.any(axis=1))[0]
+            if len(empty_frames) == 0 or defect_attempt == max(max_defect_attempts, 1) - 1:
+                break
+            # No pose of the cameras shows a defect, place the defects of the frame again
+            defect_samples += len(empty_frames)
+            (positions[empty_frames], normals[empty_frames], rotations[empty_frames],
+             scales[empty_frames], shown[empty_frames]) = self.sample_defects(empty_frames)
+            visibility[empty_frames] = update_visibility(empty_frames)
+            accepted[empty_frames] = visibility[empty_frames].any(axis=2)
+
+        kept = accepted.any(axis=1) if skip_rejected else np.ones(num_frames, dtype=bool)
+        # Final poses of the planned frames, for the cameras aiming at defects
+        targeting_cameras = np.array([camera.targeting is not None for camera in self.cameras], dtype=bool)
+        targeted_shots = int(targeted[kept][:, targeting_cameras].sum())
+        stats = {
+            "frames_sampled": num_frames,
+            "frames_planned": int(kept.sum()),
+            "frames_skipped": int(num_frames - kept.sum()),
+            "cameras": camera_count,
+            "defects": len(self.defects),
+            # Fraction of (frame, camera) pairs predicted to show a defect, before and after resampling
+            "first_pass_acceptance": float(first_pass.mean()) if first_pass.size else 0.0,
+            "acceptance": float(accepted.mean()) if accepted.size else 0.0,
+            "frame_acceptance": float(accepted.any(axis=1).mean()) if num_frames else 0.0,
+            "camera_resamples": int(camera_samples),
+            "defect_resamples": int(defect_samples),
+            "mean_visible_defects": float(visibility.sum(axis=2).mean()) if visibility.size else 0.0,
+            "targeted_shots": targeted_shots,
+            "context_shots": int(kept.sum() * targeting_cameras.sum()) - targeted_shots,
+            "separation_resamples": self.placer.separation_resamples,
+            "separation_hidden": self.placer.separation_hidden,
+        }
+        logger.info(f"Frame plan: {stats['frames_planned']} frames, acceptance {stats['first_pass_acceptance']:.1%} "
+                       f"-> {stats['acceptance']:.1%} after {camera_samples} camera and {defect_samples} defect resamples")
+        return FramePlan([defect.uuid for defect in self.defects], positions[kept], normals[kept], rotations[kept],
+                         scales[kept], shown[kept], camera_positions[kept], look_ats[kept], visibility[kept], stats,
+                         frames=np.nonzero(kept)[0])
+
+
+def create_camera_tracks(cameras: List[CameraSpec], resolutions: List[Tuple[int, int]],
+                         camera_params: CameraDomainRandomizationParameters, bounds_cache) -> List[CameraTrack]:
+    # Sampling ranges of the planned cameras, cameras without scatter prim are placed within the camera distance of their look at.
+    # bounds_cache gives the world bounds of the scatter prims, a WorldBoundsCache in Kit or a SceneSnapshot in dry runs
+    intrinsics = CameraIntrinsics()
+    max_distance = camera_params.camera_distance_max_value if camera_params.camera_distance_max_value is not None else 5
+    min_distance = min(camera_params.camera_distance_min_value or 0, max_distance)
+
+    targeting = None
+    targeting_params = camera_params.defect_targeting
+    if targeting_params.active:
+        target_max_distance = targeting_params.distance_max_value if targeting_params.distance_max_value is not None else max_distance
+        target_min_distance = targeting_params.distance_min_value if targeting_params.distance_min_value is not None else min_distance
+        targeting = DefectTargeting((min(target_min_distance, target_max_distance), target_max_distance),
+                                    jitter=targeting_params.jitter, max_view_angle=targeting_params.max_view_angle,
+                                    context_fraction=targeting_params.context_fraction)
+
+    tracks = []
+    for camera_spec, resolution in zip(cameras, resolutions):
+        scatter_bounds = bounds_cache.get_bounds(camera_spec.scatter_prim_path) if camera_spec.scatter_prim_path else None
+        tracks.append(CameraTrack(camera_spec.look_at_bounds, intrinsics.tangents(resolution), scatter_bounds=scatter_bounds,
+                                  distance_range=(min_distance, max_distance), targeting=targeting))
+    return tracks
+
+
+def create_block_planner(planner: Union[FramePlanner, DefectPlacer], job_seed_plan: SeedPlan, schedules: List[ParameterSchedule],
+                         **plan_args) -> Callable[[SeedPlan, int], FramePlan]:
+    # Plan of a block of frames for frame_parameters.sample_frame_range: the planner is reseeded with the seeds of the
+    # block and evaluates the schedules from the first frame of the block. plan_args are passed to the plan method
+    def plan_block(seed_plan: SeedPlan, num_frames: int) -> FramePlan:
+        schedule = FrameSchedule(schedules, seed_plan.start_frame)
+        if isinstance(planner, FramePlanner):
+            planner.reseed(np.random.default_rng(seed_plan.seed("frame_plan")), schedule, seed_plan.start_frame - job_seed_plan.start_frame)
+        else:
+            planner.reseed(np.random.default_rng(seed_plan.seed("defect_placement")), schedule)
+        return planner.plan(num_frames, **plan_args)
+    return plan_block
@@ -0,0 +1,137 @@
+"""
+Pure numpy geometry used to presample defect placements and camera poses on the CPU, without Kit.
+"""
+from typing import Sequence, Tuple
+import numpy as np
+
+
+class SurfaceSampler:
+    """
+    Uniform sampling of points on a triangle mesh, triangles are picked proportionally to their area, like
+    rep.randomizer.scatter_2d does on the GPU.
+
+    Parameters:
+        vertices (np.ndarray): (N, 3) world space vertices.
+        triangles (np.ndarray): (M, 3) vertex indices of every triangle.
+        face_mask (np.ndarray): (M,) booleans, only the triangles set are sampled. None samples all triangles.
+    """
+
+    def __init__(self, vertices: np.ndarray, triangles: np.ndarray, face_mask: np.ndarray = None) -> None:
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.triangles = np.asarray(triangles, dtype=np.int64)
+        corners = self.vertices[self.triangles]
+        cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        double_areas = np.linalg.norm(cross, axis=1)
+        self.areas = double_areas / 2
+        self.normals = cross / np.maximum(double_areas, 1e-12)[:, None]
+        self.face_mask = None
+        self.set_face_mask(face_mask)
+
+    def set_face_mask(self, face_mask: np.ndarray = None):
+        # Masked out triangles get a zero width in the cdf, so they are never picked
+        self.face_mask = None if face_mask is None else np.asarray(face_mask, dtype=bool)
+        weights = self.areas if self.face_mask is None else np.where(self.face_mask, self.areas, 0.0)
+        self.total_area = float(weights.sum())
+        self.cdf = np.cumsum(weights) / self.total_area if self.total_area > 0 else np.zeros(0)
+
+    @property
+    def center(self) -> np.ndarray:
+        # Area weighted centroid of the whole surface, masked triangles included
+        full_area = self.areas.sum()
+        if full_area <= 0:
+            return np.zeros(3)
+        centroids = self.vertices[self.triangles].mean(axis=1)
+        return (centroids * self.areas[:, None]).sum(axis=0) / full_area
+
+    def outward_normals(self) -> np.ndarray:
+        # Face normals flipped to point away from the center of the surface, for meshes with inconsistent winding
+        centroids = self.vertices[self.triangles].mean(axis=1)
+        inwards = np.einsum("nk,nk->n", self.normals, centroids - self.center) < 0
+        return np.where(inwards[:, None], -self.normals, self.normals)
+
+    def facing_mask(self, viewpoints: np.ndarray) -> np.ndarray:
+        # Triangles whose outward side faces at least one of the (K, 3) viewpoints
+        centroids = self.vertices[self.triangles].mean(axis=1)
+        normals = self.outward_normals()
+        mask = np.zeros(len(self.triangles), dtype=bool)
+        for viewpoint in np.asarray(viewpoints, dtype=np.float64).reshape(-1, 3):
+            mask |= np.einsum("nk,nk->n", normals, viewpoint - centroids) > 0
+        return mask
+
+    @property
+    def is_empty(self) -> bool:
+        return self.total_area <= 0
+
+    def sample_triangles(self, count: int, rng: np.random.Generator) -> np.ndarray:
+        # Area weighted triangle indices
+        return np.minimum(np.searchsorted(self.cdf, rng.random(count), side="right"), len(self.cdf) - 1)
+
+    def sample(self, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sample points uniformly on the surface.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (count, 3) positions and (count, 3) face normals.
+        """
+        if self.is_empty:
+            return np.zeros((count, 3)), np.zeros((count, 3))
+        triangle_indices = self.sample_triangles(count, rng)
+        return self.sample_on_triangles(triangle_indices, rng), self.normals[triangle_indices]
+
+    def sample_on_triangles(self, triangle_indices: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        # Uniform barycentric coordinates, folding the samples of the unit square outside the triangle back into it
+        u, v = rng.random(len(triangle_indices)), rng.random(len(triangle_indices))
+        outside = u + v > 1
+        u[outside], v[outside] = 1 - u[outside], 1 - v[outside]
+        corners = self.vertices[self.triangles[triangle_indices]]
+        return corners[:, 0] + u[:, None] * (corners[:, 1] - corners[:, 0]) + v[:, None] * (corners[:, 2] - corners[:, 0])
+
+
+def map_to_bounds(bounds: Sequence, units: np.ndarray) -> np.ndarray:
+    # Map (count, 3) points of the unit cube to axis aligned (min, max) bounds
+    min_coordinates, max_coordinates = np.asarray(bounds[0], dtype=np.float64), np.asarray(bounds[1], dtype=np.float64)
+    return min_coordinates + units * (max_coordinates - min_coordinates)
+
+
+def sample_in_shell(center: Sequence[float], min_radius: float, max_radius: float, count: int, rng: np.random.Generator) -> np.ndarray:
+    # Points uniformly distributed in the volume between two spheres around center
+    directions = rng.normal(size=(count, 3))
+    directions /= np.maximum(np.linalg.norm(directions, axis=1), 1e-12)[:, None]
+    radii = (min_radius ** 3 + rng.random(count) * (max_radius ** 3 - min_radius ** 3)) ** (1 / 3)
+    return np.asarray(center, dtype=np.float64) + directions * radii[:, None]
+
+
+def map_to_shell(center: Sequence[float], min_radius: float, max_radius: float, units: np.ndarray) -> np.ndarray:
+    # Map (count, 3) points of the unit cube to points uniformly distributed in the volume between two spheres, so
+    # that evenly spread unit points stay evenly spread in the shell
+    cos_theta = 1 - 2 * units[:, 0]
+    sin_theta = np.sqrt(np.maximum(1 - cos_theta ** 2, 0))
+    phi = 2 * np.pi * units[:, 1]
+    directions = np.stack([sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta], axis=1)
+    radii = (min_radius ** 3 + units[:, 2] * (max_radius ** 3 - min_radius ** 3)) ** (1 / 3)
+    return np.asarray(center, dtype=np.float64) + directions * radii[:, None]
+
+
+def sample_in_cone(axes: np.ndarray, max_angle: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sample unit directions uniformly inside cones around axes.
+
+    Parameters:
+        axes (np.ndarray): (count, 3) unit cone axes.
+        max_angle (float): Half angle of the cones in degrees.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        np.ndarray: (count, 3) unit directions.
+    """
+    count = len(axes)
+    cos_theta = 1 - rng.random(count) * (1 - np.cos(np.radians(max_angle)))
+    sin_theta = np.sqrt(np.maximum(1 - cos_theta ** 2, 0))
+    phi = rng.random(count) * 2 * np.pi
+    # Orthonormal basis around every axis
+    helpers = np.where(np.abs(axes[:, :1]) < 0.9, [[1.0, 0.0, 0.0]], [[0.0, 1.0, 0.0]])
+    tangents = np.cross(axes, helpers)
+    tangents /= np.maximum(np.linalg.norm(tangents, axis=1), 1e-12)[:, None]
+    bitangents = np.cross(axes, tangents)
+    return (axes * cos_theta[:, None] + tangents * (sin_theta * np.cos(phi))[:, None]
+            + bitangents * (sin_theta * np.sin(phi))[:, None])
@@ -0,0 +1,261 @@
+"""
+Samplers of the randomization ranges. Independent uniform draws cover a range x range x ... space slowly, scrambled
+Sobol and Latin hypercube points spread the frames evenly over it, so fewer frames reach the same coverage. Samplers
+draw their scrambling from the random generator of the randomizer, so they stay deterministic per seed plan.
+
+Ranges of shape (count, streams, dims) are sampled per stream: the ranges of one defect or one light are the dimensions
+of a stream, and every stream has its own independently scrambled and paired Sobol points. The direction number table
+only has SOBOL_MAX_DIMENSIONS dimensions, so a job with many defects cannot use one Sobol point for all of them.
+"""
+import argparse
+import logging
+import sys
+from typing import Dict, List, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_METHODS = ["uniform", "sobol", "latin_hypercube"]
+SOBOL_BITS = 32
+# Sobol direction numbers (s, a, m) of dimensions 1 to 20, from the new-joe-kuo-6.21201 table. Dimension 0 is the
+# van der Corput sequence
+_SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+SOBOL_MAX_DIMENSIONS = len(_SOBOL_DIRECTIONS) + 1
+
+
+def sobol_direction_numbers(dimension: int) -> List[int]:
+    # SOBOL_BITS direction numbers of a dimension, most significant bit first
+    if not 0 <= dimension < SOBOL_MAX_DIMENSIONS:
+        raise ValueError(f"Sobol sampling supports {SOBOL_MAX_DIMENSIONS} dimensions per stream, dimension {dimension} is out of range")
+    if dimension == 0:
+        return [1 << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]
+    s, a, m = _SOBOL_DIRECTIONS[dimension - 1]
+    directions = [m[k] << (SOBOL_BITS - 1 - k) for k in range(s)]
+    for k in range(s, SOBOL_BITS):
+        value = directions[k - s] ^ (directions[k - s] >> s)
+        for l in range(1, s):
+            if (a >> (s - 1 - l)) & 1:
+                value ^= directions[k - l]
+        directions.append(value)
+    return directions
+
+
+def _parity(values: np.ndarray) -> np.ndarray:
+    # Parity of the set bits of uint64 values
+    for shift in (32, 16, 8, 4, 2, 1):
+        values = values ^ (values >> np.uint64(shift))
+    return values & np.uint64(1)
+
+
+def _scrambled_directions(dimensions: Sequence[int], streams: int, rng: np.random.Generator, chunk: int = 256) -> np.ndarray:
+    # (streams, dimensions, SOBOL_BITS) direction numbers with linear matrix scrambling: the direction numbers of every
+    # stream and dimension are multiplied by their own random lower triangular binary matrix with unit diagonal
+    base = np.array([sobol_direction_numbers(dimension) for dimension in dimensions], dtype=np.uint64).reshape(len(dimensions), SOBOL_BITS)
+    rows = np.arange(SOBOL_BITS, dtype=np.uint64)
+    # Random bits in the columns before the diagonal of every row, the more significant bits
+    above = rng.integers(0, 1 << np.arange(SOBOL_BITS, dtype=np.int64), size=(streams, len(dimensions), SOBOL_BITS)).astype(np.uint64)
+    matrices = (above << (np.uint64(SOBOL_BITS) - rows)) | (np.uint64(1) << (np.uint64(SOBOL_BITS - 1) - rows))
+    scrambled = np.zeros((streams, len(dimensions), SOBOL_BITS), dtype=np.uint64)
+    for start in range(0, streams, chunk):
+        # Bit row of the product is the parity of the matrix row and the direction number
+        bits = _parity(matrices[start:start + chunk, :, :, None] & base[None, :, None, :])
+        scrambled[start:start + chunk] = (bits << (np.uint64(SOBOL_BITS - 1) - rows)[None, None, :, None]).sum(axis=2, dtype=np.uint64)
+    return scrambled
+
+
+class ParameterSampler:
+    """
+    Independent uniform draws, the points of a call are (count, dims) samples of the unit cube.
+
+    Parameters:
+        rng (np.random.Generator): Random generator of the randomizer.
+    """
+    method = "uniform"
+
+    def __init__(self, rng: np.random.Generator) -> None:
+        self.rng = rng
+
+    def random(self, count: int, dims: int) -> np.ndarray:
+        return self.rng.random((count, dims))
+
+    def random_streams(self, count: int, streams: int, dims: int) -> np.ndarray:
+        # (count, streams, dims) samples, the streams are independent of each other
+        return self.random(count, streams * dims).reshape(count, streams, dims)
+
+    def uniform(self, low, high) -> np.ndarray:
+        # Samples of (count, ...) ranges, one sample per row, so the ranges can change from frame to frame. Ranges of
+        # shape (count, streams, dims...) are sampled per stream
+        low, high = np.broadcast_arrays(np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64))
+        if low.ndim > 2:
+            units = self.random_streams(len(low), low.shape[1], int(np.prod(low.shape[2:]))).reshape(low.shape)
+        else:
+            dims = int(np.prod(low.shape[1:]))
+            units = self.random(len(low), max(dims, 1))[:, :dims].reshape(low.shape)
+        return low + units * (high - low)
+
+
+class UniformSampler(ParameterSampler):
+    # Same draws as rng.uniform, the default of all randomizers
+    def uniform(self, low, high) -> np.ndarray:
+        low, high = np.broadcast_arrays(np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64))
+        return self.rng.uniform(low, high)
+
+
+class SobolSampler(ParameterSampler):
+    """
+    Scrambled Sobol sequence, with linear matrix scrambling and a random digital shift per stream and dimension. Every
+    call continues the sequence, so the points of successive calls, resamples included, stay evenly spread. Balance is
+    best over power of two counts. A stream has at most SOBOL_MAX_DIMENSIONS dimensions.
+    """
+    method = "sobol"
+
+    def __init__(self, rng: np.random.Generator) -> None:
+        super().__init__(rng)
+        self.index = 0
+        # (streams, dims, SOBOL_BITS) scrambled direction numbers and (streams, dims) digital shifts
+        self._directions = np.zeros((0, 0, SOBOL_BITS), dtype=np.uint64)
+        self._shifts = np.zeros((0, 0), dtype=np.uint64)
+
+    def _add_streams(self, streams: int, dims: int):
+        if dims > SOBOL_MAX_DIMENSIONS:
+            raise ValueError(f"Sobol sampling supports {SOBOL_MAX_DIMENSIONS} dimensions per stream, got {dims}")
+        known_streams, known_dims = self._shifts.shape
+        if dims > known_dims:
+            self._directions = np.concatenate([self._directions, _scrambled_directions(range(known_dims, dims), known_streams, self.rng)], axis=1)
+            self._shifts = np.concatenate([self._shifts, self.rng.integers(0, 1 << SOBOL_BITS, size=(known_streams, dims - known_dims), dtype=np.uint64)], axis=1)
+            known_dims = dims
+        if streams > known_streams:
+            self._directions = np.concatenate([self._directions, _scrambled_directions(range(known_dims), streams - known_streams, self.rng)], axis=0)
+            self._shifts = np.concatenate([self._shifts, self.rng.integers(0, 1 << SOBOL_BITS, size=(streams - known_streams, known_dims), dtype=np.uint64)], axis=0)
+
+    def random(self, count: int, dims: int) -> np.ndarray:
+        return self.random_streams(count, 1, dims)[:, 0]
+
+    def random_streams(self, count: int, streams: int, dims: int) -> np.ndarray:
+        self._add_streams(streams, dims)
+        indices = np.arange(self.index, self.index + count, dtype=np.uint64)
+        self.index += count
+        gray = indices ^ (indices >> np.uint64(1))
+        values = np.repeat(self._shifts[None, :streams, :dims], count, axis=0)
+        for bit in range(SOBOL_BITS):
+            selected = ((gray >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+            values[selected] ^= self._directions[:streams, :dims, bit]
+        if streams > 1:
+            # The same dimension of two streams is the same net under another scrambling, a deterministic function of
+            # the other stream. Pairing the points of every stream in its own random order makes the streams independent,
+            # the points of each stream stay the same balanced set
+            order = self.rng.permuted(np.tile(np.arange(count), (streams, 1)), axis=1)
+            values = values[order.T, np.arange(streams)]
+        return values / float(1 << SOBOL_BITS)
+
+
+class LatinHypercubeSampler(ParameterSampler):
+    # Every call stratifies each dimension into count intervals and draws one point per interval, in random order
+    method = "latin_hypercube"
+
+    def random(self, count: int, dims: int) -> np.ndarray:
+        strata = np.argsort(self.rng.random((dims, count)), axis=1).T
+        return (strata + self.rng.random((count, dims))) / max(count, 1)
+
+
+_SAMPLERS = {sampler.method: sampler for sampler in [UniformSampler, SobolSampler, LatinHypercubeSampler]}
+
+
+def create_sampler(method: str, rng: np.random.Generator) -> ParameterSampler:
+    if method not in _SAMPLERS:
+        raise ValueError(f"Unknown sampling method {method}, expected one of {SAMPLING_METHODS}")
+    return _SAMPLERS[method](rng)
+
+
+def centered_l2_discrepancy(points: np.ndarray) -> float:
+    # Hickernell's centered L2 discrepancy of (count, dims) points of the unit cube, lower is more uniform
+    points = np.asarray(points, dtype=np.float64)
+    count, dims = points.shape
+    offsets = np.abs(points - 0.5)
+    first = np.prod(1 + 0.5 * offsets - 0.5 * offsets ** 2, axis=1).sum()
+    second = 0.0
+    for row in range(count):
+        second += np.prod(1 + 0.5 * offsets[row] + 0.5 * offsets - 0.5 * np.abs(points[row] - points), axis=1).sum()
+    return float(np.sqrt(max((13 / 12) ** dims - 2 / count * first + second / count ** 2, 0.0)))
+
+
+def pair_coverage(points: np.ndarray, bins: int) -> float:
+    # Mean fraction of the bins x bins cells of every pair of dimensions holding at least one point
+    points = np.asarray(points, dtype=np.float64)
+    cells = np.minimum((points * bins).astype(np.int64), bins - 1)
+    dims = points.shape[1]
+    fractions = [len(np.unique(cells[:, i] * bins + cells[:, j])) / bins ** 2 for i in range(dims) for j in range(i + 1, dims)]
+    return float(np.mean(fractions)) if fractions else float(len(np.unique(cells)) / bins)
+
+
+def coverage_benchmark(dims: int, frame_counts: Sequence[int], repeats: int = 5, seed: int = 0, bins: int = 8) -> Dict[str, Dict[int, Dict[str, float]]]:
+    """
+    Compare the coverage of the sampling methods over the unit cube of a randomizer.
+
+    Parameters:
+        dims (int): Number of randomized parameters, e.g. 6 for the rotation and scale of a defect.
+        frame_counts (Sequence[int]): Numbers of frames to compare.
+        repeats (int): Seeds averaged per method and frame count.
+        seed (int): Seed of the first repeat.
+        bins (int): Cells per dimension of the pair coverage.
+
+    Returns:
+        Dict[str, Dict[int, Dict[str, float]]]: Mean discrepancy and pair coverage per method and frame count.
+    """
+    results = {}
+    for method in SAMPLING_METHODS:
+        results[method] = {}
+        for frames in frame_counts:
+            discrepancies, coverages = [], []
+            for repeat in range(repeats):
+                points = create_sampler(method, np.random.default_rng(seed + repeat)).random(frames, dims)
+                discrepancies.append(centered_l2_discrepancy(points))
+                coverages.append(pair_coverage(points, bins))
+            results[method][frames] = {"discrepancy": float(np.mean(discrepancies)), "pair_coverage": float(np.mean(coverages))}
+    return results
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Coverage of the randomization ranges per sampling method")
+    parser.add_argument("--dims", type=int, default=6, help="Number of randomized parameters")
+    parser.add_argument("--frames", type=int, nargs="+", default=[32, 64, 128, 256, 512], help="Frame counts to compare")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--bins", type=int, default=8, help="Cells per dimension of the pair coverage")
+    args = parser.parse_args(argv)
+
+    results = coverage_benchmark(args.dims, args.frames, args.repeats, bins=args.bins)
+    print(f"{'method':<16}{'frames':>8}{'discrepancy':>14}{'pair coverage':>16}")
+    for method, rows in results.items():
+        for frames, row in rows.items():
+            print(f"{method:<16}{frames:>8}{row['discrepancy']:>14.5f}{row['pair_coverage']:>16.1%}")
+    # Frames each method needs to reach the discrepancy of uniform sampling at the largest frame count
+    target = results["uniform"][args.frames[-1]]["discrepancy"]
+    for method, rows in results.items():
+        reached = [frames for frames, row in rows.items() if row["discrepancy"] <= target]
+        print(f"{method}: {min(reached) if reached else f'> {args.frames[-1]}'} frames to reach the uniform discrepancy at {args.frames[-1]} frames")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
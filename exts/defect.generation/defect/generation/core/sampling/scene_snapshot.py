@@ -0,0 +1,70 @@
+"""
+Scene geometry used by the CPU sampling, saved from Kit once so that dry runs can sample the defect placements and
+camera poses of a job without Kit nor the stage.
+"""
+import json
+from typing import Dict, Sequence, Tuple
+import numpy as np
+from defect.generation.core.sampling.geometry import SurfaceSampler
+
+Bounds = Tuple[Tuple[float, float, float], Tuple[float, float, float]]
+
+
+class SceneSnapshot:
+    """
+    Placement indices, prim bounds and up axis of a scene.
+
+    Parameters:
+        surfaces (Dict[str, SurfaceSampler]): Placement index of every target prim, and the occluder prims.
+        bounds (Dict[str, Bounds]): World bounds of the defect parent prims and camera scatter prims.
+        up_axis (Sequence[float]): Up axis of the stage.
+    """
+
+    def __init__(self, surfaces: Dict[str, SurfaceSampler], bounds: Dict[str, Bounds], up_axis: Sequence[float] = (0.0, 1.0, 0.0)) -> None:
+        self.surfaces = surfaces
+        self.bounds = bounds
+        self.up_axis = tuple(up_axis)
+
+    def get_bounds(self, prim_path) -> Bounds:
+        # Same lookup as WorldBoundsCache, prims missing from the snapshot have empty bounds
+        return self.bounds.get(str(prim_path), ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0)))
+
+    def get_triangles(self, prim_paths: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # All triangles of the surfaces of prim_paths, masked ones included, as (vertices, triangles)
+        vertices, triangles, offset = [], [], 0
+        for prim_path in prim_paths:
+            if prim_path not in self.surfaces:
+                continue
+            surface = self.surfaces[prim_path]
+            vertices.append(surface.vertices)
+            triangles.append(surface.triangles + offset)
+            offset += len(surface.vertices)
+        if not vertices:
+            return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+        return np.concatenate(vertices), np.concatenate(triangles)
+
+    def save(self, path: str):
+        arrays = {}
+        prim_paths = list(self.surfaces)
+        for index, prim_path in enumerate(prim_paths):
+            surface = self.surfaces[prim_path]
+            arrays[f"surface_{index}_vertices"] = surface.vertices
+            arrays[f"surface_{index}_triangles"] = surface.triangles
+            if surface.face_mask is not None:
+                arrays[f"surface_{index}_face_mask"] = surface.face_mask
+        metadata = {"surfaces": prim_paths, "bounds": self.bounds, "up_axis": self.up_axis}
+        arrays["metadata"] = np.array(json.dumps(metadata))
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "SceneSnapshot":
+        with np.load(path) as arrays:
+            metadata = json.loads(str(arrays["metadata"]))
+            surfaces = {}
+            for index, prim_path in enumerate(metadata["surfaces"]):
+                face_mask_key = f"surface_{index}_face_mask"
+                surfaces[prim_path] = SurfaceSampler(arrays[f"surface_{index}_vertices"], arrays[f"surface_{index}_triangles"],
+                                                     face_mask=arrays[face_mask_key] if face_mask_key in arrays else None)
+        bounds = {prim_path: (tuple(value[0]), tuple(value[1])) for prim_path, value in metadata["bounds"].items()}
+        return cls(surfaces, bounds, metadata["up_axis"])
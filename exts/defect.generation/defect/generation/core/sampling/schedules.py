@@ -0,0 +1,88 @@
+"""
+Parameter schedules: the defect args, light ranges and defect budget of a run can change at keyframes, so a single
+graph renders an easy to hard curriculum. Schedules are evaluated on the CPU for all frames at once, when the frame
+parameters are sampled.
+"""
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from defect.generation.domain.models.domain_randomization_request import LightDomainRandomizationParameters, ParameterSchedule
+
+logger = logging.getLogger(__name__)
+
+INTERPOLATIONS = ["step", "linear"]
+DEFECT_SCHEDULE_KEYS = ([f"rot_{axis}_{bound}" for axis in "xyz" for bound in ("min", "max")]
+                        + [f"dim_{axis}_{bound}" for axis in "hw" for bound in ("min", "max")]
+                        + ["visibility_probability"])
+LIGHT_SCHEDULE_KEYS = [name for name in LightDomainRandomizationParameters.__fields__ if name.endswith("_value")]
+SCHEDULE_KEYS = DEFECT_SCHEDULE_KEYS + LIGHT_SCHEDULE_KEYS + ["max_visible_defects_per_prim"]
+
+
+class FrameSchedule:
+    """
+    Per frame values of the scheduled parameters of a run.
+
+    Parameters:
+        schedules (List[ParameterSchedule]): Schedules of the request, later schedules override the keys of earlier ones.
+        start_frame (int): Frame id of the first frame of the run, the frame indices given to values are relative to it.
+    """
+
+    def __init__(self, schedules: List[ParameterSchedule], start_frame: int = 0) -> None:
+        self.schedules = schedules
+        self.start_frame = start_frame
+        for schedule in schedules:
+            if schedule.interpolation not in INTERPOLATIONS:
+                raise ValueError(f"Unknown schedule interpolation {schedule.interpolation}, expected one of {INTERPOLATIONS}")
+            unknown = sorted({key for keyframe in schedule.keyframes for key in keyframe.values} - set(SCHEDULE_KEYS))
+            if unknown:
+                logger.warning(f"Ignoring unknown scheduled parameters {unknown}, expected some of {SCHEDULE_KEYS}")
+        self._keyframes: Dict[Tuple[str, Optional[str]], Optional[Tuple[np.ndarray, list, str]]] = {}
+
+    def __bool__(self) -> bool:
+        return any(schedule.keyframes for schedule in self.schedules)
+
+    def _find(self, key: str, defect_name: str = None) -> Optional[Tuple[np.ndarray, list, str]]:
+        # Keyframes of the last schedule setting key for defect_name, as (sorted frames, values, interpolation)
+        if (key, defect_name) not in self._keyframes:
+            found = None
+            for schedule in self.schedules:
+                if defect_name is not None and schedule.defect_names is not None and defect_name not in schedule.defect_names:
+                    continue
+                keyframes = sorted((keyframe for keyframe in schedule.keyframes if key in keyframe.values), key=lambda keyframe: keyframe.frame)
+                if keyframes:
+                    found = (np.array([keyframe.frame for keyframe in keyframes], dtype=np.int64),
+                             [keyframe.values[key] for keyframe in keyframes], schedule.interpolation)
+            self._keyframes[(key, defect_name)] = found
+        return self._keyframes[(key, defect_name)]
+
+    def values(self, key: str, frames: Sequence[int], base, defect_name: str = None) -> Optional[np.ndarray]:
+        """
+        Evaluate a scheduled parameter.
+
+        Parameters:
+            key (str): Name of the parameter, one of SCHEDULE_KEYS.
+            frames (Sequence[int]): Frame indices of the run.
+            base: Value of the parameter before its first keyframe, from the request.
+            defect_name (str): Defect type of a defect arg.
+
+        Returns:
+            np.ndarray: (len(frames), *shape of base) values, None if the parameter is not scheduled.
+        """
+        found = self._find(key, defect_name)
+        if found is None:
+            return None
+        keyframe_frames, keyframe_values, interpolation = found
+        base = np.asarray(base, dtype=np.float64)
+        keyframe_values = np.array([np.broadcast_to(np.asarray(value, dtype=np.float64), base.shape) for value in keyframe_values])
+        frames = np.asarray(frames, dtype=np.int64) + self.start_frame
+        index = np.searchsorted(keyframe_frames, frames, side="right") - 1
+        started = index >= 0
+        index = np.maximum(index, 0)
+        values = keyframe_values[index]
+        if interpolation == "linear":
+            following = np.minimum(index + 1, len(keyframe_frames) - 1)
+            span = keyframe_frames[following] - keyframe_frames[index]
+            weights = np.where(span > 0, (frames - keyframe_frames[index]) / np.maximum(span, 1), 0.0)
+            weights = weights.reshape(-1, *([1] * base.ndim))
+            values = values + weights * (keyframe_values[following] - values)
+        return np.where(started.reshape(-1, *([1] * base.ndim)), values, base)
@@ -0,0 +1,73 @@
+"""
+Minimum separation between the defects of a frame, checked with a spatial hash over the sampled positions so that
+the cost stays linear in the number of defects.
+"""
+import numpy as np
+
+# Large primes mixing the frame and cell coordinates into a single hash key, collisions only add candidate pairs
+_HASH_PRIMES = np.array([73856093, 19349663, 83492791, 2654435761], dtype=np.int64)
+# Offsets of a cell and its 26 neighbors
+_NEIGHBOR_OFFSETS = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def _cell_keys(batches: np.ndarray, cells: np.ndarray) -> np.ndarray:
+    return (batches * _HASH_PRIMES[3]) ^ (cells[:, 0] * _HASH_PRIMES[0]) ^ (cells[:, 1] * _HASH_PRIMES[1]) ^ (cells[:, 2] * _HASH_PRIMES[2])
+
+
+def find_close_pairs(points: np.ndarray, batches: np.ndarray, min_distance: float) -> np.ndarray:
+    """
+    Find the pairs of points of the same batch closer than min_distance.
+
+    Parameters:
+        points (np.ndarray): (M, 3) positions.
+        batches (np.ndarray): (M,) batch of every point, the frame it is placed in.
+        min_distance (float): Minimum distance between two points of a batch, also the cell size of the hash.
+
+    Returns:
+        np.ndarray: (P, 2) indices of the close pairs, every pair once with the lower index first.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    batches = np.asarray(batches, dtype=np.int64)
+    if len(points) < 2 or min_distance <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    cells = np.floor(points / min_distance).astype(np.int64)
+    keys = _cell_keys(batches, cells)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs = []
+    for offset in _NEIGHBOR_OFFSETS:
+        neighbor_keys = _cell_keys(batches, cells + offset)
+        starts = np.searchsorted(sorted_keys, neighbor_keys, side="left")
+        counts = np.searchsorted(sorted_keys, neighbor_keys, side="right") - starts
+        if not counts.any():
+            continue
+        # Expand every point into the points of its neighbor cell
+        first = np.repeat(np.arange(len(points)), counts)
+        within = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(starts, counts) + within]
+        candidates = (first < second) & (batches[first] == batches[second])
+        first, second = first[candidates], second[candidates]
+        close = np.einsum("nk,nk->n", points[first] - points[second], points[first] - points[second]) < min_distance ** 2
+        pairs.append(np.stack([first[close], second[close]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    # A pair is found once per neighbor offset leading to it, hash collisions can repeat it
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def reject_close_points(points: np.ndarray, batches: np.ndarray, min_distance: float, priorities: np.ndarray) -> np.ndarray:
+    """
+    Reject points until no two kept points of a batch are closer than min_distance: for every close pair the point with
+    the higher priority value is rejected.
+
+    Returns:
+        np.ndarray: (M,) booleans, True for the rejected points.
+    """
+    rejected = np.zeros(len(points), dtype=bool)
+    pairs = find_close_pairs(points, batches, min_distance)
+    if len(pairs) == 0:
+        return rejected
+    loser = np.where(priorities[pairs[:, 0]] > priorities[pairs[:, 1]], pairs[:, 0], pairs[:, 1])
+    rejected[loser] = True
+    return rejected
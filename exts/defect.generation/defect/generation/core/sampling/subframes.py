@@ -0,0 +1,70 @@
+"""
+Adaptive subframe counts. Path traced frames only need many subframes after large lighting or material changes, so the
+number of subframes of every frame is derived from the randomizers that changed the scene since the previous rendered
+frame, and how much they changed it. Frames where only the defects moved render with the minimum.
+"""
+from typing import Dict
+import numpy as np
+from defect.generation.core.sampling.frame_parameters import LIGHT_ATTRIBUTES, FrameParameters
+from defect.generation.domain.models.domain_randomization_request import AdaptiveSubframeParameters
+
+SUBFRAMES_COLUMN = "rt_subframes"
+# Frame parameter columns changed by each randomizer
+RANDOMIZER_COLUMNS = {
+    "light": [f"light_{attribute}" for attribute in LIGHT_ATTRIBUTES],
+    "material": ["material_choice", "material_color_choice"],
+    "color": ["color_choice"],
+    "camera": ["camera_position", "camera_look_at"],
+    "defect": ["defect_position", "defect_rotation", "defect_scale", "defect_shown", "defect_texture"],
+}
+_CHOICE_COLUMNS = {"material_choice", "material_color_choice", "color_choice", "defect_shown", "defect_texture"}
+
+
+def _column_changes(name: str, column: np.ndarray) -> np.ndarray:
+    # Change of a column from each row to the next, in [0, 1], the first row is 0
+    column = np.asarray(column)
+    changes = np.zeros(len(column))
+    if len(column) < 2:
+        return changes
+    if name in _CHOICE_COLUMNS:
+        # Fraction of the prims or defects with another option
+        changed = (column[1:] != column[:-1]).reshape(len(column) - 1, -1)
+        changes[1:] = changed.mean(axis=1) if changed.shape[1] else 0.0
+        return changes
+    # Largest step of any value, relative to the spread of that value over the run
+    values = column.astype(np.float64).reshape(len(column), -1)
+    spread = np.ptp(values, axis=0)
+    steps = np.abs(np.diff(values, axis=0)) / np.where(spread > 0, spread, 1.0)
+    changes[1:] = steps.max(axis=1) if steps.shape[1] else 0.0
+    return np.clip(changes, 0.0, 1.0)
+
+
+def scene_changes(frame_parameters: FrameParameters) -> Dict[str, np.ndarray]:
+    # Change of the scene made by every randomizer at every frame, in [0, 1], for the randomizers of the run
+    changes = {}
+    for randomizer, names in RANDOMIZER_COLUMNS.items():
+        columns = [_column_changes(name, frame_parameters.columns[name]) for name in names if name in frame_parameters.columns]
+        if columns:
+            changes[randomizer] = np.max(columns, axis=0)
+    return changes
+
+
+def plan_subframes(frame_parameters: FrameParameters, params: AdaptiveSubframeParameters) -> np.ndarray:
+    """
+    Number of subframes of every frame of a run.
+
+    Parameters:
+        frame_parameters (FrameParameters): The frames of the run, in render order.
+        params (AdaptiveSubframeParameters): Subframe bounds and cost of a full change of every randomizer.
+
+    Returns:
+        np.ndarray: Subframes per frame, between the minimum and maximum subframes.
+    """
+    subframes = np.full(frame_parameters.num_frames, float(params.min_subframes))
+    for randomizer, changes in scene_changes(frame_parameters).items():
+        subframes = np.maximum(subframes, np.ceil(params.randomizer_costs.get(randomizer, 0) * changes))
+    if len(subframes):
+        # The first frame also settles the scene from its authored state
+        subframes[0] = params.max_subframes
+    return np.clip(subframes, params.min_subframes, params.max_subframes).astype(np.int64)
+
@@ -0,0 +1,234 @@
+"""
+CPU visibility prediction of defect projections: frustum test against the sampled camera poses and an optional
+occlusion test against a coarse BVH of the scene triangles. All tests are vectorized over frames, cameras and defects.
+"""
+from typing import Sequence, Tuple
+import numpy as np
+
+# Pinhole parameters of the cameras created for the render products, shared with rep.create.camera
+FOCAL_LENGTH = 24.0
+HORIZONTAL_APERTURE = 20.955
+CLIPPING_RANGE = (0.001, 10000.0)
+
+
+class CameraIntrinsics:
+    def __init__(self, focal_length: float = FOCAL_LENGTH, horizontal_aperture: float = HORIZONTAL_APERTURE,
+                 clipping_range: Tuple[float, float] = CLIPPING_RANGE) -> None:
+        self.focal_length = focal_length
+        self.horizontal_aperture = horizontal_aperture
+        self.near, self.far = clipping_range
+
+    def tangents(self, resolution: Sequence[int]) -> Tuple[float, float]:
+        # Tangents of the horizontal and vertical half fields of view, the vertical aperture follows the aspect ratio
+        tan_horizontal = self.horizontal_aperture / (2 * self.focal_length)
+        return tan_horizontal, tan_horizontal * resolution[1] / resolution[0]
+
+
+def _normalize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12), norms[..., 0]
+
+
+def look_at_basis(positions: np.ndarray, look_ats: np.ndarray, up_axis: Sequence[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Right, up and forward axes of cameras at positions looking at look_ats.
+
+    Parameters:
+        positions (np.ndarray): (..., 3) camera positions.
+        look_ats (np.ndarray): (..., 3) look at points.
+        up_axis (Sequence[float]): World up vector of the stage.
+    """
+    forward, _ = _normalize(look_ats - positions)
+    up_axis = np.broadcast_to(np.asarray(up_axis, dtype=np.float64), forward.shape)
+    right, right_norms = _normalize(np.cross(forward, up_axis))
+    # Cameras looking straight along the up axis use another reference axis
+    degenerate = right_norms < 1e-9
+    if np.any(degenerate):
+        fallback = np.roll(up_axis[degenerate], 1, axis=-1)
+        right[degenerate], _ = _normalize(np.cross(forward[degenerate], fallback))
+    up = np.cross(right, forward)
+    return right, up, forward
+
+
+def frustum_mask(camera_positions: np.ndarray, look_ats: np.ndarray, tangents: np.ndarray, points: np.ndarray,
+                 up_axis: Sequence[float], near: float, far: float, margin: float = 0.0) -> np.ndarray:
+    """
+    Check which points are inside the view frustum of which camera.
+
+    Parameters:
+        camera_positions (np.ndarray): (F, C, 3) camera positions per frame.
+        look_ats (np.ndarray): (F, C, 3) look at points per frame.
+        tangents (np.ndarray): (C, 2) tangents of the horizontal and vertical half fields of view per camera.
+        points (np.ndarray): (F, D, 3) defect positions per frame.
+        up_axis (Sequence[float]): World up vector.
+        near (float), far (float): Clipping range.
+        margin (float): Fraction of the image border the points must stay away from.
+
+    Returns:
+        np.ndarray: (F, C, D) bool mask.
+    """
+    right, up, forward = look_at_basis(camera_positions, look_ats, up_axis)
+    offsets = points[:, None, :, :] - camera_positions[:, :, None, :]
+    depth = np.einsum("fcdk,fck->fcd", offsets, forward)
+    x = np.einsum("fcdk,fck->fcd", offsets, right)
+    y = np.einsum("fcdk,fck->fcd", offsets, up)
+    scale = 1 - margin
+    tan_horizontal = tangents[None, :, 0, None] * scale
+    tan_vertical = tangents[None, :, 1, None] * scale
+    return ((depth > near) & (depth < far)
+            & (np.abs(x) <= depth * tan_horizontal) & (np.abs(y) <= depth * tan_vertical))
+
+
+class CoarseBVH:
+    """
+    Two level bounding volume hierarchy for occlusion queries: triangles are sorted along a Morton curve and grouped
+    into at most max_leaves leaves. Rays are tested against all leaf boxes at once, then against the triangles of the
+    leaves they hit.
+
+    Parameters:
+        vertices (np.ndarray): (N, 3) world space vertices.
+        triangles (np.ndarray): (M, 3) vertex indices.
+        leaf_size (int): Minimum number of triangles per leaf.
+        max_leaves (int): Maximum number of leaves, bigger leaves are used for dense meshes.
+    """
+
+    def __init__(self, vertices: np.ndarray, triangles: np.ndarray, leaf_size: int = 16, max_leaves: int = 1024) -> None:
+        corners = np.asarray(vertices, dtype=np.float64)[np.asarray(triangles, dtype=np.int64)]
+        self.triangle_count = len(corners)
+        if self.triangle_count == 0:
+            self.leaf_size = 1
+            self.corners = np.zeros((0, 1, 3, 3))
+            self.valid = np.zeros((0, 1), dtype=bool)
+            self.box_min = self.box_max = np.zeros((0, 3))
+            return
+
+        corners = corners[np.argsort(_morton_codes(corners.mean(axis=1)), kind="stable")]
+        self.leaf_size = max(leaf_size, -(-self.triangle_count // max_leaves))
+        leaf_count = -(-self.triangle_count // self.leaf_size)
+        padding = leaf_count * self.leaf_size - self.triangle_count
+        # Pad the last leaf with copies of its last triangle, masked out of the intersection tests
+        corners = np.concatenate([corners, np.repeat(corners[-1:], padding, axis=0)])
+        self.corners = corners.reshape(leaf_count, self.leaf_size, 3, 3)
+        self.valid = (np.arange(leaf_count * self.leaf_size) < self.triangle_count).reshape(leaf_count, self.leaf_size)
+        self.box_min = self.corners.min(axis=(1, 2))
+        self.box_max = self.corners.max(axis=(1, 2))
+
+    def occluded(self, origins: np.ndarray, targets: np.ndarray, epsilon: float = 1e-3, chunk_size: int = 1 << 18) -> np.ndarray:
+        """
+        Check if segments from origins to targets are blocked by a triangle.
+
+        Parameters:
+            origins (np.ndarray): (R, 3) ray origins (camera positions).
+            targets (np.ndarray): (R, 3) ray targets (defect positions).
+            epsilon (float): Fraction of the segment ignored at both ends, so the surface a target lies on does not occlude it.
+            chunk_size (int): Maximum number of ray/box or ray/triangle tests evaluated at once.
+
+        Returns:
+            np.ndarray: (R,) bool mask of the blocked segments.
+        """
+        origins = np.asarray(origins, dtype=np.float64)
+        directions = np.asarray(targets, dtype=np.float64) - origins
+        blocked = np.zeros(len(origins), dtype=bool)
+        leaf_count = len(self.box_min)
+        if leaf_count == 0 or len(origins) == 0:
+            return blocked
+
+        rays_per_chunk = max(1, chunk_size // leaf_count)
+        for start in range(0, len(origins), rays_per_chunk):
+            chunk_origins = origins[start:start + rays_per_chunk]
+            chunk_directions = directions[start:start + rays_per_chunk]
+            ray_indices, leaf_indices = np.nonzero(self._hit_boxes(chunk_origins, chunk_directions, epsilon))
+            pairs_per_chunk = max(1, chunk_size // self.leaf_size)
+            for pair_start in range(0, len(ray_indices), pairs_per_chunk):
+                rays = ray_indices[pair_start:pair_start + pairs_per_chunk]
+                hits = self._hit_triangles(chunk_origins[rays], chunk_directions[rays], leaf_indices[pair_start:pair_start + pairs_per_chunk], epsilon)
+                blocked[start + rays[hits]] = True
+        return blocked
+
+    def _hit_boxes(self, origins: np.ndarray, directions: np.ndarray, epsilon: float) -> np.ndarray:
+        # Slab test of the segments against all leaf boxes, (R, L) mask
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1 / np.where(np.abs(directions) < 1e-12, 1e-12, directions)
+        t0 = (self.box_min[None] - origins[:, None]) * inverse[:, None]
+        t1 = (self.box_max[None] - origins[:, None]) * inverse[:, None]
+        t_enter = np.minimum(t0, t1).max(axis=2)
+        t_exit = np.maximum(t0, t1).min(axis=2)
+        return (t_exit >= np.maximum(t_enter, epsilon)) & (t_enter <= 1 - epsilon)
+
+    def _hit_triangles(self, origins: np.ndarray, directions: np.ndarray, leaf_indices: np.ndarray, epsilon: float) -> np.ndarray:
+        # Moller-Trumbore intersection of every segment with all triangles of its leaf, (P,) mask
+        corners = self.corners[leaf_indices]
+        v0, edge1, edge2 = corners[:, :, 0], corners[:, :, 1] - corners[:, :, 0], corners[:, :, 2] - corners[:, :, 0]
+        directions = directions[:, None]
+        p = np.cross(directions, edge2)
+        determinant = np.einsum("pik,pik->pi", edge1, p)
+        parallel = np.abs(determinant) < 1e-12
+        inverse_determinant = 1 / np.where(parallel, 1, determinant)
+        s = origins[:, None] - v0
+        u = np.einsum("pik,pik->pi", s, p) * inverse_determinant
+        q = np.cross(s, edge1)
+        v = np.einsum("pik,pik->pi", np.broadcast_to(directions, q.shape), q) * inverse_determinant
+        t = np.einsum("pik,pik->pi", edge2, q) * inverse_determinant
+        hits = (~parallel & self.valid[leaf_indices] & (u >= 0) & (v >= 0) & (u + v <= 1)
+                & (t > epsilon) & (t < 1 - epsilon))
+        return hits.any(axis=1)
+
+
+def _morton_codes(points: np.ndarray, bits: int = 10) -> np.ndarray:
+    # Interleave the bits of the quantized coordinates so that sorting keeps nearby triangles together
+    min_coordinates, max_coordinates = points.min(axis=0), points.max(axis=0)
+    scale = ((1 << bits) - 1) / np.maximum(max_coordinates - min_coordinates, 1e-12)
+    quantized = ((points - min_coordinates) * scale).astype(np.int64)
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return codes
+
+
+class VisibilityPredictor:
+    """
+    Predict which defects each camera sees in each frame.
+
+    Parameters:
+        intrinsics (CameraIntrinsics): Pinhole parameters of the cameras.
+        up_axis (Sequence[float]): World up vector of the stage.
+        bvh (CoarseBVH): Occluders, None to skip the occlusion test.
+        check_facing (bool): Reject defects on triangles facing away from the camera, only for meshes with consistent winding.
+        frustum_margin (float): Fraction of the image border the defect centers must stay away from.
+    """
+
+    def __init__(self, intrinsics: CameraIntrinsics, up_axis: Sequence[float] = (0, 1, 0), bvh: CoarseBVH = None,
+                 check_facing: bool = False, frustum_margin: float = 0.0) -> None:
+        self.intrinsics = intrinsics
+        self.up_axis = up_axis
+        self.bvh = bvh
+        self.check_facing = check_facing
+        self.frustum_margin = frustum_margin
+
+    def visible(self, camera_positions: np.ndarray, look_ats: np.ndarray, tangents: np.ndarray, points: np.ndarray,
+                normals: np.ndarray = None, active: np.ndarray = None) -> np.ndarray:
+        """
+        Parameters:
+            camera_positions (np.ndarray): (F, C, 3) camera positions.
+            look_ats (np.ndarray): (F, C, 3) look at points.
+            tangents (np.ndarray): (C, 2) field of view tangents of every camera.
+            points (np.ndarray): (F, D, 3) defect positions.
+            normals (np.ndarray): (F, D, 3) surface normals at the defect positions.
+            active (np.ndarray): (F, D) defects shown in the frame, None if all are.
+
+        Returns:
+            np.ndarray: (F, C, D) bool mask of the visible defects.
+        """
+        mask = frustum_mask(camera_positions, look_ats, tangents, points, self.up_axis,
+                            self.intrinsics.near, self.intrinsics.far, self.frustum_margin)
+        if active is not None:
+            mask &= active[:, None, :]
+        if self.check_facing and normals is not None:
+            to_camera = camera_positions[:, :, None, :] - points[:, None, :, :]
+            mask &= np.einsum("fcdk,fdk->fcd", to_camera, normals) > 0
+        if self.bvh is not None and np.any(mask):
+            frames, cameras, defects = np.nonzero(mask)
+            blocked = self.bvh.occluded(camera_positions[frames, cameras], points[frames, defects])
+            mask[frames[blocked], cameras[blocked], defects[blocked]] = False
+        return mask
@@ -4,6 +4,7 @@ import os
 import numpy as np
 from typing import List
 from omni.replicator.core import Writer, AnnotatorRegistry, BackendDispatch
+from defect.generation.core.writer.yield_stats import YieldStats
 import logging
 logger = logging.getLogger(__name__)
 
@@ -16,14 +17,32 @@ class BMWWriter(Writer):
             semantic_segmentation: bool = False,
             image_output_format="png",
             defects: List[str] = [],
+            render_product_dirs: bool = False,
+            start_frame_id: int = 0,
+            report_name: str = "yield_report.json",
+            report_interval: int = 100,
+            frame_ids: List[int] = None,
     ):
         self._output_dir = output_dir
+        # Always write in per render product folders, needed when several writers share the output directory
+        self._render_product_dirs = render_product_dirs
         self._backend = BackendDispatch({"paths": {"out_dir": output_dir}})
-        self._frame_id = 0
+        # Shards of a partitioned job start at the first frame of their range
+        self._frame_id = start_frame_id
+        # Replayed frames keep the ids of the recording, they are written in the order of frame_ids
+        self._frame_ids = list(frame_ids) if frame_ids else None
+        self._frame_index = 0
+        if self._frame_ids:
+            self._frame_id = self._frame_ids[0]
         self._image_output_format = image_output_format
         self.annotators = []
         self.all_labels = defects
         self.semantic_label_map = {}
+        # Yield accounting, logged and written to the report every report_interval frames and after the last frame
+        self.yield_stats = YieldStats()
+        self._report_path = os.path.join(output_dir, report_name)
+        self._report_interval = report_interval
+        self._frames_since_report = 0
 
         # RGB
         if rgb:
@@ -54,78 +73,117 @@ class BMWWriter(Writer):
         else:
             return False
 
+    def has_defect(self, id_to_labels):
+        # Check if a defect exists in this image or not TODO: Do we want to keep images with no defects ?
+        for id, labels in id_to_labels.items():
+            if labels['class'].split("_")[0] in self.all_labels:
+                return True
+        return False
+
+    def count_defects(self, id_to_labels):
+        # Number of defect instances with labels in this image
+        return sum(1 for labels in id_to_labels.values() if labels['class'].split("_")[0] in self.all_labels)
+
+    def write_yield_report(self):
+        logger.info(self.yield_stats.format_summary())
+        self.yield_stats.write_report(self._report_path)
+        self._frames_since_report = 0
+
+    def on_final_frame(self):
+        self.write_yield_report()
+
     def write(self, data):
         logger.warning(f"In render products with frame id: {self._frame_id}")
         # Get all render products and prepare postfix
         render_products = [key.replace('rp_', '-') for key in data.keys() if key.startswith('rp_RenderProduct_Replicator')]
         if len(render_products) <= 1:
             render_product_postfix = [""]
+            render_product_dirs = [render_products[0][1:] if self._render_product_dirs and render_products else ""]
+            render_product_names = [render_products[0][1:] if render_products else "RenderProduct"]
         else:
             render_product_postfix = render_products
-        
-        for postfix in render_product_postfix:
+            # Remove '-' from postfix
+            render_product_dirs = [postfix[1:] for postfix in render_products]
+            render_product_names = render_product_dirs
+
+        for postfix, render_product_dir, render_product_name in zip(render_product_postfix, render_product_dirs, render_product_names):
             logging.warning(f"Working on postfix:{postfix}")
             # Setting up keys and dir based on render product
             bounding_box_2d_tight_key = f"bounding_box_2d_tight{postfix}"
             rgb_key = f"rgb{postfix}"
             semantic_segmentation_key = f"semantic_segmentation{postfix}"
-            # Remove '-' from postfix
-            render_product_dir = postfix[1:] if postfix != "" else ""
 
-            if rgb_key in data and bounding_box_2d_tight_key in data:
+            # Only expect the annotators attached to this render product, use whichever labels are available to check for defects
+            if bounding_box_2d_tight_key in data:
+                visible_defects = self.count_defects(data[bounding_box_2d_tight_key]["info"]["idToLabels"])
+            elif semantic_segmentation_key in data:
+                visible_defects = self.count_defects(data[semantic_segmentation_key]["info"]["idToLabels"])
+            else:
+                visible_defects = None
+            exists = visible_defects is None or visible_defects > 0
+            self.yield_stats.record_frame(render_product_name, exists, visible_defects)
+
+            if rgb_key in data and exists:
+                # Write the rgb image into a file
+                image_dir =  os.path.join(render_product_dir, "images")
+                image_output_dir = os.path.join(self._output_dir, image_dir)
+                if not os.path.exists(image_output_dir):
+                    os.makedirs(image_output_dir)
+                filepath = os.path.join(image_dir, f"{self._frame_id}.{self._image_output_format}")
+                self._backend.write_image(filepath, data[rgb_key])
+
+            if bounding_box_2d_tight_key in data and exists:
                 # Make sure that directories exist
                 bbox_dir = os.path.join(render_product_dir, "labels", "json")
-                image_dir =  os.path.join(render_product_dir, "images")
                 bbox_output_dir = os.path.join(self._output_dir, bbox_dir)
-                image_output_dir = os.path.join(self._output_dir, image_dir)
                 if not os.path.exists(bbox_output_dir):
                     os.makedirs(bbox_output_dir)
-                if not os.path.exists(image_output_dir):
-                    os.makedirs(image_output_dir)
 
                 # Get bbox data
                 bbox_data = data[bounding_box_2d_tight_key]["data"]
                 id_to_labels = data[bounding_box_2d_tight_key]["info"]["idToLabels"]
-                exists = False
 
-                # Check if a defect exists in this image or not TODO: Do we want to keep images with no defects ?
-                for id, labels in id_to_labels.items():
-                    if labels['class'].split("_")[0] in self.all_labels:
-                        exists = True
-                        break
+                # Save bbox data in BMW Format
+                json_data = []
+                dropped_area = dropped_sentinel = 0
+                class_boxes = {}
+                for bbox in bbox_data:
+                    target_bbox_data = {'x_min': bbox['x_min'], 'y_min': bbox['y_min'],
+                                        'x_max': bbox['x_max'], 'y_max': bbox['y_max']}
+                    id = int(bbox[0])
+                    label = id_to_labels[str(id)]['class'].split("_")[0]
+                    # Boxes in and out per defect class
+                    class_counts = class_boxes.setdefault(label, [0, 0])
+                    class_counts[0] += 1
+
+                    if self.check_bbox_area(target_bbox_data, 0.5):
+                        width = int(abs(target_bbox_data["x_max"] - target_bbox_data["x_min"]))
+                        height = int(abs(target_bbox_data["y_max"] - target_bbox_data["y_min"]))
+
+                        if width != 2147483647 and height != 2147483647:
+                            coco_bbox_data = {"Id": id,
+                                            "ObjectClassName": label,
+                                            "Left": int(target_bbox_data["x_min"]),
+                                            "Top": int(target_bbox_data["y_min"]),
+                                            "Right": int(target_bbox_data["x_max"]),
+                                            "Bottom": int(target_bbox_data["y_max"])}
+                            json_data.append(coco_bbox_data)
+                            class_counts[1] += 1
+                        else:
+                            dropped_sentinel += 1
+                    else:
+                        dropped_area += 1
+                self.yield_stats.record_boxes(render_product_name, len(bbox_data), dropped_area, dropped_sentinel)
+                for label, (boxes_in, boxes_out) in class_boxes.items():
+                    if label in self.all_labels:
+                        self.yield_stats.record_class_boxes(render_product_name, label, boxes_in, boxes_out)
+
+                bbox_filepath = os.path.join(bbox_dir, f"{self._frame_id}.json")
 
-                if exists:
-                    # Save image and bbox data in BMW Format
-                    json_data = []
-                    for bbox in bbox_data:
-                        target_bbox_data = {'x_min': bbox['x_min'], 'y_min': bbox['y_min'],
-                                            'x_max': bbox['x_max'], 'y_max': bbox['y_max']}
-                        id = int(bbox[0])
-                        label = id_to_labels[str(id)]['class'].split("_")[0]
-
-                        if self.check_bbox_area(target_bbox_data, 0.5):
-                            width = int(abs(target_bbox_data["x_max"] - target_bbox_data["x_min"]))
-                            height = int(abs(target_bbox_data["y_max"] - target_bbox_data["y_min"]))
-
-                            if width != 2147483647 and height != 2147483647:
-                                coco_bbox_data = {"Id": id,
-                                                "ObjectClassName": label,
-                                                "Left": int(target_bbox_data["x_min"]),
-                                                "Top": int(target_bbox_data["y_min"]),
-                                                "Right": int(target_bbox_data["x_max"]),
-                                                "Bottom": int(target_bbox_data["y_max"])}
-                                json_data.append(coco_bbox_data)
-
-                        # Write the rgb image into a file
-                        filepath = os.path.join(image_dir, f"{self._frame_id}.{self._image_output_format}")
-                        self._backend.write_image(filepath, data[rgb_key])
-
-                        bbox_filepath = os.path.join(bbox_dir, f"{self._frame_id}.json")
-        
-                        # Write the bbox values to the json file
-                        buf = io.BytesIO()
-                        buf.write(json.dumps(json_data).encode())
-                        self._backend.write_blob(bbox_filepath, buf.getvalue())
+                # Write the bbox values to the json file
+                buf = io.BytesIO()
+                buf.write(json.dumps(json_data).encode())
+                self._backend.write_blob(bbox_filepath, buf.getvalue())
 
             if semantic_segmentation_key in data:
                 # Make sure that directories exist
@@ -137,46 +195,24 @@ class BMWWriter(Writer):
                 # Get semantic data
                 semantic_data = data[semantic_segmentation_key]["data"]
                 id_to_labels = data[semantic_segmentation_key]["info"]["idToLabels"]
-                exists = False
                 segmentation_label_mapping_json = {}
 
-            # Check if a defect exists in this image or not TODO: Do we want to keep images with no defects ?
-                for id, labels in id_to_labels.items():
-                    if labels['class'].split("_")[0] in self.all_labels:
-                        exists = True
-                        break
-
                 # Save semantic segmentation data in BMW Format
                 if exists:
-                    count = len(self.semantic_label_map)
-                    numpy_data = semantic_data
-                    json_data = id_to_labels
-                    for key, value in json_data.items():
-                        if '_' in value['class']:
-                            new_class = value['class'].split('_')[0]
-                            if new_class not in self.semantic_label_map:
-                                self.semantic_label_map[new_class] = count
-                                count +=1
-                            segmentation_label_mapping_json[self.semantic_label_map[new_class]] = {'class': new_class}
-                            semantic_data = [
-                                [self.semantic_label_map[new_class] if pixel == key else pixel for pixel in row]
-                                for row in semantic_data
-                            ]
-                        else:
-                            if value['class'] not in self.semantic_label_map:
-                                self.semantic_label_map[value['class']] = count
-                                count += 1
-                            segmentation_label_mapping_json[self.semantic_label_map[value['class']]] = {'class': value['class']}
-                            semantic_data = [
-                                [self.semantic_label_map[value['class']] if pixel == key else pixel for pixel in row]
-                                for row in semantic_data
-                            ]
-
-
-
-
-
-
+                    # Map the per frame semantic ids to stable ids of the class names, without the defect UUID postfix
+                    id_mapping = {}
+                    for key, value in id_to_labels.items():
+                        new_class = value['class'].split('_')[0]
+                        if new_class not in self.semantic_label_map:
+                            self.semantic_label_map[new_class] = len(self.semantic_label_map)
+                        id_mapping[int(key)] = self.semantic_label_map[new_class]
+                        segmentation_label_mapping_json[self.semantic_label_map[new_class]] = {'class': new_class}
+
+                    # Remap all pixels at once through the unique ids of the frame
+                    semantic_data = np.asarray(semantic_data)
+                    unique_ids, inverse = np.unique(semantic_data, return_inverse=True)
+                    lookup = np.array([id_mapping.get(int(id), id) for id in unique_ids], dtype=semantic_data.dtype)
+                    numpy_data = lookup[inverse].reshape(semantic_data.shape)
 
                     filepath = f"{self._frame_id}"
 
@@ -185,9 +221,17 @@ class BMWWriter(Writer):
                     buf.write(json.dumps(segmentation_label_mapping_json).encode())
                     self._backend.write_blob(os.path.join(semantic_segmentation_dir, filepath + ".json"), buf.getvalue())
 
-                    # Write the semantic data values to the npy file
-                    with open(os.path.join(semantic_segmentation_output_dir, filepath + ".npy"), 'xb') as f:
-                        np.save(f, np.array(numpy_data))
+                    # Write the semantic data values to the npy file, replacing the file of a previous run in the same directory
+                    buf = io.BytesIO()
+                    np.save(buf, numpy_data)
+                    self._backend.write_blob(os.path.join(semantic_segmentation_dir, filepath + ".npy"), buf.getvalue())
 
         # Increment frame id
-        self._frame_id += 1
+        self._frame_index += 1
+        if self._frame_ids and self._frame_index < len(self._frame_ids):
+            self._frame_id = self._frame_ids[self._frame_index]
+        else:
+            self._frame_id += 1
+        self._frames_since_report += 1
+        if self._report_interval and self._frames_since_report >= self._report_interval:
+            self.write_yield_report()
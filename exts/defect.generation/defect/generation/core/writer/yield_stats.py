@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Dict, List
+
+# Counters of every render product
+FRAME_COUNTERS = ["frames_rendered", "frames_written", "frames_without_defect"]
+BOX_COUNTERS = ["boxes_in", "boxes_out", "boxes_dropped_area", "boxes_dropped_sentinel"]
+
+
+class YieldStats:
+    """
+    Yield accounting of a writer: frames rendered and written per render product, bounding boxes kept and dropped by
+    each filter, per defect class as well, and the number of defects visible per frame.
+    """
+
+    def __init__(self) -> None:
+        self.render_products: Dict[str, Dict[str, int]] = {}
+        # Number of frames per count of visible defects
+        self.visible_defects: Dict[str, Dict[int, int]] = {}
+        # Boxes in and out per defect class
+        self.classes: Dict[str, Dict[str, Dict[str, int]]] = {}
+
+    def _counters(self, render_product: str) -> Dict[str, int]:
+        if render_product not in self.render_products:
+            self.render_products[render_product] = {counter: 0 for counter in FRAME_COUNTERS + BOX_COUNTERS}
+            self.visible_defects[render_product] = {}
+            self.classes[render_product] = {}
+        return self.render_products[render_product]
+
+    def _class_counters(self, render_product: str, label: str) -> Dict[str, int]:
+        self._counters(render_product)
+        return self.classes[render_product].setdefault(label, {"boxes_in": 0, "boxes_out": 0})
+
+    def record_frame(self, render_product: str, written: bool, visible_defects: int = None):
+        # visible_defects is None when the render product has no labels to count the defects from
+        counters = self._counters(render_product)
+        counters["frames_rendered"] += 1
+        counters["frames_written"] += int(written)
+        if visible_defects is None:
+            return
+        counters["frames_without_defect"] += int(visible_defects == 0)
+        histogram = self.visible_defects[render_product]
+        histogram[visible_defects] = histogram.get(visible_defects, 0) + 1
+
+    def record_boxes(self, render_product: str, boxes_in: int, dropped_area: int, dropped_sentinel: int):
+        counters = self._counters(render_product)
+        counters["boxes_in"] += boxes_in
+        counters["boxes_dropped_area"] += dropped_area
+        counters["boxes_dropped_sentinel"] += dropped_sentinel
+        counters["boxes_out"] += boxes_in - dropped_area - dropped_sentinel
+
+    def record_class_boxes(self, render_product: str, label: str, boxes_in: int, boxes_out: int):
+        counters = self._class_counters(render_product, label)
+        counters["boxes_in"] += boxes_in
+        counters["boxes_out"] += boxes_out
+
+    def class_totals(self) -> Dict[str, Dict[str, int]]:
+        # Boxes in and out per defect class, over all render products
+        totals = {}
+        for classes in self.classes.values():
+            for label, counters in classes.items():
+                total = totals.setdefault(label, {"boxes_in": 0, "boxes_out": 0})
+                total["boxes_in"] += counters["boxes_in"]
+                total["boxes_out"] += counters["boxes_out"]
+        return totals
+
+    def totals(self) -> Dict[str, int]:
+        return {counter: sum(counters[counter] for counters in self.render_products.values()) for counter in FRAME_COUNTERS + BOX_COUNTERS}
+
+    def summary(self) -> Dict:
+        render_products = {}
+        for render_product, counters in self.render_products.items():
+            histogram = self.visible_defects[render_product]
+            frames = sum(histogram.values())
+            render_products[render_product] = {
+                **counters,
+                "frame_yield": counters["frames_written"] / counters["frames_rendered"] if counters["frames_rendered"] else 0.0,
+                "box_yield": counters["boxes_out"] / counters["boxes_in"] if counters["boxes_in"] else 0.0,
+                "mean_visible_defects": sum(count * frames_with_count for count, frames_with_count in histogram.items()) / frames if frames else 0.0,
+                "visible_defects_histogram": {str(count): histogram[count] for count in sorted(histogram)},
+                "classes": self.classes[render_product],
+            }
+        totals = self.totals()
+        totals["frame_yield"] = totals["frames_written"] / totals["frames_rendered"] if totals["frames_rendered"] else 0.0
+        totals["box_yield"] = totals["boxes_out"] / totals["boxes_in"] if totals["boxes_in"] else 0.0
+        totals["classes"] = self.class_totals()
+        return {"total": totals, "render_products": render_products}
+
+    def format_summary(self) -> str:
+        totals = self.summary()["total"]
+        return (f"Yield: {totals['frames_written']}/{totals['frames_rendered']} frames written ({totals['frame_yield']:.1%}), "
+                f"{totals['frames_without_defect']} without defect, {totals['boxes_out']}/{totals['boxes_in']} boxes kept, "
+                f"{totals['boxes_dropped_area']} dropped by area, {totals['boxes_dropped_sentinel']} by the invalid size sentinel"
+                + "".join(f", {label}: {counters['boxes_out']}/{counters['boxes_in']}" for label, counters in sorted(totals["classes"].items())))
+
+    def write_report(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=4)
+
+    @classmethod
+    def from_reports(cls, reports: List[Dict]) -> "YieldStats":
+        # Sum the reports of several writers or shards, render products with the same name are combined
+        stats = cls()
+        for report in reports:
+            for render_product, values in report.get("render_products", {}).items():
+                counters = stats._counters(render_product)
+                for counter in FRAME_COUNTERS + BOX_COUNTERS:
+                    counters[counter] += values.get(counter, 0)
+                histogram = stats.visible_defects[render_product]
+                for count, frames in values.get("visible_defects_histogram", {}).items():
+                    histogram[int(count)] = histogram.get(int(count), 0) + frames
+                for label, class_counters in values.get("classes", {}).items():
+                    stats.record_class_boxes(render_product, label, class_counters.get("boxes_in", 0), class_counters.get("boxes_out", 0))
+        return stats
@@ -0,0 +1,21 @@
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+
+Bounds = Tuple[Tuple[float, float, float], Tuple[float, float, float]]
+
+class CameraSpec(BaseModel):
+    # Prim the camera is scattered on, None to scatter inside a sphere around the look at bounds
+    scatter_prim_path: Optional[str] = None
+    # Look at bounds of the camera. With more than one target, the camera cycles through them across frames
+    look_at_bounds: List[Bounds]
+
+    @property
+    def is_multiplexed(self) -> bool:
+        return len(self.look_at_bounds) > 1
+
+class CameraPlan(BaseModel):
+    cameras: List[CameraSpec] = []
+    # Number of expanded specs that were dropped as duplicates, invalid or over budget
+    duplicate_count: int = 0
+    invalid_count: int = 0
+    over_budget_count: int = 0
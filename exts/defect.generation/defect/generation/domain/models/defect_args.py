@@ -0,0 +1,129 @@
+import json
+from typing import Any, Callable, Dict, Type
+from pydantic import BaseModel, root_validator, validator
+
+# Version of the defect args schemas, increased when a field is renamed or changes meaning. Args of older versions are
+# migrated when they are loaded, see DEFECT_ARGS_MIGRATIONS
+DEFECT_ARGS_VERSION = 2
+
+class DefectArgs(BaseModel):
+    # Args of a defect type without registered schema, and fields shared by all the defect types. The defaults are
+    # the values used for args missing from a request
+    schema_version: int = DEFECT_ARGS_VERSION
+    semantic_label: str = "default"
+    # Probability of the defect being shown in a frame
+    visibility_probability: float = 0.5
+    # Rotation ranges in degrees
+    rot_x_min: float = 0
+    rot_x_max: float = 360
+    rot_y_min: float = 0
+    rot_y_max: float = 360
+    rot_z_min: float = 0
+    rot_z_max: float = 360
+    # Size ranges of the defect projection
+    dim_h_min: float = 0
+    dim_h_max: float = 1
+    dim_w_min: float = 0
+    dim_w_max: float = 1
+
+    class Config:
+        # Args of custom defect types keep their extra values
+        extra = "allow"
+
+    @validator("visibility_probability")
+    def _check_probability(cls, probability):
+        if not 0 <= probability <= 1:
+            raise ValueError(f"Visibility probability must be between 0 and 1, got {probability}")
+        return probability
+
+    @root_validator(skip_on_failure=True)
+    def _check_ranges(cls, values):
+        for name in ("rot_x", "rot_y", "rot_z", "dim_h", "dim_w"):
+            if values[f"{name}_min"] > values[f"{name}_max"]:
+                raise ValueError(f"{name}_min {values[f'{name}_min']} is larger than {name}_max {values[f'{name}_max']}")
+        if values["dim_h_min"] < 0 or values["dim_w_min"] < 0:
+            raise ValueError("Defect dimensions cannot be negative")
+        return values
+
+# Defect args schemas by defect name
+DEFECT_ARGS_SCHEMAS: Dict[str, Type[DefectArgs]] = {}
+
+def register_defect_args(defect_name: str) -> Callable[[Type[DefectArgs]], Type[DefectArgs]]:
+    # Class decorator registering the args schema of a defect type
+    def register(schema: Type[DefectArgs]) -> Type[DefectArgs]:
+        DEFECT_ARGS_SCHEMAS[defect_name] = schema
+        return schema
+    return register
+
+def get_defect_args_schema(defect_name: str) -> Type[DefectArgs]:
+    return DEFECT_ARGS_SCHEMAS.get(defect_name, DefectArgs)
+
+@register_defect_args("crack")
+class CrackArgs(DefectArgs):
+    semantic_label: str = "crack"
+
+@register_defect_args("scratch")
+class ScratchArgs(DefectArgs):
+    semantic_label: str = "scratch"
+
+@register_defect_args("hole")
+class HoleArgs(DefectArgs):
+    semantic_label: str = "hole"
+
+    @root_validator(pre=True)
+    def _default_to_round(cls, values):
+        # Holes are round, dim_w is the radius range and dim_h defaults to it
+        values = dict(values)
+        values.setdefault("dim_h_min", values.get("dim_w_min", 0))
+        values.setdefault("dim_h_max", values.get("dim_w_max", 1))
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def _check_round(cls, values):
+        if (values["dim_h_min"], values["dim_h_max"]) != (values["dim_w_min"], values["dim_w_max"]):
+            raise ValueError(f"Holes are round, the dim_h range ({values['dim_h_min']}, {values['dim_h_max']}) must be the "
+                             f"dim_w range ({values['dim_w_min']}, {values['dim_w_max']})")
+        return values
+
+def defect_args_schema_json() -> str:
+    # JSON schemas of the shared args and of every registered defect type, they change with the fields and defaults
+    schemas = {"": DefectArgs.schema()}
+    schemas.update({defect_name: schema.schema() for defect_name, schema in sorted(DEFECT_ARGS_SCHEMAS.items())})
+    return json.dumps(schemas, sort_keys=True)
+
+def _migrate_count(args: Dict[str, Any]) -> Dict[str, Any]:
+    # Version 1 args had the number of defects of their row, it is the count of the DefectObject since version 2 and is
+    # moved there by DefectObject before its args are parsed
+    args.pop("count", None)
+    return args
+
+# Migration of the args of each version to the next one
+DEFECT_ARGS_MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _migrate_count,
+}
+
+def parse_defect_args(defect_name: str, args: Any) -> DefectArgs:
+    """
+    Validate the args of a defect with the schema of its defect type, migrating args of older schema versions.
+
+    Parameters:
+        defect_name (str): Defect type of the args.
+        args (Any): Args dict, or args already validated.
+
+    Returns:
+        DefectArgs: The args, an instance of the schema registered for defect_name.
+    """
+    schema = get_defect_args_schema(defect_name)
+    if isinstance(args, schema):
+        return args
+    if isinstance(args, DefectArgs):
+        args = args.dict()
+    args = dict(args or {})
+    # Args written before the schemas were versioned use the version 1 names
+    version = args.pop("schema_version", 1)
+    if version > DEFECT_ARGS_VERSION:
+        raise ValueError(f"Args of {defect_name} have schema version {version}, newer than the supported version {DEFECT_ARGS_VERSION}")
+    while version < DEFECT_ARGS_VERSION:
+        args = DEFECT_ARGS_MIGRATIONS[version](args)
+        version += 1
+    return schema(**args)
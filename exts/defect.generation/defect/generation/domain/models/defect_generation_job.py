@@ -0,0 +1,34 @@
+from typing import List
+from pydantic import BaseModel
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest
+from defect.generation.utils.fast_json import json_dumps, json_loads
+
+class DefectGenerationJob(BaseModel):
+    # Stage to open before building the graph, None to use the stage that is already open
+    stage_url: str = None
+    defect_generation_request: DefectGenerationRequest
+    domain_randomization_request: DomainRandomizationRequest
+    output_dir: str
+    frames: int = 1
+    start_frame: int = 0
+    # First frame and number of frames of the whole job a shard is part of. The frames of a job are sampled in blocks
+    # aligned at its first frame and the shard only samples the blocks of its own frames, so the frames do not depend
+    # on the number of shards. None when the job is not a shard
+    job_start_frame: int = None
+    job_frames: int = None
+    seed: int = None
+    rt_subframes: int = 1
+    use_seg: bool = False
+    use_bb: bool = True
+    use_bmw: bool = True
+    # Frame parameter log of a previous run to replay, and the frames of it to render again, all of them if None
+    replay_log: str = None
+    replay_frames: List[int] = None
+    # Directory of the compiled Defect layers, the shards of a job load the materials, projections and cameras built by
+    # the first of them and only build the graph of their frames. Only used on jobs with a saved stage_url
+    layer_cache_dir: str = None
+
+    class Config:
+        json_loads = json_loads
+        json_dumps = json_dumps
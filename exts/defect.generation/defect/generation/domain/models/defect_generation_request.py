@@ -1,16 +1,100 @@
-from typing import Any, List
-from pydantic import BaseModel
+from typing import Any, Dict, Iterator, List
+from pydantic import BaseModel, root_validator, validator
+from defect.generation.domain.models.defect_args import DefectArgs, parse_defect_args
+from defect.generation.utils.fast_json import json_dumps, json_loads
+
+def _move_args_count(defect: Dict[str, Any]) -> Dict[str, Any]:
+    # Args of schema version 1 have the count of the defect, it is the count of the defect when the defect has none
+    args = defect.get("args")
+    if not isinstance(args, dict) or "count" not in args:
+        return defect
+    args = dict(args)
+    count = args.pop("count")
+    return {**defect, "args": args, "count": defect.get("count", count)}
 
 class DefectObject(BaseModel):
     defect_name: str
-    args: Any
+    # Validated with the args schema registered for defect_name
+    args: DefectArgs
     uuid: str
+    # Number of defects with these args. A group of several defects is expanded into defects with the uuids
+    # "<uuid>_<index>" only where each defect needs its own identity: its prims, seeds and presampled parameters
+    count: int = 1
+
+    @root_validator(pre=True)
+    def _move_count(cls, values):
+        return _move_args_count(values)
+
+    @validator("args", pre=True)
+    def _parse_args(cls, args, values):
+        return parse_defect_args(values.get("defect_name"), args)
+
+    @validator("count")
+    def _check_count(cls, count):
+        if count < 1:
+            raise ValueError(f"Defect count must be at least 1, got {count}")
+        return count
+
+    def instances(self) -> Iterator["DefectObject"]:
+        # The defects of the group, they share the args of the group
+        if self.count == 1:
+            yield self
+            return
+        for index in range(self.count):
+            yield DefectObject.construct(defect_name=self.defect_name, args=self.args, uuid=f"{self.uuid}_{index}", count=1)
 
 class PrimDefectObject(BaseModel):
     prim_path: str
     defects: List[DefectObject]
 
+    def iter_defects(self) -> Iterator[DefectObject]:
+        # Every defect of the prim, with the groups expanded
+        for defect in self.defects:
+            yield from defect.instances()
+
+class PlacementRegion(BaseModel):
+    # Names of the UsdGeom.Subset face subsets of the meshes the defects are placed on, None for all faces
+    include_subsets: List[str] = None
+    # Names of the face subsets no defect is placed on
+    exclude_subsets: List[str] = None
+    # Only place defects on faces facing the scatter region of at least one camera
+    visible_only: bool = False
+
 class DefectGenerationRequest(BaseModel):
     prim_defects: List[PrimDefectObject]
     texture_dir: str
+    # Maximum number of defects shown per prim in a frame, None for no limit
+    max_visible_defects_per_prim: int = None
+    # Minimum distance between the centers of two defects shown in a frame, None to allow overlaps
+    min_defect_separation: float = None
+    # Region of each target prim the defects are placed in, by prim path. Prims without region use all their faces
+    placement_regions: Dict[str, PlacementRegion] = {}
+    # Relative weights of the texture files of a defect type, by defect name then texture file. Textures without weight
+    # have weight 1, defect types without weights pick their textures uniformly
+    texture_weights: Dict[str, Dict[str, float]] = {}
+
+    class Config:
+        json_loads = json_loads
+        json_dumps = json_dumps
+
+    @root_validator(pre=True)
+    def _parse_shared_defect_args(cls, values):
+        # The defects of a defect row of the UI have identical args, the args are validated once per distinct value
+        # instead of once per defect
+        parsed_args = {}
+        prim_defects = []
+        for prim_defect in values.get("prim_defects") or []:
+            if isinstance(prim_defect, dict) and isinstance(prim_defect.get("defects"), list):
+                defects = []
+                for defect in prim_defect["defects"]:
+                    if isinstance(defect, dict) and isinstance(defect.get("args"), dict):
+                        defect = _move_args_count(defect)
+                        key = (defect.get("defect_name"), json_dumps(defect["args"], sort_keys=True))
+                        if key not in parsed_args:
+                            parsed_args[key] = parse_defect_args(defect.get("defect_name"), defect["args"])
+                        defect = {**defect, "args": parsed_args[key].copy()}
+                    defects.append(defect)
+                prim_defect = {**prim_defect, "defects": defects}
+            prim_defects.append(prim_defect)
+        return {**values, "prim_defects": prim_defects} if "prim_defects" in values else values
 
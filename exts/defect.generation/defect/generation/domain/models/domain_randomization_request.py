@@ -16,10 +16,49 @@ class LightDomainRandomizationParameters(BaseModel):
     active = False
 
 
+class CameraRenderSettings(BaseModel):
+    resolution: Tuple[int, int] = (1024, 1024)
+    # Annotators attached to the render product ("rgb", "bounding_box_2d_tight", "semantic_segmentation"),
+    # None to use the annotators selected for the whole run
+    annotators: List[str] = None
+
+
+class PreviewSettings(BaseModel):
+    # Reduced graph for previews: a single low resolution camera, without writer nor annotators. The frames are planned
+    # for all the cameras of the job at their own resolutions, only the rendering uses the preview resolution
+    resolution: Tuple[int, int] = (256, 256)
+    # Camera of the camera plan that is previewed
+    camera_index: int = 0
+    # Preview steps, the first frames of the job
+    frames: int = 16
+
+
+class DefectTargetingParameters(BaseModel):
+    # Aim the cameras at the defects placed in each frame, context_fraction of the frames keep the look at sampling
+    context_fraction: float = 0.2
+    # Radius of the random offset of the look at point around the targeted defect
+    jitter: float = 0.0
+    # Distance of the cameras without scatter prim to the targeted defect, the camera distance if None
+    distance_min_value: float = None
+    distance_max_value: float = None
+    # Maximum angle in degrees between the view direction and the surface normal at the defect
+    max_view_angle: float = 60.0
+    active = False
+
+
 class CameraDomainRandomizationParameters(BaseModel):
     camera_distance_min_value: List[float] = None
     camera_distance_max_value: List[float] = None
     camera_prims: List[Tuple[str,Tuple[Tuple[float, float, float], ...]]] = None
+    # Maximum number of cameras (and render products), extra look at targets are cycled across frames. None for no limit
+    max_render_products: int = None
+    # Look at bounds closer than this are considered duplicates
+    look_at_tolerance: float = 1e-3
+    # Render settings of the cameras, render_settings overrides them per scatter prim path
+    default_render_settings: CameraRenderSettings = CameraRenderSettings()
+    render_settings: Dict[str, CameraRenderSettings] = None
+    # Aim the cameras at the sampled defect positions, needs the frame plan of the visibility pre-check
+    defect_targeting: DefectTargetingParameters = DefectTargetingParameters()
     active = False
 
 class ColorDomainRandomizationParameters(BaseModel):
@@ -32,6 +71,46 @@ class MaterialDomainRandomizationParameters(BaseModel):
     created_materials: Dict[str, List[str]] = None
     active = False
 
+class VisibilityPrecheckParameters(BaseModel):
+    # Cameras predicted to see no defect are resampled, then the defects of the frames no camera sees
+    max_camera_attempts: int = 10
+    max_defect_attempts: int = 3
+    # Drop the frames that are still predicted to show no defect instead of rendering them
+    skip_rejected_frames = False
+    # Reject defects on faces pointing away from the camera, only for meshes with consistent winding
+    check_facing = False
+    # Test occlusion against a coarse BVH of the occluder prims, the defect prims if None
+    check_occlusion = False
+    occluder_prims: List[str] = None
+    bvh_leaf_size: int = 16
+    bvh_max_leaves: int = 1024
+    # Fraction of the image border the defect centers must stay away from
+    frustum_margin: float = 0.0
+    active = False
+
+class ScheduleKeyframe(BaseModel):
+    # Frame id the values apply from, counted over the whole job so that all shards follow the same schedule
+    frame: int
+    # Scheduled values by name: defect args (rot_x_min, dim_h_max, visibility_probability...), light parameters
+    # (light_intensity_min_value, light_color_max_value...) or max_visible_defects_per_prim
+    values: Dict[str, Any]
+
+class ParameterSchedule(BaseModel):
+    keyframes: List[ScheduleKeyframe]
+    # "step" holds the values of a keyframe until the next one, "linear" interpolates between keyframes
+    interpolation = "step"
+    # Defect types the defect args apply to, all defects if None
+    defect_names: List[str] = None
+
+class AdaptiveSubframeParameters(BaseModel):
+    # Subframes of the frames where no costly randomizer changed the scene, and the most any frame renders with
+    min_subframes: int = 1
+    max_subframes: int = 32
+    # Subframes needed after a full change of the scene by each randomizer: light, material, color, camera or defect.
+    # Smaller changes need proportionally fewer, frames render with the highest need of their randomizers
+    randomizer_costs: Dict[str, int] = {"light": 32, "material": 16, "color": 8, "camera": 4, "defect": 1}
+    active = False
+
 class DomainRandomizationRequest(BaseModel):
     # Light params
     light_domain_randomization_params: LightDomainRandomizationParameters
@@ -41,3 +120,13 @@ class DomainRandomizationRequest(BaseModel):
     color_domain_randomization_params: ColorDomainRandomizationParameters
     # Material params
     material_domain_randomization_params: MaterialDomainRandomizationParameters
+    # Visibility pre-check params
+    visibility_precheck_params: VisibilityPrecheckParameters = VisibilityPrecheckParameters()
+    # Sequence the randomization ranges are sampled from: "uniform", "sobol" or "latin_hypercube"
+    sampling_method = "uniform"
+    # Frames sampled together, every block draws from its own seeds and a shard only samples the blocks of its frames
+    sampling_block_frames: int = 1024
+    # Parameters varying over the frames of the run, for curricula. Later schedules override the keys of earlier ones
+    parameter_schedules: List[ParameterSchedule] = []
+    # Per frame subframe counts, replacing the fixed rt_subframes of the run when active
+    adaptive_subframe_params: AdaptiveSubframeParameters = AdaptiveSubframeParameters()
@@ -2,6 +2,7 @@
 import omni.ui as ui
 from omni.kit.notification_manager import post_notification, NotificationStatus
 import carb
+from defect.generation.domain.models.defect_args import parse_defect_args
 
 
 class BaseDefectUI:
@@ -45,16 +46,18 @@ class BaseDefectUI:
             # Check if current selected prim exists in the defects parameters list
             if self.object_params.current_selected_prim_value in self.defect_parameters_list:
 
-                args = self.prepare_defect_args()
+                # Args with the defaults of the args schema of the defect type, stored as a dict for the JSON export
+                args = parse_defect_args(self.defect_name, self.prepare_defect_args()).dict()
 
                 # If it exists, append defects to it
                 self.defect_parameters_list[self.object_params.current_selected_prim_value].append({
                     "defect_name": self.defect_name,
+                    "count": self.count.as_int,
                     "args": args
                 })
 
                 post_notification(
-                    f"Added defect: {self.defect_name}, count: {args['count']}, semantic label: {args['semantic_label']}",
+                    f"Added defect: {self.defect_name}, count: {self.count.as_int}, semantic label: {args['semantic_label']}",
                     duration = 5,
                     status=NotificationStatus.INFO
                 )
@@ -72,15 +75,22 @@ class BaseDefectUI:
     def _build_base_ui(self):
         self.semantic_label = ui.SimpleStringModel(self.defect_name)
         self.count = ui.SimpleIntModel(1)
+        self.visibility_probability = ui.SimpleFloatModel(0.5, min=0.0, max=1.0)
         with ui.HStack():
             ui.Spacer(width=13)
             ui.Button("+", clicked_fn=self.add_new_defect_row)
         self._build_semantic_label()
+        self._build_visibility_probability()
 
     def _build_semantic_label(self):
         with ui.HStack(height=0, tooltip="The label that will be associated with the defect"):
             ui.Label("Defect Semantic")
             ui.StringField(model=self.semantic_label)
+
+    def _build_visibility_probability(self):
+        with ui.HStack(height=0, tooltip="Probability of each defect of this type being shown in a frame"):
+            ui.Label("Visibility Probability")
+            ui.FloatDrag(model=self.visibility_probability, min=0.0, max=1.0, step=0.01)
     
     def destroy(self):
         self.semantic_label = None
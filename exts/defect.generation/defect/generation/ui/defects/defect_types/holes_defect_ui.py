@@ -17,7 +17,7 @@ class HolesUI(BaseDefectUI):
             "rot_x_min": self.rot_x.min_value,
             "rot_x_max": self.rot_x.max_value,
             "semantic_label": self.semantic_label.as_string,
-            "count": self.count.as_int,
+            "visibility_probability": self.visibility_probability.as_float,
         }
         if self.rotation_cb.get_value_as_bool():
             common_args.update({
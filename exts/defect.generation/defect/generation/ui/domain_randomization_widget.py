@@ -5,7 +5,9 @@ from pxr import Sdf
 import asyncio
 from defect.generation.ui.widgets import MinMaxWidget, PathWidget, RGBMinMaxWidget, PositionMinMaxWidget, CustomDirectory
 from defect.generation.utils import helpers
-from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest, LightDomainRandomizationParameters, CameraDomainRandomizationParameters, ColorDomainRandomizationParameters, MaterialDomainRandomizationParameters
+from defect.generation.utils.bounds import WorldBoundsCache
+from defect.generation.core.sampling.low_discrepancy import SAMPLING_METHODS
+from defect.generation.domain.models.domain_randomization_request import DomainRandomizationRequest, LightDomainRandomizationParameters, CameraDomainRandomizationParameters, ColorDomainRandomizationParameters, MaterialDomainRandomizationParameters, VisibilityPrecheckParameters, DefectTargetingParameters
 MAX_NUMBER_PRIM_PATH_CHARACTERS_TO_SHOW = 30
 
 class RandomizerParameters():
@@ -21,6 +23,12 @@ class RandomizerParameters():
         # Camera Params
         self.camera_params_list = []
         self.camera_distance = None
+        self.max_cameras_model = ui.SimpleIntModel(0)
+        self.visibility_precheck_model = ui.SimpleBoolModel(False)
+        self.check_occlusion_model = ui.SimpleBoolModel(False)
+        self.skip_rejected_frames_model = ui.SimpleBoolModel(False)
+        self.defect_targeting_model = ui.SimpleBoolModel(False)
+        self.context_fraction_model = ui.SimpleFloatModel(0.2)
 
         # Color Params
         self.prim_colors = {}
@@ -29,6 +37,9 @@ class RandomizerParameters():
         self.material_prims = {} 
         self.created_materials = {}
 
+        # Sampler of the randomization ranges, index in SAMPLING_METHODS
+        self.sampling_method_model = None
+
         self.build_randomization_ui()
 
     def prepare_domain_randomization_request(self) -> DomainRandomizationRequest:
@@ -37,6 +48,7 @@ class RandomizerParameters():
 
         color_domain_randomization_params = ColorDomainRandomizationParameters()
         material_domain_randomization_params = MaterialDomainRandomizationParameters()
+        visibility_precheck_params = VisibilityPrecheckParameters()
 
         if self.light_cb.get_value_as_bool():
                 light_domain_randomization_params.active = True
@@ -72,10 +84,20 @@ class RandomizerParameters():
                     camera_domain_randomization_params.camera_distance_max_value = 5
                 else:
                     camera_domain_randomization_params.camera_distance_max_value = self.camera_distance.max_value
+            if self.max_cameras_model.as_int > 0:
+                camera_domain_randomization_params.max_render_products = self.max_cameras_model.as_int
+            if self.defect_targeting_model.as_bool:
+                camera_domain_randomization_params.defect_targeting = DefectTargetingParameters(
+                    active=True, context_fraction=min(max(self.context_fraction_model.as_float, 0.0), 1.0))
+            if self.visibility_precheck_model.as_bool:
+                visibility_precheck_params.active = True
+                visibility_precheck_params.check_occlusion = self.check_occlusion_model.as_bool
+                visibility_precheck_params.skip_rejected_frames = self.skip_rejected_frames_model.as_bool
             if len(self.camera_params_list) != 0:
                 # Send the lookat directly if the coordinates were manually specified, or calculate bbox coordinates if a path is given.
+                bounds_cache = WorldBoundsCache()
                 camera_domain_randomization_params.camera_prims = [
-    (scatter_prim, lookat_path if lookat_path == "" or isinstance(lookat_path, tuple) else helpers.get_bbox_dimensions(lookat_path))
+    (scatter_prim, lookat_path if lookat_path == "" or isinstance(lookat_path, tuple) else bounds_cache.get_bounds(lookat_path))
     for scatter_prim, lookat_path in self.camera_params_list]
             else:
                 camera_domain_randomization_params.camera_prims = []
@@ -101,7 +123,9 @@ class RandomizerParameters():
             light_domain_randomization_params=light_domain_randomization_params,
             camera_domain_randomization_params=camera_domain_randomization_params,
             color_domain_randomization_params=color_domain_randomization_params,
-            material_domain_randomization_params=material_domain_randomization_params
+            material_domain_randomization_params=material_domain_randomization_params,
+            visibility_precheck_params=visibility_precheck_params,
+            sampling_method=SAMPLING_METHODS[self.sampling_method_model.get_item_value_model().as_int]
         )
 
     def add_randomization_checkbox(self, name, callback):
@@ -187,6 +211,9 @@ class RandomizerParameters():
                                 self.y = PositionMinMaxWidget("Manual Coordinate Y", min_value=0, max_value=10)
                                 self.z = PositionMinMaxWidget("Manual Coordinate Z", min_value=0, max_value=10)
                     
+                    self._build_max_cameras_ui()
+                    self._build_visibility_precheck_ui()
+                    self._build_defect_targeting_ui()
                     with ui.HStack(): 
                         ui.Button("Add", clicked_fn=lambda: self.add_camera_params(), tooltip="Add the Current Scattering Prim and LookAt Prim")
                         ui.Button("Reset", clicked_fn=lambda: self.reset_current_camera_params(), tooltip="Reset the Scattering Prim and LookAt Prim")
@@ -217,6 +244,7 @@ class RandomizerParameters():
                 with ui.HStack():
                     ui.Line(height=ui.Length(20))
                 
+                bounds_cache = WorldBoundsCache()
                 for scattering, lookat in self.camera_params_list:
                     with ui.HStack(height=0):
                         ui.Label(f"{str(scattering)[:MAX_NUMBER_PRIM_PATH_CHARACTERS_TO_SHOW]}{'...' if len(str(scattering))>MAX_NUMBER_PRIM_PATH_CHARACTERS_TO_SHOW else ''}", width=225, style={"color": 0xFF777777},tooltip=str(scattering))
@@ -225,7 +253,7 @@ class RandomizerParameters():
                                 f"{str(lookat)[:MAX_NUMBER_PRIM_PATH_CHARACTERS_TO_SHOW]}{'...' if len(str(lookat)) > MAX_NUMBER_PRIM_PATH_CHARACTERS_TO_SHOW else ''}",
                                 width=225, style={"color": 0xFF777777},tooltip=str(lookat))
                             if lookat != "":
-                                look_at_range = helpers.get_bbox_dimensions(lookat)
+                                look_at_range = bounds_cache.get_bounds(lookat)
                                 center_coords = tuple( round((min_val + max_val) /2,3) for min_val, max_val in zip(look_at_range[0], look_at_range[1]))
                                 ui.Label(f"({center_coords})", width=225, style={"color": 0xFF777777})
                         else:
@@ -392,10 +420,7 @@ class RandomizerParameters():
             self.material_prims = {}
             self.created_materials = {}
             self.update_added_materials_ui()
-            if helpers.is_valid_prim('/Created_Materials'):
-                helpers.delete_prim('/Created_Materials')
-            if helpers.is_valid_prim('/Copied_Stage_Materials'):
-                helpers.delete_prim('/Copied_Stage_Materials')
+            helpers.delete_prims(['/Created_Materials', '/Copied_Stage_Materials'])
 
     def select_from_stage(self): 
         if self.from_stage_cb.get_value_as_bool(): 
@@ -426,11 +451,10 @@ class RandomizerParameters():
                             found_mats = helpers.get_all_children_paths([], prim)
                         # Create scope prim that will jold the copied materials 
                         helpers.create_prim_with_default_xform("Scope", "/Copied_Stage_Materials")
-                        for mat in found_mats:
-                            # Iterate through every material in selected stage materials and copy to created scope.
-                            material_name = str(mat).split("/")[-1]
-                            copied_path = helpers.copy_prim(mat, f"/Copied_Stage_Materials/{material_name}")
-                            self.created_materials[material_prim].append(copied_path)
+                        # Copy every material in selected stage materials to created scope in one batch.
+                        copied_paths = helpers.get_next_free_paths([f"/Copied_Stage_Materials/{str(mat).split('/')[-1]}" for mat in found_mats])
+                        copied_paths = helpers.copy_prims(list(zip(found_mats, copied_paths)))
+                        self.created_materials[material_prim].extend(copied_paths)
 
                     # If materials are from a browsed directory, create them in the stage
                     else: 
@@ -477,6 +501,30 @@ class RandomizerParameters():
                     self.light_cb.add_value_changed_fn(lambda _: self.build_light_ui())
 
 
+    def _build_max_cameras_ui(self):
+        with ui.HStack(height=0, tooltip="Maximum number of cameras/render products, 0 for no limit. Look at targets that do not fit are cycled across frames."):
+            ui.Label("Max Cameras")
+            ui.IntDrag(model=self.max_cameras_model, min=0)
+
+    def _build_visibility_precheck_ui(self):
+        with ui.HStack(height=0, tooltip="Predict on the CPU which defects the cameras see and resample the frames where no defect is visible before rendering."):
+            ui.Label("Visibility Pre-check")
+            ui.CheckBox(model=self.visibility_precheck_model, width=200)
+        with ui.HStack(height=0, tooltip="Also test occlusion of the defects by the defect prims."):
+            ui.Label("Pre-check Occlusion")
+            ui.CheckBox(model=self.check_occlusion_model, width=200)
+        with ui.HStack(height=0, tooltip="Do not render the frames that are still predicted to show no defect after resampling."):
+            ui.Label("Skip Empty Frames")
+            ui.CheckBox(model=self.skip_rejected_frames_model, width=200)
+
+    def _build_defect_targeting_ui(self):
+        with ui.HStack(height=0, tooltip="Aim the cameras at the defects placed in each frame instead of random points of the look at prims."):
+            ui.Label("Target Defects")
+            ui.CheckBox(model=self.defect_targeting_model, width=200)
+        with ui.HStack(height=0, tooltip="Fraction of the frames keeping the look at prim sampling, for context shots."):
+            ui.Label("Context Shots")
+            ui.FloatDrag(model=self.context_fraction_model, min=0, max=1, step=0.05)
+
     # Build the Camera Params in the UI when the Camera Checkbox is clicked.
     def build_camera_ui(self):
         # If Camera Randomization is checked
@@ -501,6 +549,9 @@ class RandomizerParameters():
                                     self.y = MinMaxWidget("Y", min_value=0, max_value=10)
                                     self.z = MinMaxWidget("Z", min_value=0, max_value=10)
 
+                        self._build_max_cameras_ui()
+                        self._build_visibility_precheck_ui()
+                        self._build_defect_targeting_ui()
                         with ui.HStack():
                             ui.Button("Add", clicked_fn=lambda: self.add_camera_params(), tooltip="Add the Current Scattering Prim and LookAt Prim")
                             ui.Button("Reset", clicked_fn=lambda: self.reset_current_camera_params(), tooltip="Reset the Scattering Prim and LookAt Prim")
@@ -618,4 +669,7 @@ class RandomizerParameters():
         self.light_params, self.light_cb = self.add_randomization_checkbox("Light", lambda _: self.build_light_ui())
         self.camera_params, self.camera_cb = self.add_randomization_checkbox("Camera", lambda _: self.build_camera_ui())
         self.color_params, self.color_cb = self.add_randomization_checkbox("Color", lambda _: self.build_color_ui())
-        self.material_params, self.material_cb = self.add_randomization_checkbox("Material", lambda _: self.build_materials_ui())
\ No newline at end of file
+        self.material_params, self.material_cb = self.add_randomization_checkbox("Material", lambda _: self.build_materials_ui())
+        with ui.HStack(height=0, tooltip="Sobol and Latin hypercube samples cover the light, camera, defect rotation and scale ranges evenly with fewer frames than uniform samples."):
+            ui.Label("Range Sampling")
+            self.sampling_method_model = ui.ComboBox(0, *SAMPLING_METHODS, width=200).model
\ No newline at end of file
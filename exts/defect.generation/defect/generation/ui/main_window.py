@@ -28,10 +28,12 @@ from defect.generation.core.replicator.replicator_defect import create_defect_la
 from defect.generation.utils.replicator_utils import rep_preview, does_defect_layer_exist, rep_run, get_defect_layer
 from defect.generation.ui.prim_widgets import ObjectParameters
 from defect.generation.ui.defects.defect_types_factory import DefectUIFactory
-from defect.generation.utils.helpers import delete_prim, is_valid_prim, generate_small_uuid, restore_original_materials
+from defect.generation.utils.helpers import delete_prims, is_valid_prim, generate_stable_uuid, restore_original_materials
 from defect.generation.ui.domain_randomization_widget import RandomizerParameters
 from defect.generation.utils.file_picker import open_file_dialog, click_open_json_startup
 from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest, DefectObject, PrimDefectObject
+from defect.generation.domain.models.domain_randomization_request import PreviewSettings
+from defect.generation.utils.seed_plan import SeedPlan
 from omni.kit.notification_manager import post_notification, NotificationStatus
 from pathlib import Path
 from functools import lru_cache
@@ -55,6 +57,12 @@ class MainWindow(ui.Window):
         # Models
         self.frames = ui.SimpleIntModel(1, min=1)
         self.rt_subframes = ui.SimpleIntModel(1, min=1)
+        self.seed = ui.SimpleIntModel(-1, min=-1)
+        self.low_cost_preview = ui.SimpleBoolModel(True)
+        # Arguments the graph on the stage was created with, a preview only reuses a graph of the same arguments
+        self._graph_args = None
+        self.max_visible_defects = ui.SimpleIntModel(0, min=0)
+        self.min_defect_separation = ui.SimpleFloatModel(0.0, min=0.0)
         # Widgets
         self.defect_params = None
         self.object_params = None
@@ -117,7 +125,8 @@ class MainWindow(ui.Window):
                             # Loop over each appended defect method, and format the content in the UI
                             for i, defect in enumerate(defects):
 
-                                args_formatted = []
+                                # Rows exported before the count moved out of the args have it in their args
+                                args_formatted = [f"count: {defect['count']}"] if "count" in defect else []
                                 for k, v in defect["args"].items():
                                     args_formatted.append(f"{k}: {v}" if not isinstance(v,float) else f"{k}: {v:.2f}")
                                 args_formatted = '\n'.join(args_formatted)
@@ -346,6 +355,8 @@ class MainWindow(ui.Window):
 
     def _build_replicator_param(self):
         self.original_materials = None
+        # Subframes per frame of the graph when it uses adaptive subframes
+        self.subframe_plan = None
         def _create_defect_layer(**kwargs):
             if len(self.defect_text.directory) == 0 :
                 post_notification(
@@ -360,24 +371,54 @@ class MainWindow(ui.Window):
                         continue
                     # If primvars not applied, apply them
                     self.object_params.apply(prim_path)
-                    for d in defects:
-                        for _ in range(int(d['args']['count'])):
-                            prim_defect_objects.append(PrimDefectObject(prim_path=prim_path, defects=[DefectObject(defect_name=d['defect_name'], args=d['args'], uuid=generate_small_uuid())]))
+                    # One group per defect row, expanded into count defects when the graph is built
+                    prim_defect_objects.append(PrimDefectObject(prim_path=prim_path, defects=[
+                        DefectObject.parse_obj({**d, "uuid": generate_stable_uuid(prim_path, defect_idx)})
+                        for defect_idx, d in enumerate(defects)]))
 
                 defect_generation_request = DefectGenerationRequest(
                             texture_dir=self.defect_text.directory,
-                            prim_defects = prim_defect_objects
+                            prim_defects = prim_defect_objects,
+                            # 0 leaves the number of defects shown per prim unbounded
+                            max_visible_defects_per_prim=self.max_visible_defects.get_value_as_int() or None,
+                            min_defect_separation=self.min_defect_separation.get_value_as_float() or None
                         )
                 domain_randomization_request = self.randomizer_params.prepare_domain_randomization_request()
-                self.original_materials = create_defect_layer(defect_generation_request, domain_randomization_request, **kwargs)
-                post_notification(f"Created defect layer with {len(self.defect_parameters_list)} total prims/groups and {sum(int(defect['args']['count']) for defects in self.defect_parameters_list.values() for defect in defects)} combined defects.", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
+                self.original_materials, self.subframe_plan = create_defect_layer(defect_generation_request, domain_randomization_request, **kwargs)
+                self._graph_args = kwargs
+                post_notification(f"Created defect layer with {len(self.defect_parameters_list)} total prims/groups and {sum(defect.count for prim_defect in prim_defect_objects for defect in prim_defect.defects)} combined defects.", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
        
+        def _job_seed():
+            # A negative seed draws a random job seed once, it is written to the seed field so that the preview and the
+            # runs after it use the same seed
+            seed = self.seed.get_value_as_int()
+            if seed < 0:
+                seed = SeedPlan(seed).job_seed
+                self.seed.set_value(seed)
+                post_notification(f"Drew the random job seed {seed}", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
+            return seed
+
+        def _run_args():
+            # Arguments of the run, previews are built with the same ones so that they show the frames of the run
+            subframes = self.rt_subframes.get_value_as_int()
+            if subframes < 1:
+                post_notification(
+                    f"Number of Subframes {subframes} Needs to Be Greater than 0. Setting the Value to 1",
+                    hide_after_timeout=True, duration=5, status=NotificationStatus.WARNING)
+                subframes = 1
+            return {"output_dir": self.output_dir.directory, "frames": self.frames.get_value_as_int(), "rt_subframes": subframes,
+                    "use_seg": self._use_seg.as_bool, "use_bb": self._use_bb.as_bool, "use_bmw": self._use_bmw.as_bool, "seed": _job_seed()}
+
         def preview_data():
-            if does_defect_layer_exist():
-                rep_preview()
-            else:
-                _create_defect_layer()
+            graph_args = _run_args()
+            if self.low_cost_preview.as_bool:
+                # Preview a reduced graph built from the same requests and run arguments as the full one
+                graph_args["preview"] = PreviewSettings()
+            if not does_defect_layer_exist() or self._graph_args != graph_args:
+                remove_replicator_graph()
+                _create_defect_layer(**graph_args)
                 self.rep_layer_button.text = "Recreate Replicator Graph"
+            rep_preview()
         
         # TODO: Fix that so it supports target_prim
         def remove_replicator_graph():
@@ -389,16 +430,10 @@ class MainWindow(ui.Window):
                                           sublayer_position=pos)
 
 
-            # Remove replicator
-            if is_valid_prim('/Replicator'):
-                delete_prim('/Replicator')
-                logger.warning(f"Deleting : /Replicator")
-            
-            #Remove projections
-            for prim_path in list(self.defect_parameters_list.keys()):
-                if is_valid_prim(f"{prim_path}/Projection"):
-                    delete_prim(f"{prim_path}/Projection")
-                    logger.warning(f"Deleting : {prim_path}/Projection")
+            # Remove replicator and projections
+            prims_to_delete = ['/Replicator'] + [f"{prim_path}/Projection" for prim_path in self.defect_parameters_list.keys()]
+            logger.warning(f"Deleting : {prims_to_delete}")
+            delete_prims(prims_to_delete)
 
 
         def delete_replicator_graph():
@@ -410,42 +445,22 @@ class MainWindow(ui.Window):
                                           layer_identifier=layer.identifier,
                                           sublayer_position=pos)
 
-            # Remove replicator
-            if is_valid_prim('/Replicator'):
-                delete_prim('/Replicator')
-                logger.warning(f"Deleting : /Replicator")
-            
-            #Remove projections
-            for prim_path in list(self.defect_parameters_list.keys()):
-                if is_valid_prim(f"{prim_path}/Projection"):
-                    delete_prim(f"{prim_path}/Projection")
-                    logger.warning(f"Deleting : {prim_path}/Projection")
-
-            #Remove Created materials
-            if is_valid_prim("/Created_Materials"):
-                delete_prim('/Created_Materials')
-                logger.warning(f"Deleting : /Created_Materials")
-                
-            #Remove Copied materials
-            if is_valid_prim("/Copied_Stage_Materials"):
-                delete_prim('/Copied_Stage_Materials')
-                logger.warning(f"Deleting : /Copied_Stage_Materials")
+            # Remove replicator, projections, created materials and copied materials
+            prims_to_delete = ['/Replicator'] + [f"{prim_path}/Projection" for prim_path in self.defect_parameters_list.keys()]
+            prims_to_delete += ['/Created_Materials', '/Copied_Stage_Materials']
+            logger.warning(f"Deleting : {prims_to_delete}")
+            delete_prims(prims_to_delete)
 
 
         def run_replicator():
             remove_replicator_graph()
-            total_frames = self.frames.get_value_as_int()
-            subframes = self.rt_subframes.get_value_as_int()
-            if subframes < 1:
-                post_notification(
-                    f"Number of Subframes {subframes} Needs to Be Greater than 0. Setting the Value to 1",
-                    hide_after_timeout=True, duration=5, status=NotificationStatus.WARNING)
-                subframes = 1
+            run_args = _run_args()
+            total_frames = run_args["frames"]
             if total_frames > 0:
-                post_notification(f"Running replicator with {total_frames} total frames and {subframes} subframes.", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
-                _create_defect_layer(output_dir = self.output_dir.directory, frames = total_frames,rt_subframes=subframes ,use_seg = self._use_seg.as_bool,use_bb= self._use_bb.as_bool, use_bmw = self._use_bmw.as_bool)
+                post_notification(f"Running replicator with {total_frames} total frames and {run_args['rt_subframes']} subframes.", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
+                _create_defect_layer(**run_args)
                 self.rep_layer_button.text = "Recreate Replicator Graph"
-                rep_run()
+                rep_run(self.subframe_plan)
             else:
                 post_notification(
                     f"Number of frames is {total_frames}. Input value needs to be greater than 0.",
@@ -454,7 +469,7 @@ class MainWindow(ui.Window):
         
         def create_replicator_graph():
             remove_replicator_graph()
-            _create_defect_layer()
+            _create_defect_layer(**_run_args())
             self.rep_layer_button.text = "Recreate Replicator Graph"
 
         def set_text(label, model):
@@ -481,6 +496,21 @@ class MainWindow(ui.Window):
                          tooltip="Defines how many subframes of rendering occur before going to the next frame")
                 ui.Spacer(width=ui.Fraction(0.25))
                 ui.IntField(model=self.rt_subframes)
+            with ui.HStack(height=0):
+                ui.Label("Seed: ", width=0,
+                         tooltip="Seed of the whole job, the same seed reproduces the same frames. -1 draws a random seed, written here when the graph is created so that the preview and the run use the same frames")
+                ui.Spacer(width=ui.Fraction(0.25))
+                ui.IntField(model=self.seed)
+            with ui.HStack(height=0):
+                ui.Label("Max Visible Defects per Prim: ", width=0,
+                         tooltip="Maximum number of defects shown on a prim in a frame, 0 for no limit")
+                ui.Spacer(width=ui.Fraction(0.25))
+                ui.IntField(model=self.max_visible_defects)
+            with ui.HStack(height=0):
+                ui.Label("Min Defect Separation: ", width=0,
+                         tooltip="Minimum distance between the centers of two defects shown in a frame, 0 allows overlapping defects")
+                ui.Spacer(width=ui.Fraction(0.25))
+                ui.FloatField(model=self.min_defect_separation)
             with ui.HStack(height=0):
                 self.rep_layer_button = ui.Button("Create Replicator Layer", 
                                                 clicked_fn=lambda: create_replicator_graph(), 
@@ -488,6 +518,9 @@ class MainWindow(ui.Window):
                 self.rep_delete_layer_button = ui.Button("Delete Replicator Layer", 
                                         clicked_fn=lambda: delete_replicator_graph(), 
                                         tooltip="Deletes the Replicator Graph and all relevant components")
+            with ui.HStack(height=0, tooltip="Preview a single low resolution camera, without writer nor annotators"):
+                ui.Label("Low-Cost Preview: ", width=0)
+                ui.CheckBox(model=self.low_cost_preview)
             with ui.HStack(height=0):
                 ui.Button("Preview", width=0, clicked_fn=lambda: preview_data(),
                           tooltip="Preview a Replicator Scene")
@@ -15,7 +15,7 @@
 
 import omni.ui as ui
 from defect.generation.ui.widgets import PathWidget
-from defect.generation.utils.helpers import is_valid_prim, get_prim, check_path
+from defect.generation.utils.helpers import is_valid_prim, get_prim, check_path, apply_defect_primvars
 from pxr import Sdf
 from omni.kit.notification_manager import post_notification, NotificationStatus
 import logging
@@ -63,11 +63,7 @@ class ObjectParameters():
     def apply(self, target_prim_path):
         def _apply_primvars(prim):
             # Apply prim vars
-            prim.CreateAttribute('primvars:d1_forward_vector', Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
-            prim.CreateAttribute('primvars:d1_right_vector', Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
-            prim.CreateAttribute('primvars:d1_up_vector', Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
-            prim.CreateAttribute('primvars:d1_position', Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
-            prim.CreateAttribute('primvars:v3_scale', Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
+            apply_defect_primvars(prim)
             post_notification(f"Applied Primvars to: {prim.GetPath()}", hide_after_timeout=True, duration=5, status=NotificationStatus.INFO)
 
         if not check_path(target_prim_path):
@@ -0,0 +1,50 @@
+from typing import Dict, Iterable, Tuple
+import carb
+from pxr import Usd, UsdGeom
+from defect.generation.utils.helpers import get_current_stage
+
+Bounds = Tuple[Tuple[float, float, float], Tuple[float, float, float]]
+
+
+class WorldBoundsCache:
+    """
+    World axis aligned bounds of prims, computed through a single UsdGeom.BBoxCache so that the bounds of shared
+    descendants are only computed once, and memoized per prim path. Create one per graph build, the cached bounds
+    are not invalidated when the stage changes.
+    """
+
+    def __init__(self, stage: Usd.Stage = None, time: Usd.TimeCode = Usd.TimeCode.Default(),
+                 purposes: Iterable[str] = (UsdGeom.Tokens.default_, UsdGeom.Tokens.render)) -> None:
+        self._stage = stage if stage is not None else get_current_stage()
+        self._bbox_cache = UsdGeom.BBoxCache(time, list(purposes), useExtentsHint=True)
+        self._bounds: Dict[str, Bounds] = {}
+
+    def get_bounds(self, prim_path) -> Bounds:
+        # Get the min and max coordinates of a prim based on its path
+        prim_path = str(prim_path)
+        if prim_path not in self._bounds:
+            self._bounds[prim_path] = self._compute_bounds(prim_path)
+        return self._bounds[prim_path]
+
+    def get_all_bounds(self, prim_paths: Iterable) -> Dict[str, Bounds]:
+        return {str(prim_path): self.get_bounds(prim_path) for prim_path in prim_paths}
+
+    def get_center(self, prim_path) -> Tuple[float, float, float]:
+        min_coordinates, max_coordinates = self.get_bounds(prim_path)
+        return tuple((min_val + max_val) / 2 for min_val, max_val in zip(min_coordinates, max_coordinates))
+
+    def clear(self):
+        self._bbox_cache.Clear()
+        self._bounds = {}
+
+    def _compute_bounds(self, prim_path: str) -> Bounds:
+        prim = self._stage.GetPrimAtPath(prim_path)
+        if not prim.IsValid():
+            carb.log_warn(f"No valid prim at path given: {prim_path}")
+            return (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+
+        bounds_range = self._bbox_cache.ComputeWorldBound(prim).ComputeAlignedRange()
+        if bounds_range.IsEmpty():
+            carb.log_warn(f"Prim {prim_path} has empty bounds")
+            return (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+        return tuple(bounds_range.GetMin()), tuple(bounds_range.GetMax())
@@ -0,0 +1,96 @@
+import json
+import os
+from typing import Dict, Iterable, Optional, Tuple
+import carb
+import carb.settings
+from pxr import Usd, UsdShade
+
+# Default schema shipped with the extension
+COLOR_ATTRIBUTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "color_attributes.json")
+# Setting listing additional user supplied schema files
+COLOR_ATTRIBUTE_SCHEMAS_SETTING = "/exts/defect.generation/color_attribute_schemas"
+
+
+class ColorAttributeRegistry:
+    """
+    Registry of the material color inputs that can be randomized, mapping each input name to its type ("float3" or "float4").
+    The schema files are read once, lookups are done through a dictionary and the color inputs found on a shader are memoized
+    per shader source asset, since every shader created from the same MDL module exposes the same inputs.
+    """
+
+    def __init__(self, schema_files: Iterable[str] = (COLOR_ATTRIBUTES_FILE,)) -> None:
+        self._color_inputs: Dict[str, str] = {}
+        self._shader_cache: Dict[Tuple[str, str], Dict[str, str]] = {}
+        for schema_file in schema_files:
+            self.register_schema_file(schema_file)
+
+    @property
+    def color_inputs(self) -> Dict[str, str]:
+        return dict(self._color_inputs)
+
+    def register_schema_file(self, schema_file: str):
+        # Load a user supplied schema file with the same structure as color_attributes.json.
+        # Later files override the type of inputs that were already registered.
+        with open(schema_file, 'r') as file:
+            color_inputs = json.load(file)["color_inputs"]
+
+        for color_input in color_inputs:
+            self._color_inputs[color_input["name"]] = color_input["type"]
+        self._shader_cache.clear()
+
+    def register_color_input(self, name: str, attr_type: str):
+        if attr_type not in ("float3", "float4"):
+            raise ValueError(f"Color input type must be 'float3' or 'float4', got '{attr_type}'")
+        self._color_inputs[name] = attr_type
+        self._shader_cache.clear()
+
+    def search(self, properties_list) -> Dict[str, str]:
+        # Search for registered color attributes in the list of all attributes of a material.
+        result = {}
+        for property in properties_list:
+            # Get this property's name with all namespace prefixes removed
+            name = property.GetBaseName()
+            attr_type = self._color_inputs.get(name)
+            if attr_type is not None:
+                result[name] = attr_type
+        return result
+
+    def search_shader(self, shader_prim: Usd.Prim) -> Dict[str, str]:
+        # Same as search, but memoized on the source asset of the shader.
+        key = self._get_source_asset_key(shader_prim)
+        if key is None:
+            return self.search(shader_prim.GetAttributes())
+
+        if key not in self._shader_cache:
+            self._shader_cache[key] = self.search(shader_prim.GetAttributes())
+        return dict(self._shader_cache[key])
+
+    def clear_cache(self):
+        self._shader_cache.clear()
+
+    @staticmethod
+    def _get_source_asset_key(shader_prim: Usd.Prim) -> Optional[Tuple[str, str]]:
+        shader = UsdShade.Shader(shader_prim)
+        if not shader:
+            return None
+        source_asset = shader.GetSourceAsset("mdl")
+        if not source_asset or not source_asset.path:
+            return None
+        sub_identifier = shader.GetSourceAssetSubIdentifier("mdl") or ""
+        return (source_asset.resolvedPath or source_asset.path, sub_identifier)
+
+
+_registry: Optional[ColorAttributeRegistry] = None
+
+
+def get_color_attribute_registry() -> ColorAttributeRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ColorAttributeRegistry()
+        for schema_file in carb.settings.get_settings().get(COLOR_ATTRIBUTE_SCHEMAS_SETTING) or []:
+            if os.path.isfile(schema_file):
+                _registry.register_schema_file(schema_file)
+            else:
+                carb.log_warn(f"Color attribute schema file not found: {schema_file}")
+        carb.log_info(f"Loaded {len(_registry.color_inputs)} color inputs from {COLOR_ATTRIBUTES_FILE}")
+    return _registry
@@ -0,0 +1,30 @@
+"""
+JSON helpers used by the job models. orjson parses and serializes the large job files several times faster than the
+json module, it is used when it is installed and json is used otherwise, with the same results.
+"""
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data) -> Any:
+    # Parse a JSON str or bytes
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any, *, default: Callable = None, sort_keys: bool = False, indent: int = None, **kwargs) -> str:
+    # Same signature as json.dumps for the arguments used by pydantic and this extension
+    if orjson is None:
+        return json.dumps(value, default=default, sort_keys=sort_keys, indent=indent, **kwargs)
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(value, default=default, option=option).decode()
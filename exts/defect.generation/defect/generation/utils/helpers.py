@@ -13,16 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import uuid
-from typing import List
+import hashlib
+from typing import List, Tuple
 import omni.usd
 import carb
 import omni.kit.commands
+import omni.kit.undo
 import os
-from pxr import Usd, Gf, Sdf
+from pxr import Usd, Gf, Sdf, UsdShade
 from defect.generation.domain.models.defect_generation_request import PrimDefectObject, DefectObject
 import matplotlib as mpl
-import json
-import inspect
+from defect.generation.utils.color_attributes import get_color_attribute_registry
 def get_current_stage():
     context = omni.usd.get_context()
     stage = context.get_stage()
@@ -46,6 +47,45 @@ def delete_prim(path: str):
         paths=[path],
         destructive=False)
 
+def delete_prims(paths: List[str], undoable: bool = False):
+    """
+    Delete a list of prims. Specs are removed from the edit target and session layers inside a single Sdf.ChangeBlock,
+    prims that are still composed from other layers (sublayers, references) are deactivated in the edit target instead,
+    so the other layers are never modified.
+
+    Parameters:
+        paths (List[str]): Paths of the prims to delete.
+        undoable (bool): Go through a single DeletePrims command instead, so the deletion is one undo entry.
+    """
+    stage = get_current_stage()
+    paths = [str(path) for path in paths if stage.GetPrimAtPath(str(path)).IsValid()]
+    if not paths:
+        return
+    if undoable:
+        omni.kit.commands.execute('DeletePrims',
+            paths=paths,
+            destructive=False)
+        return
+
+    edit_layer = stage.GetEditTarget().GetLayer()
+    edited_layers = [edit_layer] if edit_layer == stage.GetSessionLayer() else [edit_layer, stage.GetSessionLayer()]
+    deactivate = []
+    for path in paths:
+        prim_stack = stage.GetPrimAtPath(path).GetPrimStack()
+        if any(spec.layer not in edited_layers for spec in prim_stack):
+            deactivate.append(path)
+
+    with Sdf.ChangeBlock():
+        for path in paths:
+            sdf_path = Sdf.Path(path)
+            for layer in edited_layers:
+                prim_spec = layer.GetPrimAtPath(sdf_path)
+                if prim_spec is None:
+                    continue
+                layer.GetPrimAtPath(sdf_path.GetParentPath()).RemoveNameChild(prim_spec)
+        for path in deactivate:
+            Sdf.CreatePrimInLayer(edit_layer, path).active = False
+
 def get_prim_attr(prim_path: str, attr_name: str):
     prim = get_prim(prim_path)
     return prim.GetAttribute(attr_name).Get()
@@ -90,9 +130,20 @@ def get_all_children_paths(children, parent_prim: Usd.Prim):
     return children
 
 
+# Primvars used by the defect projection, authored on every prim with defects
+DEFECT_PRIMVARS = ('primvars:d1_forward_vector', 'primvars:d1_right_vector', 'primvars:d1_up_vector', 'primvars:d1_position', 'primvars:v3_scale')
+
+def apply_defect_primvars(prim: Usd.Prim):
+    for primvar in DEFECT_PRIMVARS:
+        prim.CreateAttribute(primvar, Sdf.ValueTypeNames.Float3, custom=True).Set((0,0,0))
+
 def generate_small_uuid():
     return str(uuid.uuid4())[:8]
 
+def generate_stable_uuid(*parts):
+    # Small uuid derived from the given parts, so that the same defect gets the same uuid (and seeds) in every session
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()[:8]
+
 def get_center_coordinates(prim_path: str):
     stage = omni.usd.get_context().get_stage()
     prim = stage.GetPrimAtPath(prim_path)
@@ -103,13 +154,13 @@ def get_center_coordinates(prim_path: str):
 def fetch_all_defect_objects(prim_defect_list: List[PrimDefectObject]) -> List[DefectObject]:
     all_defect_objects = []
     for prim_defect in prim_defect_list:
-        for defect in prim_defect.defects:
+        for defect in prim_defect.iter_defects():
             all_defect_objects.append(defect)
     return all_defect_objects
 
 def find_prim_defect_by_uuid(prim_defects: List[PrimDefectObject], target_uuid: str) -> PrimDefectObject:
     for prim_defect in prim_defects:
-        for defect in prim_defect.defects:
+        for defect in prim_defect.iter_defects():
             if defect.uuid == target_uuid:
                 return prim_defect
 
@@ -164,6 +215,170 @@ def copy_prim(path_from: str, path_to: str):
     copied_path = str(omni.usd.get_context().get_selection().get_selected_prim_paths()[0])
     return copied_path
 
+def _is_layer_relative_asset(asset_path: str) -> bool:
+    # Only "./" and "../" paths are anchored to their layer, bare names (e.g. "OmniPBR.mdl") go through the search paths.
+    return asset_path.startswith("./") or asset_path.startswith("../")
+
+def _anchor_asset_path(attr_spec: Sdf.AttributeSpec, src_layer: Sdf.Layer):
+    # Make a layer relative asset path absolute after copying the attribute out of src_layer.
+    if attr_spec.typeName != Sdf.ValueTypeNames.Asset or not attr_spec.HasDefaultValue():
+        return
+    value = attr_spec.default
+    if value is not None and _is_layer_relative_asset(value.path):
+        attr_spec.default = Sdf.AssetPath(src_layer.ComputeAbsolutePath(value.path))
+
+def _anchor_asset_paths(prim_spec: Sdf.PrimSpec, src_layer: Sdf.Layer):
+    for attr_spec in prim_spec.attributes:
+        _anchor_asset_path(attr_spec, src_layer)
+    for child_spec in prim_spec.nameChildren:
+        _anchor_asset_paths(child_spec, src_layer)
+
+def _namespace_maps(prim: Usd.Prim) -> dict:
+    # Map function from the namespace of every (layer, spec path) of the prim stack to the stage namespace, specs brought
+    # in by a reference or payload are authored at other paths than the prim
+    maps = {}
+    nodes = [prim.GetPrimIndex().rootNode]
+    while nodes:
+        node = nodes.pop()
+        for node_layer in node.layerStack.layers:
+            maps[(node_layer.identifier, node.path)] = node.mapToRoot
+        nodes.extend(node.children)
+    return maps
+
+def _target_remapper(src_path: Sdf.Path, prim_path: Sdf.Path, dst_path: Sdf.Path, map_to_root):
+    # Relationship targets and connections of the copy: paths inside of the copied prim point at the copy, the others are
+    # brought from the namespace of the source spec to the stage namespace.
+    def remap(path: Sdf.Path) -> Sdf.Path:
+        if path.HasPrefix(dst_path):
+            # Already remapped by Sdf.CopySpec
+            return path
+        if path.HasPrefix(src_path):
+            return path.ReplacePrefix(src_path, dst_path)
+        if map_to_root is not None:
+            mapped_path = map_to_root.MapSourceToTarget(path)
+            path = path if mapped_path.isEmpty else mapped_path
+        return path.ReplacePrefix(prim_path, dst_path) if path.HasPrefix(prim_path) else path
+    return remap
+
+def _remap_targets(spec, remap):
+    if isinstance(spec, Sdf.PrimSpec):
+        for prop_spec in spec.properties:
+            _remap_targets(prop_spec, remap)
+        for child_spec in spec.nameChildren:
+            _remap_targets(child_spec, remap)
+        return
+    path_list = spec.targetPathList if isinstance(spec, Sdf.RelationshipSpec) else spec.connectionPathList
+    paths = set(path_list.explicitItems) | set(path_list.addedItems) | set(path_list.prependedItems) \
+        | set(path_list.appendedItems) | set(path_list.deletedItems) | set(path_list.orderedItems)
+    for path in paths:
+        remapped_path = remap(path)
+        if remapped_path != path:
+            path_list.ReplaceItemEdits(path, remapped_path)
+
+def _copy_prim_spec(src_spec: Sdf.PrimSpec, dst_layer: Sdf.Layer, dst_path: Sdf.Path, remap):
+    Sdf.CreatePrimInLayer(dst_layer, dst_path)
+    Sdf.CopySpec(src_spec.layer, src_spec.path, dst_layer, dst_path)
+    dst_spec = dst_layer.GetPrimAtPath(dst_path)
+    _remap_targets(dst_spec, remap)
+    if src_spec.layer != dst_layer:
+        _anchor_asset_paths(dst_spec, src_spec.layer)
+
+def _merge_prim_spec(src_spec: Sdf.PrimSpec, dst_layer: Sdf.Layer, dst_path: Sdf.Path, remap):
+    # Author the opinions of src_spec over the spec at dst_path, recursing into the children.
+    dst_spec = dst_layer.GetPrimAtPath(dst_path)
+    if dst_spec is None:
+        _copy_prim_spec(src_spec, dst_layer, dst_path, remap)
+        return
+    for prop_spec in src_spec.properties:
+        dst_prop_path = dst_path.AppendProperty(prop_spec.name)
+        Sdf.CopySpec(src_spec.layer, prop_spec.path, dst_layer, dst_prop_path)
+        _remap_targets(dst_layer.GetPropertyAtPath(dst_prop_path), remap)
+        if src_spec.layer != dst_layer and isinstance(prop_spec, Sdf.AttributeSpec):
+            _anchor_asset_path(dst_layer.GetAttributeAtPath(dst_prop_path), src_spec.layer)
+    for child_spec in src_spec.nameChildren:
+        _merge_prim_spec(child_spec, dst_layer, dst_path.AppendChild(child_spec.name), remap)
+
+def copy_prims(path_pairs: List[Tuple[str, str]], layer: Sdf.Layer = None, undoable: bool = False) -> List[str]:
+    """
+    Copy the composed prims of a list of (path_from, path_to) pairs into a layer (the edit target by default)
+    inside a single Sdf.ChangeBlock, so the stage recomposes once for the whole batch. A destination that is already
+    taken gets the next free path instead of being overwritten. Relationship targets and connections inside of a copied
+    prim point at the copy.
+
+    Parameters:
+        path_pairs (List[Tuple[str, str]]): Source and destination prim paths.
+        layer (Sdf.Layer): Layer to author the copies in. Defaults to the current edit target layer.
+        undoable (bool): Go through CopyPrim commands grouped in a single undo entry instead. The destination paths
+            must be free, as the command renames the copy otherwise.
+
+    Returns:
+        List[str]: Actual destination paths of the prims that were copied.
+    """
+    if undoable:
+        with omni.kit.undo.group():
+            for path_from, path_to in path_pairs:
+                omni.kit.commands.execute('CopyPrim',
+                    path_from=str(path_from),
+                    path_to=str(path_to),
+                    exclusive_select=False,
+                    copy_to_introducing_layer=False)
+        return [str(path_to) for _, path_to in path_pairs]
+
+    stage = get_current_stage()
+    if layer is None:
+        layer = stage.GetEditTarget().GetLayer()
+
+    # Gather the specs before opening the change block, the stage is not recomposed inside of it.
+    copies = []
+    undefined_parents = set()
+    for (path_from, path_to), free_path in zip(path_pairs, get_next_free_paths([path_to for _, path_to in path_pairs])):
+        prim = stage.GetPrimAtPath(str(path_from))
+        if not prim.IsValid():
+            carb.log_warn(f"Cannot copy {path_from}, no valid prim at that path")
+            continue
+        if free_path != str(path_to):
+            carb.log_warn(f"{path_to} already exists, copying {path_from} to {free_path} instead")
+        # Prim stack is ordered strongest first, start from the weakest defining spec and merge stronger opinions on top of it.
+        prim_stack = list(reversed(prim.GetPrimStack()))
+        defining_specs = [i for i, spec in enumerate(prim_stack) if spec.specifier == Sdf.SpecifierDef]
+        prim_stack = prim_stack[defining_specs[0]:] if defining_specs else prim_stack
+        dst_path = Sdf.Path(free_path)
+        namespace_maps = _namespace_maps(prim)
+        remaps = [_target_remapper(spec.path, prim.GetPath(), dst_path, namespace_maps.get((spec.layer.identifier, spec.path)))
+                  for spec in prim_stack]
+        copies.append((prim_stack, remaps, dst_path))
+
+        parent_path = dst_path.GetParentPath()
+        while parent_path != Sdf.Path.absoluteRootPath and not stage.GetPrimAtPath(parent_path).IsDefined():
+            undefined_parents.add(parent_path)
+            parent_path = parent_path.GetParentPath()
+
+    with Sdf.ChangeBlock():
+        for parent_path in undefined_parents:
+            Sdf.CreatePrimInLayer(layer, parent_path).specifier = Sdf.SpecifierDef
+        for prim_stack, remaps, dst_path in copies:
+            _copy_prim_spec(prim_stack[0], layer, dst_path, remaps[0])
+            for spec, remap in zip(prim_stack[1:], remaps[1:]):
+                _merge_prim_spec(spec, layer, dst_path, remap)
+            layer.GetPrimAtPath(dst_path).specifier = Sdf.SpecifierDef
+
+    return [str(dst_path) for _, _, dst_path in copies]
+
+def get_next_free_paths(paths: List[str]) -> List[str]:
+    # Suffix the paths that already exist on the stage (or earlier in the list) with an index, e.g. /Looks/Mat_01.
+    stage = get_current_stage()
+    reserved = set()
+    free_paths = []
+    for path in paths:
+        free_path = str(path)
+        idx = 1
+        while free_path in reserved or stage.GetPrimAtPath(free_path).IsValid():
+            free_path = f"{path}_{idx:02d}"
+            idx += 1
+        reserved.add(free_path)
+        free_paths.append(free_path)
+    return free_paths
+
 def create_prim_with_default_xform(prim_type: str, prim_path: str):
     omni.kit.commands.execute('CreatePrimWithDefaultXform',
         prim_type=prim_type,
@@ -215,33 +430,68 @@ def bind_material(material_path, prim_path):
         prim_path=[prim_path],
         strength=['weakerThanDescendants'])
 
+def bind_materials(bindings: List[Tuple[str, str]], layer: Sdf.Layer = None, undoable: bool = False):
+    """
+    Bind materials to prims with a "weakerThanDescendants" strength, authoring all the bindings in the edit target
+    layer inside a single Sdf.ChangeBlock.
+
+    Parameters:
+        bindings (List[Tuple[str, str]]): (material_path, prim_path) pairs.
+        layer (Sdf.Layer): Layer to author the bindings in. Defaults to the current edit target layer.
+        undoable (bool): Go through BindMaterial commands (one per material) grouped in a single undo entry instead.
+    """
+    if undoable:
+        prims_per_material = {}
+        for material_path, prim_path in bindings:
+            prims_per_material.setdefault(str(material_path), []).append(str(prim_path))
+        with omni.kit.undo.group():
+            for material_path, prim_paths in prims_per_material.items():
+                omni.kit.commands.execute('BindMaterial',
+                    material_path=material_path,
+                    prim_path=prim_paths,
+                    strength=['weakerThanDescendants'] * len(prim_paths))
+        return
+
+    if layer is None:
+        layer = get_current_stage().GetEditTarget().GetLayer()
+
+    with Sdf.ChangeBlock():
+        for material_path, prim_path in bindings:
+            prim_spec = Sdf.CreatePrimInLayer(layer, Sdf.Path(str(prim_path)))
+
+            # Apply the MaterialBindingAPI schema
+            api_schemas = prim_spec.GetInfo("apiSchemas")
+            if api_schemas.isExplicit:
+                if "MaterialBindingAPI" not in api_schemas.explicitItems:
+                    api_schemas.explicitItems = list(api_schemas.explicitItems) + ["MaterialBindingAPI"]
+            elif "MaterialBindingAPI" not in api_schemas.prependedItems:
+                api_schemas.prependedItems = list(api_schemas.prependedItems) + ["MaterialBindingAPI"]
+            prim_spec.SetInfo("apiSchemas", api_schemas)
+
+            # Author the material:binding relationship
+            if UsdShade.Tokens.materialBinding in prim_spec.relationships:
+                binding = prim_spec.relationships[UsdShade.Tokens.materialBinding]
+            else:
+                binding = Sdf.RelationshipSpec(prim_spec, UsdShade.Tokens.materialBinding, custom=False)
+            binding.targetPathList.explicitItems = [Sdf.Path(str(material_path))]
+            binding.SetInfo("bindMaterialAs", UsdShade.Tokens.weakerThanDescendants)
+
 def restore_original_materials(original_materials): 
     # Restore original materials for each prim
-    print(f'original materials {original_materials}')
     if original_materials is not None:
+        bindings = []
         for parent_path in original_materials: 
             parent_materials = original_materials[parent_path] 
             if parent_materials is not None and len(parent_materials)>0:
                 for child_path, material_path in original_materials[parent_path].items(): 
-                        bind_material(material_path, child_path)
+                    if material_path is not None:
+                        bindings.append((material_path, child_path))
+        bind_materials(bindings)
 
 def search_color_properties(properties_list):
-    # Search for color attributes specified in the color_attributes.json file from the list of all attributes of a material. 
-
-    # Get JSON File path
-    dir_path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-    json_file_path = os.path.join(dir_path, 'color_attributes.json')
-
-    with open(json_file_path, 'r') as file:
-        color_inputs = json.load(file)["color_inputs"]
-
-    result = {}
-    # Iterate through each property or attribute in the list of all attributes
-    for property in properties_list:
-        # Get this property’s name with all namespace prefixes removed
-        property = property.GetBaseName()
-        for color_input in color_inputs:
-            # If the material's color attribute is found in the json file, append to result.
-            if property == color_input["name"]:
-                result[property] = color_input['type']
-    return result
+    # Search for color attributes specified in the color_attributes.json file (and any registered schema file) from the list of all attributes of a material.
+    return get_color_attribute_registry().search(properties_list)
+
+def search_shader_color_properties(shader_prim: Usd.Prim):
+    # Same as search_color_properties, memoized per shader source asset.
+    return get_color_attribute_registry().search_shader(shader_prim)
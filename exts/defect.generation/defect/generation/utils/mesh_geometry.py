@@ -0,0 +1,101 @@
+import hashlib
+from typing import Dict, Iterable, List, Tuple
+import carb
+import numpy as np
+from pxr import Usd, UsdGeom
+from defect.generation.utils.helpers import get_current_stage
+
+
+def get_mesh_paths(prim_path: str, stage: Usd.Stage = None) -> List[str]:
+    # Mesh prims at or under a prim path, the surfaces the defects of that prim are placed on
+    stage = stage if stage is not None else get_current_stage()
+    prim = stage.GetPrimAtPath(str(prim_path))
+    if not prim.IsValid():
+        carb.log_warn(f"No valid prim at path given: {prim_path}")
+        return []
+    return [str(child.GetPath()) for child in Usd.PrimRange(prim) if child.IsA(UsdGeom.Mesh)]
+
+
+def get_world_triangles(mesh_paths: Iterable[str], stage: Usd.Stage = None,
+                        time: Usd.TimeCode = Usd.TimeCode.Default()) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Triangulate meshes in world space, polygons are split as fans around their first vertex.
+
+    Parameters:
+        mesh_paths (Iterable[str]): Paths of UsdGeom.Mesh prims.
+        stage (Usd.Stage): Stage of the meshes, the current stage if None.
+        time (Usd.TimeCode): Time the points and transforms are read at.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]:
+            - (N, 3) float array of the world space vertices of all meshes.
+            - (M, 3) int array of the vertex indices of every triangle.
+    """
+    stage = stage if stage is not None else get_current_stage()
+    xform_cache = UsdGeom.XformCache(time)
+    all_vertices = []
+    all_triangles = []
+    vertex_offset = 0
+    for mesh_path in mesh_paths:
+        mesh = UsdGeom.Mesh(stage.GetPrimAtPath(str(mesh_path)))
+        points = mesh.GetPointsAttr().Get(time)
+        face_vertex_counts = mesh.GetFaceVertexCountsAttr().Get(time)
+        face_vertex_indices = mesh.GetFaceVertexIndicesAttr().Get(time)
+        if not points or not face_vertex_counts or not face_vertex_indices:
+            carb.log_warn(f"Skipping mesh without geometry: {mesh_path}")
+            continue
+
+        # Transform the points to world space, USD matrices are row major and transform row vectors
+        matrix = np.array(xform_cache.GetLocalToWorldTransform(mesh.GetPrim()), dtype=np.float64)
+        points = np.array(points, dtype=np.float64)
+        vertices = points @ matrix[:3, :3] + matrix[3, :3]
+
+        triangles = triangulate(np.array(face_vertex_counts, dtype=np.int64), np.array(face_vertex_indices, dtype=np.int64))
+        all_vertices.append(vertices)
+        all_triangles.append(triangles + vertex_offset)
+        vertex_offset += len(vertices)
+
+    if not all_vertices:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(all_vertices), np.concatenate(all_triangles)
+
+
+def triangulate(face_vertex_counts: np.ndarray, face_vertex_indices: np.ndarray) -> np.ndarray:
+    # Fan triangulation of all faces at once: face f with n vertices gives triangles (v0, vi, vi+1) for i in 1..n-2
+    face_starts = np.concatenate(([0], np.cumsum(face_vertex_counts)[:-1]))
+    triangle_counts = np.maximum(face_vertex_counts - 2, 0)
+    triangle_faces = np.repeat(np.arange(len(face_vertex_counts)), triangle_counts)
+    # Index of the triangle inside its face
+    triangle_offsets = np.arange(len(triangle_faces)) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+    first = face_starts[triangle_faces]
+    return np.stack([face_vertex_indices[first],
+                     face_vertex_indices[first + triangle_offsets + 1],
+                     face_vertex_indices[first + triangle_offsets + 2]], axis=1)
+
+
+def triangle_faces(face_vertex_counts: np.ndarray) -> np.ndarray:
+    # Face index of every triangle returned by triangulate
+    return np.repeat(np.arange(len(face_vertex_counts)), np.maximum(face_vertex_counts - 2, 0))
+
+
+def topology_hash(face_vertex_counts: np.ndarray, face_vertex_indices: np.ndarray) -> str:
+    # Hash of the connectivity of a mesh, independent of its points and transform
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(face_vertex_counts, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(face_vertex_indices, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def get_subset_faces(mesh: UsdGeom.Mesh, subset_names: Iterable[str], time: Usd.TimeCode = Usd.TimeCode.Default()) -> np.ndarray:
+    # Face indices of the UsdGeom.Subset children of a mesh with the given names
+    subset_names = set(subset_names)
+    faces = [np.array(subset.GetIndicesAttr().Get(time) or [], dtype=np.int64)
+             for subset in UsdGeom.Subset.GetAllGeomSubsets(UsdGeom.Imageable(mesh.GetPrim()))
+             if subset.GetPrim().GetName() in subset_names and subset.GetElementTypeAttr().Get() == UsdGeom.Tokens.face]
+    return np.unique(np.concatenate(faces)) if faces else np.zeros(0, dtype=np.int64)
+
+
+def get_prim_triangles(prim_paths: Iterable[str], stage: Usd.Stage = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    # World space triangles of all meshes under each prim path
+    stage = stage if stage is not None else get_current_stage()
+    return {str(prim_path): get_world_triangles(get_mesh_paths(prim_path, stage), stage) for prim_path in prim_paths}
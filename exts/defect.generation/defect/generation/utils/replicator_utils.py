@@ -1,3 +1,5 @@
+import asyncio
+from typing import List
 import omni.replicator.core as rep
 from defect.generation.utils.helpers import *
 
@@ -6,8 +8,17 @@ from defect.generation.utils.helpers import *
 def rep_preview():
     rep.orchestrator.preview()
 
-def rep_run():
-    rep.orchestrator.run()
+def rep_run(subframes: List[int] = None):
+    # With a subframe count per frame, the frames are stepped one at a time instead of run by the trigger
+    if subframes is None:
+        rep.orchestrator.run()
+    else:
+        asyncio.ensure_future(rep_run_frames_async(subframes))
+
+async def rep_run_frames_async(subframes: List[int]):
+    for rt_subframes in subframes:
+        await rep.orchestrator.step_async(rt_subframes=int(rt_subframes), pause_timeline=False)
+    await rep.orchestrator.wait_until_complete_async()
 
 def does_defect_layer_exist() -> bool:
     stage = get_current_stage()
@@ -0,0 +1,53 @@
+import hashlib
+import random
+from typing import Tuple
+
+MAX_SEED = 2**31 - 1
+
+
+class SeedPlan:
+    """
+    Seeds of all randomizers of a job, derived from a single job seed. Every randomizer gets a stable sub-seed from
+    its name and a key (e.g. the defect UUID) only, so the same job seed always reproduces the same samples.
+    start_frame is the frame id of the first sampled frame, it does not change the seeds. The frames of a job are
+    sampled in blocks of frames aligned at the first frame of the job, and every block draws from seeds of its own, so
+    the shards of a job only sample the blocks of their frames and the frames do not depend on the number of shards.
+    Runs meant to draw other frames than a previous run need another job seed.
+    """
+
+    def __init__(self, job_seed: int = None, start_frame: int = 0, block: int = 0) -> None:
+        if job_seed is None or job_seed < 0:
+            job_seed = random.SystemRandom().randint(0, MAX_SEED)
+        self.job_seed = job_seed
+        self.start_frame = start_frame
+        self.block = block
+
+    def seed(self, randomizer: str, key: str = "") -> int:
+        # The first block keeps the seeds of the jobs sampled in a single block
+        block = f"{self.block}:" if self.block else ""
+        digest = hashlib.sha256(f"{self.job_seed}:{block}{randomizer}:{key}".encode()).digest()
+        return int.from_bytes(digest[:4], "little") & MAX_SEED
+
+    def rng(self, randomizer: str, key: str = "") -> random.Random:
+        return random.Random(self.seed(randomizer, key))
+
+    def for_shard(self, shard_index: int, num_shards: int, total_frames: int) -> "SeedPlan":
+        start_frame, _ = shard_frame_range(total_frames, shard_index, num_shards)
+        return SeedPlan(self.job_seed, self.start_frame + start_frame)
+
+    def for_block(self, block: int, block_frames: int) -> "SeedPlan":
+        # Seeds of the block-th block of block_frames frames from the start frame
+        return SeedPlan(self.job_seed, self.start_frame + block * block_frames, block)
+
+    def __repr__(self) -> str:
+        return f"SeedPlan(job_seed={self.job_seed}, start_frame={self.start_frame}, block={self.block})"
+
+
+def shard_frame_range(total_frames: int, shard_index: int, num_shards: int) -> Tuple[int, int]:
+    # Split total_frames into num_shards contiguous ranges, the first ones get one extra frame if it does not divide evenly
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f"Invalid shard {shard_index} of {num_shards}")
+    base, extra = divmod(total_frames, num_shards)
+    start_frame = shard_index * base + min(shard_index, extra)
+    end_frame = start_frame + base + (1 if shard_index < extra else 0)
+    return start_frame, end_frame
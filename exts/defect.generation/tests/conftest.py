@@ -0,0 +1,50 @@
+import os
+import sys
+
+# The CPU-side modules of the extension (sampling, seed plan, job models, dataset merge) import without Kit
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def cube_snapshot():
+    from defect.generation.core.sampling.geometry import SurfaceSampler
+    from defect.generation.core.sampling.scene_snapshot import SceneSnapshot
+    # Unit cube target prim and a scatter box above it
+    vertices = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+    faces = np.array([(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+                      (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)])
+    return SceneSnapshot({"/World/Cube": SurfaceSampler(vertices, faces)},
+                         {"/World/Cube": ((0, 0, 0), (1, 1, 1)), "/World/Scatter": ((-3, 2, -3), (3, 4, 3))})
+
+
+@pytest.fixture
+def cube_job(tmp_path):
+    from defect.generation.domain.models.defect_generation_job import DefectGenerationJob
+    texture_dir = tmp_path / "textures"
+    for defect_name in ("scratch", "hole"):
+        (texture_dir / defect_name).mkdir(parents=True)
+        for index in range(3):
+            (texture_dir / defect_name / f"t{index}_D.png").touch()
+    return DefectGenerationJob.parse_obj({
+        "output_dir": str(tmp_path / "output"),
+        "frames": 24,
+        "seed": 7,
+        "defect_generation_request": {
+            "texture_dir": str(texture_dir),
+            "min_defect_separation": 0.1,
+            "prim_defects": [{"prim_path": "/World/Cube", "defects": [
+                {"defect_name": "scratch", "uuid": "s", "count": 3, "args": {"rot_x_max": 90, "dim_h_min": 0.1, "dim_h_max": 0.3}},
+                {"defect_name": "hole", "uuid": "h", "args": {"visibility_probability": 0.9}},
+            ]}],
+        },
+        "domain_randomization_request": {
+            "light_domain_randomization_params": {"active": True, "light_intensity_min_value": 100, "light_intensity_max_value": 1000,
+                                                  "light_color_min_value": [0, 0, 0], "light_color_max_value": [1, 1, 1], "light_count": 2},
+            "camera_domain_randomization_params": {"active": True, "camera_prims": [["/World/Scatter", [[0, 0, 0], [1, 1, 1]]]]},
+            "color_domain_randomization_params": {"active": True, "prim_colors": {"/World/Cube": [[1, 0, 0, 1], [0, 1, 0, 1]]}},
+            "material_domain_randomization_params": {"active": True, "material_prims": {"/World/Cube": ["a.mdl", "b.mdl"]}},
+        },
+    })
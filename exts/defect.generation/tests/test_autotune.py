@@ -0,0 +1,9 @@
+from defect.generation.core.jobs.autotune import create_settings
+
+
+def test_autotune_does_not_tune_adaptive_subframes(cube_job):
+    assert len(create_settings(cube_job, [(512, 512)], [1, 4, 16], [1, 2])) == 6
+    cube_job.rt_subframes = 4
+    cube_job.domain_randomization_request.adaptive_subframe_params.active = True
+    settings = create_settings(cube_job, [(512, 512)], [1, 4, 16], [1, 2])
+    assert [(setting.rt_subframes, setting.cameras) for setting in settings] == [(4, 1), (4, 2)]
@@ -0,0 +1,44 @@
+import numpy as np
+from defect.generation.core.replicator.camera_plan import compile_camera_plan
+from defect.generation.core.sampling.frame_plan import CameraTrack, FramePlanner
+
+
+def _bounds(x):
+    return ((x, 0.0, 0.0), (x + 1.0, 1.0, 1.0))
+
+
+def test_duplicates_within_tolerance_collapse():
+    # Reversed coordinates and a difference below the tolerance are the same viewpoint, another scatter prim is not
+    near = ((1.0, 1.0, 1.0), (0.0, 0.0, 0.0 + 1e-5))
+    plan = compile_camera_plan([("/World/A", _bounds(0.0)), ("/World/A", near), ("/World/B", _bounds(0.0)), ("/World/A", ((0, 0), (1, 1)))], {})
+    assert [camera.scatter_prim_path for camera in plan.cameras] == ["/World/A", "/World/B"]
+    assert plan.duplicate_count == 1
+    assert plan.invalid_count == 1
+
+
+def test_budget_caps_the_cameras():
+    targets = [("/World/A", _bounds(x)) for x in range(5)] + [("/World/B", _bounds(x)) for x in range(2)] + [(None, _bounds(10.0))]
+    plan = compile_camera_plan(targets, {}, max_render_products=3)
+    assert len(plan.cameras) == 3
+    # Every target of a kept scatter prim is still looked at by one of its cameras
+    assert sum(len(camera.look_at_bounds) for camera in plan.cameras) == 8
+    assert plan.over_budget_count == 0
+
+    plan = compile_camera_plan(targets, {}, max_render_products=2)
+    assert len(plan.cameras) == 2
+    assert [camera.scatter_prim_path for camera in plan.cameras] == [None, "/World/A"]
+    assert plan.over_budget_count == 2
+
+
+def test_frames_round_robin_across_the_targets():
+    targets = [("/World/A", _bounds(float(x))) for x in range(5)]
+    plan = compile_camera_plan(targets, {}, max_render_products=2)
+    assert [[bounds[0][0] for bounds in camera.look_at_bounds] for camera in plan.cameras] == [[0.0, 2.0, 4.0], [1.0, 3.0]]
+
+    # Frame i of a camera looks at its target i modulo the number of targets
+    tracks = [CameraTrack(camera.look_at_bounds, (0.5, 0.5), scatter_bounds=((-5, -5, 5), (5, 5, 6))) for camera in plan.cameras]
+    planner = FramePlanner([], {}, tracks, None, np.random.default_rng(0))
+    frames = np.tile(np.arange(6), 2)
+    camera_indices = np.repeat([0, 1], 6)
+    _, look_ats, _ = planner.sample_cameras(frames, camera_indices, np.zeros((6, 0, 3)), np.zeros((6, 0, 3)), np.zeros((6, 0), dtype=bool))
+    assert np.floor(look_ats[:, 0]).tolist() == [0, 2, 4, 0, 2, 4, 1, 3, 1, 3, 1, 3]
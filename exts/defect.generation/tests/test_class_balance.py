@@ -0,0 +1,71 @@
+import json
+import os
+import numpy as np
+from defect.generation.core.jobs.class_balance import ClassBalancer, read_texture_yields
+from defect.generation.core.sampling.frame_parameters import FRAME_PARAMETERS_FILE, FrameParameters
+
+
+def _counts(scratch, hole):
+    return {"scratch": {"boxes_in": scratch, "boxes_out": scratch}, "hole": {"boxes_in": hole, "boxes_out": hole}}
+
+
+def _probabilities(request):
+    return {defect.defect_name: defect.args.visibility_probability for prim_defect in request.prim_defects for defect in prim_defect.defects}
+
+
+def test_multipliers_move_toward_the_target_ratio(cube_job):
+    request = cube_job.defect_generation_request
+    balancer = ClassBalancer({"scratch": 1, "hole": 1})
+    balancer.update(request, _counts(10, 90), frames=10, next_frames=10)
+    assert balancer.multipliers["scratch"] > 1 > balancer.multipliers["hole"]
+    probabilities = _probabilities(balancer.apply(request))
+    assert probabilities["scratch"] > 0.5 and probabilities["hole"] < 0.9
+    # The request itself is left untouched
+    assert _probabilities(request) == {"scratch": 0.5, "hole": 0.9}
+
+    # Once the running counts match the targets, the next round keeps the ratio of the expected boxes
+    shares = balancer.shares()
+    balancer.update(request, _counts(80, 0), frames=10, next_frames=10)
+    assert abs(balancer.shares()["scratch"] - 0.5) < abs(shares["scratch"] - 0.5)
+
+
+def test_multipliers_respect_the_bounds(cube_job):
+    request = cube_job.defect_generation_request
+    balancer = ClassBalancer({"scratch": 1, "hole": 1}, gain=1.0, min_multiplier=0.5, max_probability=0.8)
+    for _ in range(3):
+        balancer.update(request, _counts(1, 1000), frames=10, next_frames=10)
+        assert min(balancer.multipliers.values()) >= 0.5
+        assert max(_probabilities(balancer.apply(request)).values()) <= 0.8
+    # The scratch probability is capped, the hole multiplier is lowered instead, down to its minimum
+    assert _probabilities(balancer.apply(request))["scratch"] == 0.8
+    assert balancer.multipliers["hole"] == 0.5
+
+
+def _write_output(output_dir, class_boxes):
+    # Frame parameter log of one scratch defect showing texture index frame % 2, and the boxes the writer kept per frame
+    frames = len(class_boxes)
+    FrameParameters({
+        "frame": np.arange(frames),
+        "defect_shown": np.ones((frames, 1), dtype=bool),
+        "defect_texture": (np.arange(frames) % 2).reshape(-1, 1),
+    }, {"defect_uuids": ["s"], "defect_names": ["scratch"], "textures": {"scratch": ["a.png", "b.png"]}}).save(os.path.join(output_dir, FRAME_PARAMETERS_FILE))
+    labels_dir = os.path.join(output_dir, "labels", "json")
+    os.makedirs(labels_dir)
+    for frame_id, boxes in enumerate(class_boxes):
+        with open(os.path.join(labels_dir, f"{frame_id}.json"), 'w') as file:
+            json.dump([{"ObjectClassName": "scratch"}] * boxes, file)
+
+
+def test_texture_weights_stay_above_the_minimum(cube_job, tmp_path):
+    # Texture a always survives the writer filters, texture b never does
+    _write_output(str(tmp_path), [1, 0] * 10)
+    yields = read_texture_yields([str(tmp_path)], {"s": "scratch", "h": "hole"})
+    assert yields == {"scratch": {"a.png": (10.0, 10), "b.png": (0.0, 10)}}
+
+    request = cube_job.defect_generation_request
+    balancer = ClassBalancer({"scratch": 1, "hole": 1}, texture_prior=1.0, min_texture_weight=0.2)
+    balancer.update(request, _counts(10, 90), frames=20, next_frames=20, texture_yields=yields)
+    weights = balancer.texture_weights["scratch"]
+    assert weights["a.png"] > 1
+    assert weights["b.png"] == 0.2
+    assert balancer.apply(request).texture_weights["scratch"] == weights
@@ -0,0 +1,49 @@
+import json
+import os
+import numpy as np
+from defect.generation.core.jobs.dataset_merge import CLASS_MAP_FILE, merge_datasets
+from defect.generation.core.sampling.frame_parameters import FRAME_PARAMETERS_FILE, FrameParameters
+
+
+def _write_shard(shard_dir, frame_ids, written_ids, class_name):
+    # BMWWriter output of a shard: images and segmentation of the written frames, and the parameters of all frames
+    for kind in ("images", "semantic_segmentation"):
+        os.makedirs(os.path.join(shard_dir, kind), exist_ok=True)
+    for frame_id in written_ids:
+        with open(os.path.join(shard_dir, "images", f"{frame_id}.png"), 'w') as file:
+            file.write(f"{shard_dir}:{frame_id}")
+        np.save(os.path.join(shard_dir, "semantic_segmentation", f"{frame_id}.npy"), np.array([[0, 1]], dtype=np.uint32))
+        with open(os.path.join(shard_dir, "semantic_segmentation", f"{frame_id}.json"), 'w') as file:
+            json.dump({"0": {"class": "background"}, "1": {"class": class_name}}, file)
+    FrameParameters({"frame": np.array(frame_ids), "value": np.array(frame_ids) * 10}, {}).save(os.path.join(shard_dir, FRAME_PARAMETERS_FILE))
+
+
+def test_merge_remaps_frames_and_classes(tmp_path):
+    _write_shard(str(tmp_path / "shard_0"), [0, 1, 2], [0, 2], "scratch")
+    _write_shard(str(tmp_path / "shard_1"), [3, 4, 5], [4], "hole")
+    output_dir = str(tmp_path / "merged")
+    shard_dirs = [str(tmp_path / "shard_0"), str(tmp_path / "shard_1")]
+
+    class_map = merge_datasets(shard_dirs, output_dir)
+    assert class_map == {"background": 0, "scratch": 1, "hole": 2}
+    assert sorted(os.listdir(os.path.join(output_dir, "images"))) == ["0.png", "1.png", "2.png"]
+    assert np.load(os.path.join(output_dir, "semantic_segmentation", "2.npy")).tolist() == [[0, 2]]
+    parameters = FrameParameters.load(os.path.join(output_dir, FRAME_PARAMETERS_FILE))
+    assert parameters.frame_ids == [0, 1, 2]
+    assert parameters.columns["value"].tolist() == [0, 20, 40]
+
+
+def test_merge_again_replaces_the_dataset(tmp_path):
+    output_dir = str(tmp_path / "merged")
+    _write_shard(str(tmp_path / "shard_0"), [0, 1, 2], [0, 1, 2], "scratch")
+    merge_datasets([str(tmp_path / "shard_0")], output_dir)
+    with open(os.path.join(output_dir, "notes.txt"), 'w') as file:
+        file.write("kept")
+
+    _write_shard(str(tmp_path / "shard_1"), [0, 1], [1], "hole")
+    merge_datasets([str(tmp_path / "shard_1")], output_dir)
+    assert os.listdir(os.path.join(output_dir, "images")) == ["0.png"]
+    with open(os.path.join(output_dir, CLASS_MAP_FILE)) as file:
+        assert json.load(file) == {"background": 0, "hole": 1}
+    assert os.path.exists(os.path.join(output_dir, "notes.txt"))
+    assert [name for name in os.listdir(tmp_path) if ".merge_" in name] == []
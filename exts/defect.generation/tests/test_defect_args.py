@@ -0,0 +1,48 @@
+import pytest
+from pydantic import ValidationError
+from defect.generation.domain.models.defect_args import DEFECT_ARGS_VERSION, DefectArgs, HoleArgs, ScratchArgs, parse_defect_args
+from defect.generation.domain.models.defect_generation_request import DefectGenerationRequest, DefectObject
+
+
+def test_args_use_the_schema_of_their_defect_type():
+    args = parse_defect_args("scratch", {"dim_w_max": 0.5})
+    assert isinstance(args, ScratchArgs) and args.semantic_label == "scratch" and args.dim_w_max == 0.5
+    assert args.schema_version == DEFECT_ARGS_VERSION
+    # Custom defect types keep their extra values
+    custom = parse_defect_args("dent", {"depth": 2})
+    assert type(custom) is DefectArgs and custom.depth == 2
+
+
+def test_unversioned_args_are_parsed_as_the_first_version():
+    assert parse_defect_args("crack", {"rot_x_max": 90}).rot_x_max == 90
+    with pytest.raises(ValueError):
+        parse_defect_args("crack", {"schema_version": DEFECT_ARGS_VERSION + 1})
+
+
+def test_ranges_are_validated():
+    with pytest.raises(ValidationError):
+        parse_defect_args("scratch", {"rot_z_min": 90, "rot_z_max": 10})
+    with pytest.raises(ValidationError):
+        parse_defect_args("scratch", {"dim_h_min": -1})
+    with pytest.raises(ValidationError):
+        parse_defect_args("scratch", {"visibility_probability": 1.5})
+
+
+def test_holes_are_round():
+    args = parse_defect_args("hole", {"dim_w_min": 0.2, "dim_w_max": 0.4})
+    assert isinstance(args, HoleArgs) and (args.dim_h_min, args.dim_h_max) == (0.2, 0.4)
+    with pytest.raises(ValidationError):
+        parse_defect_args("hole", {"dim_w_min": 0.2, "dim_w_max": 0.4, "dim_h_max": 0.3})
+
+
+def test_version_1_count_moves_to_the_defect():
+    args = {"schema_version": 1, "count": 4, "rot_x_max": 90}
+    defect = DefectObject.parse_obj({"defect_name": "crack", "uuid": "c", "args": args})
+    assert defect.count == 4 and not hasattr(defect.args, "count") and defect.args.schema_version == DEFECT_ARGS_VERSION
+    # The count of the defect wins over the one of its args
+    assert DefectObject.parse_obj({"defect_name": "crack", "uuid": "c", "count": 2, "args": args}).count == 2
+    # Args validated once for the whole request keep the counts of their defects
+    request = DefectGenerationRequest.parse_obj({"texture_dir": "", "prim_defects": [{"prim_path": "/World/Cube", "defects": [
+        {"defect_name": "crack", "uuid": "a", "args": args}, {"defect_name": "crack", "uuid": "b", "args": {**args, "count": 2}}]}]})
+    assert [defect.count for defect in request.prim_defects[0].defects] == [4, 2]
+    assert "count" not in parse_defect_args("crack", args).dict()
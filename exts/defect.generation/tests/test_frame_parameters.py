@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from defect.generation.core.sampling.dry_run import DryRun
+from defect.generation.core.sampling.frame_parameters import FrameParameters, check_replay, list_defect_textures
+
+
+@pytest.fixture
+def recorded(cube_job, cube_snapshot, tmp_path):
+    # Frame parameters of the cube job, saved and loaded like a replay log
+    dry_run = DryRun(cube_job, cube_snapshot)
+    dry_run.run()
+    plan_block, _ = dry_run._create_block_planner()
+    path = str(tmp_path / "frame_parameters.npz")
+    dry_run._sample_frame_parameters(plan_block).save(path)
+    return FrameParameters.load(path)
+
+
+def _replay_args(job, frame_parameters):
+    request = job.defect_generation_request
+    randomization = job.domain_randomization_request
+    return dict(defect_uuids=[defect.uuid for prim_defect in request.prim_defects for defect in prim_defect.iter_defects()],
+                textures=list_defect_textures(request.texture_dir, [defect.defect_name for prim_defect in request.prim_defects for defect in prim_defect.defects]),
+                camera_count=frame_parameters.columns["camera_position"].shape[1],
+                prim_colors=randomization.color_domain_randomization_params.prim_colors,
+                material_options=frame_parameters.tables["material_options"])
+
+
+def test_select_and_frame_range(recorded):
+    assert recorded.select([5, 2]).frame_ids == [5, 2]
+    assert recorded.frame_range(20, 10).frame_ids == [20, 21, 22, 23]
+    np.testing.assert_array_equal(recorded.select([3]).columns["defect_position"][0], recorded.columns["defect_position"][3])
+    with pytest.raises(ValueError):
+        recorded.select([100])
+
+
+def test_replay_of_the_recording_request(cube_job, recorded):
+    check_replay(recorded, **_replay_args(cube_job, recorded))
+
+
+def test_replay_rejects_other_colors_and_materials(cube_job, recorded):
+    args = _replay_args(cube_job, recorded)
+    with pytest.raises(ValueError, match="color choices"):
+        check_replay(recorded, **{**args, "prim_colors": {**args["prim_colors"], "/World/Other": [[0, 0, 0, 1]]}})
+    with pytest.raises(ValueError, match="choose color"):
+        check_replay(recorded, **{**args, "prim_colors": {"/World/Cube": [[1, 0, 0, 1]]}})
+    with pytest.raises(ValueError, match="materials"):
+        check_replay(recorded, **{**args, "material_options": {"/World/Cube": ["a.mdl"]}})
+    with pytest.raises(ValueError, match="cameras"):
+        check_replay(recorded, **{**args, "camera_count": 3})
@@ -0,0 +1,19 @@
+from defect.generation.core.sampling.dry_run import DryRun
+from defect.generation.domain.models.domain_randomization_request import VisibilityPrecheckParameters
+
+
+def test_targeting_stats_count_the_planned_poses(cube_job, cube_snapshot):
+    camera_params = cube_job.domain_randomization_request.camera_domain_randomization_params
+    camera_params.defect_targeting.active = True
+    camera_params.defect_targeting.context_fraction = 0.5
+    # Rarely shown defects and many resamples, every attempt used to be counted as a shot
+    for prim_defect in cube_job.defect_generation_request.prim_defects:
+        for defect in prim_defect.defects:
+            defect.args.visibility_probability = 0.1
+    cube_job.domain_randomization_request.visibility_precheck_params = VisibilityPrecheckParameters(
+        active=True, max_camera_attempts=8, max_defect_attempts=4)
+    _, stats = DryRun(cube_job, cube_snapshot).run()
+    frame_plan = stats["frame_plan"]
+    assert frame_plan["camera_resamples"] > 0
+    assert frame_plan["targeted_shots"] + frame_plan["context_shots"] == frame_plan["frames_planned"] * frame_plan["cameras"]
+    assert frame_plan["targeted_shots"] > 0 and frame_plan["context_shots"] > 0
@@ -0,0 +1,24 @@
+from defect.generation.core.jobs.job_files import load_job, pack_job, unpack_job
+from defect.generation.domain.models.defect_args import HoleArgs, ScratchArgs
+
+
+def test_pack_round_trip(cube_job):
+    job = unpack_job(pack_job(cube_job))
+    assert job.dict() == cube_job.dict()
+    defects = job.defect_generation_request.prim_defects[0].defects
+    assert [type(defect.args) for defect in defects] == [ScratchArgs, HoleArgs]
+    assert [defect.count for defect in defects] == [3, 1]
+
+
+def test_load_job_from_the_cache(cube_job, tmp_path):
+    job_file = tmp_path / "job.json"
+    job_file.write_text(cube_job.json())
+    cache_dir = tmp_path / "cache"
+    validated = load_job(str(job_file), str(cache_dir))
+    assert [path.suffix for path in cache_dir.iterdir()] == [".json"]
+    cached = load_job(str(job_file), str(cache_dir))
+    assert cached.dict() == validated.dict() == cube_job.dict()
+    # Another job file content is validated and cached on its own
+    job_file.write_text(cube_job.copy(update={"frames": 12}).json())
+    assert load_job(str(job_file), str(cache_dir)).frames == 12
+    assert len(list(cache_dir.iterdir())) == 2
@@ -0,0 +1,92 @@
+import os
+from defect.generation.core.jobs.sharding import ShardedJobRunner
+from defect.generation.core.replicator.layer_key import base_stage_fingerprint, defect_layer_key, is_saved_stage
+
+PRIMVARS = ("primvars:d1_position", "primvars:v3_scale")
+
+
+class _Layer:
+    # The attributes of a Sdf.Layer the keys use
+    def __init__(self, path: str = None, display_name: str = None, anonymous: bool = False) -> None:
+        self.identifier = path or f"anon:{display_name}"
+        self.realPath = path
+        self.anonymous = anonymous
+        self.dirty = False
+        self.display_name = display_name or os.path.basename(path)
+
+    def GetDisplayName(self) -> str:
+        return self.display_name
+
+
+class _Stage:
+    # The attributes of a Usd.Stage the keys use
+    def __init__(self, layers, session_layers=()) -> None:
+        self.layers = list(layers)
+        self.session_layers = list(session_layers)
+
+    def GetRootLayer(self) -> _Layer:
+        return self.layers[0]
+
+    def GetLayerStack(self, includeSessionLayers: bool = True):
+        return (self.session_layers if includeSessionLayers else []) + self.layers
+
+    def GetUsedLayers(self, includeClipLayers: bool = True):
+        return self.session_layers + self.layers
+
+
+def _stage(tmp_path):
+    paths = [tmp_path / "scene.usd", tmp_path / "part.usd"]
+    for path in paths:
+        path.write_text("#usda 1.0\n")
+    return _Stage([_Layer(str(path)) for path in paths], [_Layer(display_name="session", anonymous=True)])
+
+
+def _key(job, stage, **job_args):
+    job_args = {"seed": job.seed, "job_start_frame": job.start_frame, "job_frames": job.frames, **job_args}
+    return defect_layer_key(job.defect_generation_request, job.domain_randomization_request, stage, **job_args)
+
+
+def test_the_shards_of_a_job_share_the_layer_key(cube_job, tmp_path):
+    stage = _stage(tmp_path)
+    runner = ShardedJobRunner(cube_job, 3, str(tmp_path / "work"), [])
+    keys = {defect_layer_key(shard.job.defect_generation_request, shard.job.domain_randomization_request, stage,
+                             seed=shard.job.seed, job_start_frame=shard.job.job_start_frame, job_frames=shard.job.job_frames)
+            for shard in runner.prepare()}
+    assert keys == {_key(cube_job, stage)}
+
+    # Another seed, job range, request or root layer is another layer
+    assert _key(cube_job, stage, seed=8) != _key(cube_job, stage)
+    assert _key(cube_job, stage, job_start_frame=24) != _key(cube_job, stage)
+    assert _key(cube_job, stage, job_frames=48) != _key(cube_job, stage)
+    other_job = cube_job.copy(deep=True)
+    other_job.defect_generation_request.prim_defects[0].defects[0].count = 4
+    assert _key(other_job, stage) != _key(cube_job, stage)
+    assert _key(cube_job, _Stage(stage.layers[::-1])) != _key(cube_job, stage)
+
+
+def test_the_base_stage_fingerprint_follows_the_layer_files(tmp_path):
+    stage = _stage(tmp_path)
+    fingerprint = base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS)
+    assert is_saved_stage(stage)
+    # The session layers and the Defect layer are not part of the base stage
+    stage.layers.append(_Layer(display_name="Defect", anonymous=True))
+    assert base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS) == fingerprint
+    assert is_saved_stage(stage)
+
+    # Other defect prims or primvars
+    assert base_stage_fingerprint(stage, ["/World/Cube", "/World/Sphere"], PRIMVARS) != fingerprint
+    assert base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS[:1]) != fingerprint
+
+    # A layer file saved again, with another size or only another modification time
+    part = tmp_path / "part.usd"
+    stat = os.stat(part)
+    os.utime(part, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    touched = base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS)
+    assert touched != fingerprint
+    part.write_text("#usda 1.0\ndef Xform \"World\" {}\n")
+    assert base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS) not in (fingerprint, touched)
+
+    # An unsaved layer has no fingerprint
+    stage.layers.append(_Layer(display_name="edits", anonymous=True))
+    assert base_stage_fingerprint(stage, ["/World/Cube"], PRIMVARS) is None
+    assert not is_saved_stage(stage)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from defect.generation.core.sampling.low_discrepancy import SOBOL_MAX_DIMENSIONS, create_sampler, pair_coverage, sobol_direction_numbers
+
+
+def test_sobol_streams_are_independent():
+    # 4 defects x 6 dimensions exceed the direction number table, the same dimension of two defects must not be a
+    # function of the other
+    points = create_sampler("sobol", np.random.default_rng(0)).random_streams(256, 4, 6).reshape(256, -1)
+    uniform = pair_coverage(np.random.default_rng(1).random((256, 2)), 16)
+    for first, second in [(0, 18), (0, 6), (5, 23)]:
+        assert pair_coverage(points[:, [first, second]], 16) > 0.9 * uniform
+        assert abs(np.corrcoef(points[:, first], points[:, second])[0, 1]) < 0.25
+
+
+def test_sobol_stream_is_balanced():
+    points = create_sampler("sobol", np.random.default_rng(0)).random_streams(256, 3, 6)
+    for stream in range(3):
+        for dimension in range(6):
+            # One point per 1/256 interval of every dimension
+            assert len(np.unique((points[:, stream, dimension] * 256).astype(int))) == 256
+
+
+def test_sobol_rejects_dimensions_past_the_table():
+    with pytest.raises(ValueError):
+        sobol_direction_numbers(SOBOL_MAX_DIMENSIONS)
+    with pytest.raises(ValueError):
+        create_sampler("sobol", np.random.default_rng(0)).random(8, SOBOL_MAX_DIMENSIONS + 1)
+
+
+@pytest.mark.parametrize("method", ["uniform", "sobol", "latin_hypercube"])
+def test_uniform_ranges(method):
+    low = np.zeros((64, 5, 6))
+    high = np.arange(1, 7, dtype=np.float64) * np.ones((64, 5, 6))
+    values = create_sampler(method, np.random.default_rng(0)).uniform(low, high)
+    assert values.shape == (64, 5, 6)
+    assert (values >= low).all() and (values <= high).all()
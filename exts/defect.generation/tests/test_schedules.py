@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from defect.generation.core.sampling.schedules import FrameSchedule
+from defect.generation.domain.models.domain_randomization_request import ParameterSchedule
+
+
+def _schedule(keyframes, **kwargs):
+    return ParameterSchedule(keyframes=[{"frame": frame, "values": values} for frame, values in keyframes], **kwargs)
+
+
+def test_step_schedule_holds_the_keyframe_values():
+    schedule = FrameSchedule([_schedule([(2, {"dim_w_max": 0.5}), (5, {"dim_w_max": 0.8})])])
+    values = schedule.values("dim_w_max", range(7), 1.0)
+    # The base value of the request before the first keyframe, the last keyframe value after it
+    assert values.tolist() == [1.0, 1.0, 0.5, 0.5, 0.5, 0.8, 0.8]
+    assert schedule.values("dim_h_max", range(7), 1.0) is None
+
+
+def test_linear_schedule_interpolates_between_keyframes():
+    schedule = FrameSchedule([_schedule([(0, {"light_color_min_value": [0, 0, 0]}), (4, {"light_color_min_value": [1, 0.5, 0]})],
+                                        interpolation="linear")])
+    values = schedule.values("light_color_min_value", range(6), [0.2, 0.2, 0.2])
+    assert values.shape == (6, 3)
+    np.testing.assert_allclose(values[:, 0], [0, 0.25, 0.5, 0.75, 1, 1])
+    np.testing.assert_allclose(values[2], [0.5, 0.25, 0])
+
+
+def test_schedule_frames_are_relative_to_the_job_start():
+    # A shard starting at frame 10 of the job sees the values of frames 10 and on
+    schedule = FrameSchedule([_schedule([(0, {"visibility_probability": 0.0}), (20, {"visibility_probability": 1.0})],
+                                        interpolation="linear")], start_frame=10)
+    np.testing.assert_allclose(schedule.values("visibility_probability", [0, 5], 0.5), [0.5, 0.75])
+
+
+def test_later_schedules_and_defect_names():
+    schedule = FrameSchedule([_schedule([(0, {"rot_x_max": 10})]),
+                              _schedule([(0, {"rot_x_max": 20})], defect_names=["hole"])])
+    assert schedule.values("rot_x_max", [0], 360, "hole").tolist() == [20]
+    assert schedule.values("rot_x_max", [0], 360, "scratch").tolist() == [10]
+
+
+def test_unknown_interpolation():
+    with pytest.raises(ValueError):
+        FrameSchedule([_schedule([(0, {"rot_x_max": 10})], interpolation="cubic")])
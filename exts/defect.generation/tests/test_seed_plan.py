@@ -0,0 +1,87 @@
+import sys
+import numpy as np
+import pytest
+from defect.generation.core.jobs.sharding import ShardedJobRunner
+from defect.generation.core.sampling.dry_run import DryRun
+from defect.generation.core.sampling.frame_parameters import FrameParameters
+from defect.generation.domain.models.domain_randomization_request import VisibilityPrecheckParameters
+from defect.generation.utils.seed_plan import SeedPlan, shard_frame_range
+
+
+def test_seeds_do_not_depend_on_the_shard():
+    seed_plan = SeedPlan(11)
+    shard = seed_plan.for_shard(2, 3, 30)
+    assert shard.start_frame == 20
+    assert shard.seed("move_defect.rotation", "abc") == seed_plan.seed("move_defect.rotation", "abc")
+    assert seed_plan.seed("move_defect.rotation", "abc") != seed_plan.seed("move_defect.rotation", "abd")
+    # The first block of frames keeps the seeds of the job, the other blocks draw from their own
+    block = seed_plan.for_block(2, 8)
+    assert block.start_frame == 16
+    assert seed_plan.for_block(0, 8).seed("change_light") == seed_plan.seed("change_light") != block.seed("change_light")
+
+
+def test_shard_frame_ranges_cover_the_job():
+    ranges = [shard_frame_range(10, index, 3) for index in range(3)]
+    assert ranges == [(0, 4), (4, 7), (7, 10)]
+    with pytest.raises(ValueError):
+        shard_frame_range(10, 3, 3)
+
+
+def _shard_columns(job, num_shards, tmp_path, snapshot, max_shard_frames=None):
+    # Frames rendered by the shards of the job, concatenated in frame order
+    runner = ShardedJobRunner(job, num_shards, str(tmp_path / f"shards_{num_shards}_{max_shard_frames}"), ["true"], max_shard_frames=max_shard_frames)
+    parts = []
+    for shard in runner.prepare():
+        columns, _ = DryRun(shard.job, snapshot).run()
+        columns.pop("defect_uuid")
+        parts.append(FrameParameters(columns, {}).frame_range(shard.job.start_frame, shard.job.frames))
+    return FrameParameters.concatenate(parts).columns
+
+
+@pytest.mark.parametrize("sampling_method", ["uniform", "sobol", "latin_hypercube"])
+def test_frames_do_not_depend_on_the_shard_count(cube_job, cube_snapshot, tmp_path, sampling_method):
+    cube_job.domain_randomization_request.sampling_method = sampling_method
+    single = _shard_columns(cube_job, 1, tmp_path, cube_snapshot)
+    for num_shards in (2, 5):
+        sharded = _shard_columns(cube_job, num_shards, tmp_path, cube_snapshot)
+        assert sharded.keys() == single.keys()
+        for name, column in single.items():
+            np.testing.assert_array_equal(sharded[name], column, err_msg=name)
+
+
+
+@pytest.mark.parametrize("sampling_method", ["uniform", "sobol"])
+@pytest.mark.parametrize("skip_rejected", [False, True])
+def test_shards_only_sample_the_blocks_of_their_frames(cube_job, cube_snapshot, tmp_path, sampling_method, skip_rejected):
+    randomization = cube_job.domain_randomization_request
+    randomization.sampling_method = sampling_method
+    randomization.sampling_block_frames = 8
+    randomization.visibility_precheck_params = VisibilityPrecheckParameters(active=True, max_camera_attempts=1, max_defect_attempts=1,
+                                                                            skip_rejected_frames=skip_rejected)
+    # Rarely shown defects, so that frames are skipped and the frame ids of the shards have gaps
+    for prim_defect in cube_job.defect_generation_request.prim_defects:
+        for defect in prim_defect.defects:
+            defect.args.visibility_probability = 0.1
+    single = _shard_columns(cube_job, 1, tmp_path, cube_snapshot)
+    sharded = _shard_columns(cube_job, 2, tmp_path, cube_snapshot)
+    assert len(single["frame"]) < 24 if skip_rejected else single["frame"].tolist() == list(range(24))
+    for name, column in single.items():
+        np.testing.assert_array_equal(sharded[name], column, err_msg=name)
+
+    # Every shard of 12 frames samples the 2 blocks of 8 frames holding its frames, not the 24 frames of the job
+    runner = ShardedJobRunner(cube_job, 2, str(tmp_path / "blocks"), ["true"])
+    for shard in runner.prepare():
+        _, stats = DryRun(shard.job, cube_snapshot).run()
+        assert stats["frame_plan"]["frames_sampled"] == 16
+        assert stats["frame_plan"]["frames_planned"] + stats["frame_plan"]["frames_skipped"] == 16
+
+def test_large_jobs_are_split_into_bounded_shards(cube_job, cube_snapshot, tmp_path):
+    single = _shard_columns(cube_job, 1, tmp_path, cube_snapshot)
+    bounded = _shard_columns(cube_job, 2, tmp_path, cube_snapshot, max_shard_frames=5)
+    for name, column in single.items():
+        np.testing.assert_array_equal(bounded[name], column, err_msg=name)
+
+    runner = ShardedJobRunner(cube_job, 2, str(tmp_path / "run"), [sys.executable, "-c", "pass"], poll_interval=0.01, max_shard_frames=5)
+    results = runner.run(merge=False)
+    assert len(results) == 5 and all(code == 0 for code in results.values())
+    assert max(shard.job.frames for shard in runner.shards) <= 5
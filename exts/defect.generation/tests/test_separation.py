@@ -0,0 +1,43 @@
+import numpy as np
+from defect.generation.core.sampling.frame_plan import DefectPlacer, DefectTrack
+from defect.generation.core.sampling.geometry import SurfaceSampler
+from defect.generation.core.sampling.separation import find_close_pairs, reject_close_points
+
+
+def test_close_points_are_rejected_by_priority():
+    points = np.array([[0, 0, 0], [0.05, 0, 0], [1, 0, 0], [0.05, 0, 0]], dtype=np.float64)
+    batches = np.array([0, 0, 0, 1])
+    # Only points of the same batch conflict
+    assert find_close_pairs(points, batches, 0.1).tolist() == [[0, 1]]
+    assert reject_close_points(points, batches, 0.1, np.array([1, 0, 2, 0])).tolist() == [True, False, False, False]
+    assert reject_close_points(points, batches, 0.1, np.array([0, 1, 2, 0])).tolist() == [False, True, False, False]
+
+    # A point close to two others is rejected instead of both of them when its priority is the highest
+    chain = np.array([[0, 0, 0], [0.06, 0, 0], [0.12, 0, 0]], dtype=np.float64)
+    assert reject_close_points(chain, np.zeros(3), 0.1, np.array([0, 5, 1])).tolist() == [False, True, False]
+
+
+def _placer(size, min_separation, max_separation_attempts):
+    # Three always shown defects on a square of the given size
+    surface = SurfaceSampler(np.array([[0, 0, 0], [size, 0, 0], [size, size, 0], [0, size, 0]], dtype=np.float64), np.array([[0, 1, 2], [0, 2, 3]]))
+    defects = [DefectTrack(str(index), "/World/Cube", ((0, 0, 0), (0, 0, 0)), ((1, 1, 1), (1, 1, 1)), visibility_probability=1.0) for index in range(3)]
+    return DefectPlacer(defects, {"/World/Cube": surface}, np.random.default_rng(3), min_separation=min_separation,
+                        max_separation_attempts=max_separation_attempts)
+
+
+def test_separated_defects_stay_shown():
+    placer = _placer(10.0, 0.5, 10)
+    positions, _, _, _, shown = placer.sample(np.arange(20))
+    assert shown.all()
+    assert placer.separation_hidden == 0
+    rows, columns = np.nonzero(shown)
+    assert len(find_close_pairs(positions[rows, columns], rows, 0.5)) == 0
+
+
+def test_defects_in_conflict_after_the_attempts_are_hidden():
+    # No two defects fit on the surface, the first one is kept and the others are hidden after their resamples
+    placer = _placer(0.01, 1.0, 4)
+    _, _, _, _, shown = placer.sample(np.arange(5))
+    assert shown.tolist() == [[True, False, False]] * 5
+    assert placer.separation_resamples == 5 * 2 * 4
+    assert placer.separation_hidden == 5 * 2
@@ -0,0 +1,23 @@
+import numpy as np
+from defect.generation.core.sampling.frame_parameters import FrameParameters
+from defect.generation.core.sampling.subframes import plan_subframes
+from defect.generation.domain.models.domain_randomization_request import AdaptiveSubframeParameters
+
+
+def _frames(**columns):
+    return FrameParameters({"frame": np.arange(len(next(iter(columns.values())))), **columns}, {})
+
+
+def test_subframes_follow_the_costliest_change():
+    params = AdaptiveSubframeParameters(min_subframes=2, max_subframes=32, active=True)
+    frame_parameters = _frames(light_intensity=np.array([[0.0], [0.0], [1.0], [0.5]]),
+                               defect_position=np.array([[[0, 0, 0]], [[1, 1, 1]], [[1, 1, 1]], [[0, 0, 0]]], dtype=np.float64))
+    # The first frame settles the scene, a full light change needs the light cost, a defect move the minimum
+    assert plan_subframes(frame_parameters, params).tolist() == [32, 2, 32, 16]
+
+
+def test_subframes_stay_within_bounds():
+    params = AdaptiveSubframeParameters(min_subframes=4, max_subframes=8, randomizer_costs={"color": 100}, active=True)
+    frame_parameters = _frames(color_choice=np.array([[0, 0], [0, 1], [1, 1], [1, 1]]))
+    assert plan_subframes(frame_parameters, params).tolist() == [8, 8, 8, 4]
+
@@ -0,0 +1,38 @@
+import json
+from defect.generation.core.writer.yield_stats import YieldStats
+
+
+def _writer_stats(render_product, frames, boxes):
+    # Stats of a writer that rendered the given frames, every frame with the (class, boxes in, boxes out) of boxes
+    stats = YieldStats()
+    for visible_defects in frames:
+        stats.record_frame(render_product, written=visible_defects > 0, visible_defects=visible_defects)
+        for label, boxes_in, boxes_out in boxes:
+            stats.record_boxes(render_product, boxes_in, boxes_in - boxes_out, 0)
+            stats.record_class_boxes(render_product, label, boxes_in, boxes_out)
+    return stats
+
+
+def test_reports_merge_by_render_product(tmp_path):
+    first = _writer_stats("rp_0", [0, 2, 1], [("scratch", 2, 1)])
+    second = _writer_stats("rp_0", [3], [("scratch", 1, 1), ("hole", 2, 0)])
+    third = _writer_stats("rp_1", [1, 1], [("hole", 1, 1)])
+    third.record_boxes("rp_1", 3, 0, 3)
+    merged = YieldStats.from_reports([stats.summary() for stats in (first, second, third)])
+
+    assert merged.render_products["rp_0"]["frames_rendered"] == 4
+    assert merged.render_products["rp_0"]["frames_written"] == 3
+    assert merged.render_products["rp_0"]["frames_without_defect"] == 1
+    assert merged.visible_defects["rp_0"] == {0: 1, 1: 1, 2: 1, 3: 1}
+    totals = merged.totals()
+    assert (totals["frames_rendered"], totals["frames_written"], totals["frames_without_defect"]) == (6, 5, 1)
+    # Boxes in and out, and the boxes dropped by each filter
+    assert (totals["boxes_in"], totals["boxes_out"]) == (14, 6)
+    assert (totals["boxes_dropped_area"], totals["boxes_dropped_sentinel"]) == (5, 3)
+    assert merged.class_totals() == {"scratch": {"boxes_in": 7, "boxes_out": 4}, "hole": {"boxes_in": 4, "boxes_out": 2}}
+
+    # A written report reads back the same
+    path = str(tmp_path / "yield_report.json")
+    merged.write_report(path)
+    with open(path, 'r') as file:
+        assert YieldStats.from_reports([json.load(file)]).summary() == merged.summary()